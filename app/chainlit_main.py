@@ -2,10 +2,14 @@ import logging
 
 import chainlit as cl
 from chainlit import on_chat_start
+
+from app.metrics import start_metrics_server
 from consts import PRESENTATION
 from models import Answer
 from state import chat_bot
 
+start_metrics_server()
+
 
 @on_chat_start
 async def chat_start():
@@ -16,5 +20,6 @@ async def chat_start():
 @cl.on_message
 async def on_message(question: str):
     logging.info(f'Question received from user: "{question}"')
-    answer: Answer = chat_bot.chat(question=question)
+    # The chat runs in a thread, so that the identical questions of the users are coalesced
+    answer: Answer = await cl.make_async(chat_bot.chat)(question=question)
     await cl.Message(content=answer.answer).send()
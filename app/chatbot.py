@@ -1,36 +1,100 @@
+import json
 import logging
-from typing import Optional
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
 
-import torch
 from langchain import PromptTemplate
 from langchain.chains.question_answering import load_qa_chain
 from langchain.embeddings import HuggingFaceEmbeddings
+from langchain.embeddings.base import Embeddings
 from langchain.llms import Databricks, HuggingFacePipeline
+from langchain.llms.base import LLM
 from langchain.vectorstores import Chroma
-from transformers import pipeline
 
-from app.config import CHROMA_SETTINGS, ExecutionContext, config
+from app.coalescing import SingleFlight, normalize_question
+from app.config import (
+    ExecutionContext,
+    RetrievalMode,
+    VectorPrecision,
+    config,
+    get_chroma_settings,
+)
 from app.consts import PROMPT_FORMAT
 from app.databricks_utils.manager import DatabricksManager
+from app.generation.assisted import DraftModel
+from app.generation.controls import GenerationControls, truncate_at_stop
+from app.generation.prefix_cache import PROMPT_PREFIX, PrefixCachedLLM
+from app.generation.profiles import InferenceProfile, load_instruct_pipeline
+from app.generation.routing import LARGE, SMALL, QuestionRouter
+from app.metrics import (
+    QUEUE_DEPTH,
+    ROUTED_QUESTIONS,
+    SlowRequestProfiler,
+    record_generation,
+    stage,
+)
 from app.models import Answer
+from app.precomputed import PrecomputedAnswers, directory_fingerprint
+from app.retrieval.artifact import IndexArtifact, current_version
+from app.retrieval.base import ChromaIndex, ScoredDocuments, VectorIndex
+from app.retrieval.encoder import QueryEncoder
+from app.retrieval.hot_swap import IndexGeneration, IndexHolder, IndexWatcher
+from app.retrieval.hybrid import HybridRetriever
+from app.retrieval.lexical import LexicalIndex
+from app.retrieval.quantization import QuantizedIndex
+from app.retrieval.shards import (
+    QueryRouter,
+    ShardedIndex,
+    existing_shards,
+    shard_directory,
+)
 
 
 class ChatBot:
     def __init__(
-        self, execution_context: ExecutionContext = ExecutionContext.LOCAL
+        self,
+        execution_context: ExecutionContext = ExecutionContext.LOCAL,
+        embeddings: Optional[Embeddings] = None,
+        llm: Optional[LLM] = None,
+        small_llm: Optional[LLM] = None,
     ) -> None:
         self.execution_context = execution_context
+        self.single_flight: SingleFlight[Answer] = SingleFlight(name="chat")
+        self.precomputed_answers: Optional[PrecomputedAnswers] = None
+        self.questions_log_lock = threading.Lock()
+        self.index_holder: Optional[IndexHolder] = None
+        self.index_watcher: Optional[IndexWatcher] = None
         if self.execution_context.value == ExecutionContext.LOCAL.value:
             logging.info(
                 "Downloading and loading the QA chain, this may take a long time..."
             )
-            embeddings = HuggingFaceEmbeddings(model_name=config.PREPARATION_MODEL_NAME)
-
-            self.db = Chroma(
-                persist_directory=config.PERSIST_DIRECTORY,
-                embedding_function=embeddings,
-                client_settings=CHROMA_SETTINGS,
+            self.embeddings = embeddings or HuggingFaceEmbeddings(
+                model_name=config.PREPARATION_MODEL_NAME
+            )
+            self.query_encoder = QueryEncoder.from_config(self.embeddings)
+            self.llm = llm
+            self.small_llm = small_llm
+            self.router = (
+                QuestionRouter.from_config() if config.SMALL_MODEL_NAME else None
+            )
+            self.profiler = SlowRequestProfiler()
+            self.index_holder = IndexHolder(
+                self.load_generation(config.INDEX_ARTIFACT_VERSION or None),
+                loader=self.load_generation,
+                drain_timeout_seconds=config.INDEX_DRAIN_TIMEOUT_SECONDS,
             )
+            if config.INDEX_WATCH_SECONDS:
+                self.index_watcher = IndexWatcher(
+                    self.index_holder,
+                    probe=self.probe_index,
+                    interval_seconds=config.INDEX_WATCH_SECONDS,
+                ).start()
+            if os.path.isdir(config.PRECOMPUTED_ANSWERS_DIRECTORY):
+                self.precomputed_answers = PrecomputedAnswers.open(
+                    config.PRECOMPUTED_ANSWERS_DIRECTORY
+                )
             self.reset_context()
             logging.info("The QA chain is loaded.")
         elif self.execution_context.value == ExecutionContext.DATABRICKS.value:
@@ -43,39 +107,327 @@ class ChatBot:
             )
             self.serving_mode = config.DATABRICKS_SERVING_MODE
 
+    @property
+    def index_version(self) -> Optional[str]:
+        """
+        Get the version of the served index, None without a local index.
+        """
+        return self.index_holder.version if self.index_holder else None
+
+    def load_generation(self, version: Optional[str] = None) -> IndexGeneration:
+        """
+        Load a generation of the index: the vector index, the lexical index and their retriever.
+
+        :param version: the version of the index artifact, None for the active one
+        :return: the generation
+        """
+        artifact = (
+            IndexArtifact.open(
+                config.INDEX_ARTIFACT_DIRECTORY,
+                version=version,
+                verify=config.INDEX_ARTIFACT_VERIFY,
+            )
+            if config.INDEX_ARTIFACT_DIRECTORY
+            else None
+        )
+        if version and not artifact:
+            raise ValueError("Only the versions of the index artifact can be loaded.")
+        # Fingerprinted before the loading, a change during the loading triggers another reload
+        index_version = (
+            artifact.version
+            if artifact
+            else directory_fingerprint(
+                [
+                    config.PERSIST_DIRECTORY,
+                    config.QUANTIZED_INDEX_DIRECTORY,
+                    config.LEXICAL_INDEX_DIRECTORY,
+                ]
+            )
+        )
+        index = self.load_index(artifact)
+        retriever = HybridRetriever(
+            embeddings=self.query_encoder,
+            index=index,
+            lexical_index=self.load_lexical_index(artifact),
+            candidates=config.HYBRID_CANDIDATES,
+            lexical_fast_path=config.LEXICAL_FAST_PATH,
+            router=QueryRouter(shards=list(index.shards))
+            if isinstance(index, ShardedIndex)
+            else None,
+        )
+        return IndexGeneration(version=index_version, retriever=retriever)
+
+    def probe_index(self) -> Any:
+        """
+        Get the state of the index files watched for the reloads.
+
+        :return: the active version of the index artifact, or the sizes and modification times of the databases
+        """
+        if config.INDEX_ARTIFACT_DIRECTORY:
+            return current_version(config.INDEX_ARTIFACT_DIRECTORY)
+        return [
+            (os.path.join(root, name), status.st_size, status.st_mtime_ns)
+            for directory in [
+                config.PERSIST_DIRECTORY,
+                config.QUANTIZED_INDEX_DIRECTORY,
+                config.LEXICAL_INDEX_DIRECTORY,
+            ]
+            for root, _, names in sorted(os.walk(directory))
+            for name in sorted(names)
+            for status in [os.stat(os.path.join(root, name))]
+        ]
+
+    def load_index(self, artifact: Optional[IndexArtifact] = None) -> VectorIndex:
+        """
+        Load the index of the chunks, sharded by source family when the sharding is enabled.
+
+        The index artifact replaces the databases written by the ingestion when it is configured.
+
+        :param artifact: the version of the index artifact to load
+        :return: the index
+        """
+        if artifact:
+            logging.info(f"Loading the version {artifact.version} of the index.")
+            if artifact.manifest["model_name"] != config.PREPARATION_MODEL_NAME:
+                logging.warning(
+                    f"The index was embedded with {artifact.manifest['model_name']}, "
+                    f"not with {config.PREPARATION_MODEL_NAME}."
+                )
+            return artifact.load_index(
+                rescore_candidates=config.VECTOR_STORE_RESCORE_CANDIDATES
+            )
+        if not config.VECTOR_STORE_SHARDING:
+            return self._load_index(
+                config.PERSIST_DIRECTORY, config.QUANTIZED_INDEX_DIRECTORY
+            )
+        shards = existing_shards(
+            config.PERSIST_DIRECTORY
+            if config.VECTOR_STORE_PRECISION == VectorPrecision.FLOAT32
+            else config.QUANTIZED_INDEX_DIRECTORY
+        )
+        logging.info(f"Loading the shards {shards} of the index.")
+        return ShardedIndex(
+            {
+                shard: self._load_index(
+                    shard_directory(config.PERSIST_DIRECTORY, shard),
+                    shard_directory(config.QUANTIZED_INDEX_DIRECTORY, shard),
+                )
+                for shard in shards
+            }
+        )
+
+    def _load_index(
+        self, persist_directory: str, quantized_index_directory: str
+    ) -> VectorIndex:
+        """
+        Load an index, the quantized index replaces Chroma with a lower precision.
+
+        :param persist_directory: the directory of the Chroma database
+        :param quantized_index_directory: the directory of the quantized index
+        :return: the index
+        """
+        if config.VECTOR_STORE_PRECISION != VectorPrecision.FLOAT32:
+            logging.info(
+                f"Loading the {config.VECTOR_STORE_PRECISION.value} quantized index."
+            )
+            return QuantizedIndex.load(
+                quantized_index_directory,
+                rescore_candidates=config.VECTOR_STORE_RESCORE_CANDIDATES,
+            )
+        return ChromaIndex(
+            db=Chroma(
+                persist_directory=persist_directory,
+                embedding_function=self.embeddings,
+                client_settings=get_chroma_settings(persist_directory),
+            )
+        )
+
+    def load_lexical_index(
+        self, artifact: Optional[IndexArtifact] = None
+    ) -> Optional[LexicalIndex]:
+        """
+        Load the lexical index of the chunks for the hybrid retrieval.
+
+        :param artifact: the version of the index artifact to load
+        :return: the index, None for the vector retrieval or when it was not built
+        """
+        if config.RETRIEVAL_MODE != RetrievalMode.HYBRID:
+            return None
+        directory = (
+            artifact.lexical_index_directory
+            if artifact
+            else config.LEXICAL_INDEX_DIRECTORY
+        )
+        if not directory or not os.path.exists(directory):
+            logging.warning(
+                f"No lexical index in {directory or artifact.directory}, "
+                "only the vector search is used, ingest the documents to build it."
+            )
+            return None
+        return LexicalIndex.open(directory)
+
     def build_qa_chain(self):
-        torch.cuda.empty_cache()
         prompt = PromptTemplate(
             input_variables=["context", "question"],
             template=PROMPT_FORMAT,
         )
 
-        instruct_pipeline = pipeline(
-            model=config.DATABRICKS_MODEL_NAME,
-            torch_dtype=torch.bfloat16,
-            trust_remote_code=True,
-            device_map="auto",
-            return_full_text=True,
-            max_new_tokens=1024,
-            top_p=0.95,
-            top_k=50,
-        )
-        hf_pipe = HuggingFacePipeline(pipeline=instruct_pipeline)
+        if not self.llm:
+            profile = InferenceProfile.from_config()
+            # The pipeline only loads the model, the generation is controlled by the LLM
+            instruct_pipeline = load_instruct_pipeline(
+                model_name=config.DATABRICKS_MODEL_NAME, profile=profile
+            )
+            draft_model = None
+            if config.DRAFT_MODEL_NAME:
+                draft_model = DraftModel.load(
+                    model_name=config.DRAFT_MODEL_NAME,
+                    profile=profile,
+                    device=instruct_pipeline.model.device,
+                    draft_tokens=config.DRAFT_MODEL_TOKENS,
+                )
+            self.llm = PrefixCachedLLM.from_pipeline(
+                instruct_pipeline,
+                prefix=PROMPT_PREFIX if config.PROMPT_PREFIX_CACHE else "",
+                max_new_tokens=profile.max_new_tokens,
+                draft_model=draft_model,
+                do_sample=True,
+                top_p=0.95,
+                top_k=50,
+            )
+            if config.SMALL_MODEL_NAME and not self.small_llm:
+                self.small_llm = self.load_small_llm(profile)
         logging.info("loading chain, this can take some time...")
         return load_qa_chain(
-            llm=hf_pipe, chain_type="stuff", prompt=prompt, verbose=True
+            llm=self.llm, chain_type="stuff", prompt=prompt, verbose=True
         )
 
+    @staticmethod
+    def load_small_llm(profile: InferenceProfile) -> LLM:
+        """
+        Load the small LLM answering the easy questions, loaded next to the large one.
+
+        :param profile: the inference profile of the large LLM
+        :return: the small LLM
+        """
+        logging.info(f"Loading the small model {config.SMALL_MODEL_NAME}...")
+        return PrefixCachedLLM.from_pipeline(
+            load_instruct_pipeline(model_name=config.SMALL_MODEL_NAME, profile=profile),
+            prefix=PROMPT_PREFIX if config.PROMPT_PREFIX_CACHE else "",
+            max_new_tokens=profile.max_new_tokens,
+            do_sample=True,
+            top_p=0.95,
+            top_k=50,
+        )
+
+    def count_tokens(self, text: str, llm: Optional[LLM] = None) -> int:
+        """
+        Count the tokens of a text with the tokenizer of an LLM.
+
+        :param text: the text
+        :param llm: the LLM, the large one by default
+        :return: the number of tokens
+        """
+        llm = llm or self.llm
+        if isinstance(llm, HuggingFacePipeline):
+            return len(llm.pipeline.tokenizer.encode(text))
+        return llm.get_num_tokens(text)
+
+    def route(self, question: str, scores: List[float]) -> Tuple[str, LLM]:
+        """
+        Choose the LLM answering a question, the large one without routing.
+
+        :param question: the question
+        :param scores: the relevance scores of the retrieved chunks, the best first
+        :return: the route and its LLM
+        """
+        if not self.router:
+            return LARGE, self.llm
+        route, reason = self.router.route(question, scores)
+        ROUTED_QUESTIONS.labels(route=route, reason=reason).inc()
+        logging.info(f"Routing the question to the {route} model ({reason}).")
+        # The injected LLMs, like the stubs, answer both routes without a small LLM
+        return route, (self.small_llm or self.llm) if route == SMALL else self.llm
+
     def reset_context(self):
         self.qa_chain = self.build_qa_chain()
 
     def get_similar_docs(self, question: str, similar_doc_count: int):
-        return self.db.similarity_search(
-            question, include_metadata=True, k=similar_doc_count
-        )
+        with self.index_holder.acquire() as generation:
+            return [
+                document
+                for document, _ in generation.retriever.retrieve(
+                    question, k=similar_doc_count
+                )
+            ]
+
+    def search(
+        self,
+        queries: List[str],
+        k: int,
+        where: Optional[Dict[str, Any]] = None,
+    ) -> Tuple[Optional[str], List[ScoredDocuments]]:
+        """
+        Retrieve the chunks of queries without generating answers.
+
+        A single query is embedded with the concurrent ones by the query encoder, several queries are
+        embedded in one pass and searched together.
+
+        :param queries: the queries
+        :param k: the number of chunks to return by query
+        :param where: the metadata values the chunks must match, a list of values matches any of them
+        :return: the version of the searched index and the scored chunks of each query
+        """
+        with self.index_holder.acquire() as generation:
+            if len(queries) == 1:
+                results = [generation.retriever.retrieve(queries[0], k=k, where=where)]
+            else:
+                results = generation.retriever.retrieve_batch(queries, k=k, where=where)
+        return generation.version, results
 
     def chat(
-        self, question: str, from_databricks_notebook: bool = False
+        self,
+        question: str,
+        from_databricks_notebook: bool = False,
+        controls: Optional[GenerationControls] = None,
+    ) -> Optional[Answer]:
+        """
+        Answer a question.
+
+        :param question: the question
+        :param from_databricks_notebook: format the answer in html for a notebook
+        :param controls: the stop sequences, the maximum tokens and the deadline of the generation
+        :return: the answer
+        """
+        controls = controls or GenerationControls()
+        self.log_question(question)
+        answer = self.get_precomputed_answer(question, controls)
+        if answer:
+            if from_databricks_notebook:
+                return Answer.to_html(question=question, answer=answer.answer)
+            return answer
+        if not config.SINGLE_FLIGHT:
+            return self._chat(question, from_databricks_notebook, controls)
+        # The html answers of the notebooks contain the question as it was asked
+        key = (
+            question if from_databricks_notebook else normalize_question(question),
+            from_databricks_notebook,
+            tuple(controls.stop),
+            controls.max_new_tokens,
+            controls.deadline_seconds,
+        )
+        answer, shared = self.single_flight.do(
+            key, lambda: self._chat(question, from_databricks_notebook, controls)
+        )
+        if shared and answer and not from_databricks_notebook:
+            return answer.copy(update={"question": question})
+        return answer
+
+    def _chat(
+        self,
+        question: str,
+        from_databricks_notebook: bool,
+        controls: GenerationControls,
     ) -> Optional[Answer]:
         try:
             if self.execution_context.value == ExecutionContext.DATABRICKS.value:
@@ -86,9 +438,9 @@ class ChatBot:
                     logging.info(
                         "From Databricks context using the LLM to answer the question."
                     )
-                    answer = self.databricks_job_manager.llm(
+                    answer = self.databricks_job_manager.get_llm_client().complete_sync(
                         prompt=question,
-                        stop=list(),
+                        stop=controls.stop,
                     )
                     return Answer(question=question, answer=answer.strip().capitalize())
                 elif (
@@ -96,30 +448,20 @@ class ChatBot:
                     == config.DATABRICKS_SERVING_MODE.NOTEBOOK_API.value
                 ):
                     logging.info(
-                        "From Databricks context using job API to run the notebook to answer the question."
+                        "From Databricks context using the warm job runner to answer the question."
                     )
-                    return self.databricks_job_manager.submit_notebook_job_to_cluster(
+                    return self.databricks_job_manager.ask_warm_job_runner(
                         question=question
                     )
             elif self.execution_context.value == ExecutionContext.LOCAL.value:
                 logging.info("Loading the QA chain to provide an answer.")
-                similar_docs = self.get_similar_docs(
-                    question, similar_doc_count=config.SOURCE_DOCUMENTS_MAX_COUNT
-                )
-                result = self.qa_chain(
-                    {"input_documents": similar_docs, "question": question}
-                )
-                answer = result["output_text"]
-                for document in result["input_documents"]:
-                    source_id = document.metadata["source"]
-                    answer += f"\n (Source: {source_id})"
-                return (
-                    Answer(question=question, answer=answer.strip().capitalize())
-                    if not from_databricks_notebook
-                    else Answer.to_html(
-                        question=question, answer=answer.strip().capitalize()
-                    )
-                )
+                with QUEUE_DEPTH.labels(queue="chat").track_inprogress():
+                    with self.profiler.profile(question):
+                        answer = self.generate_answer(question, controls)
+                self.refresh_precomputed_answer(answer, controls)
+                if from_databricks_notebook:
+                    return Answer.to_html(question=question, answer=answer.answer)
+                return answer
 
             raise ValueError(
                 f"This execution context is not supported {self.execution_context}"
@@ -127,3 +469,120 @@ class ChatBot:
         except Exception as exception:
             logging.exception("An error occurred while answering the question.")
             raise exception
+
+    def log_question(self, question: str) -> None:
+        """
+        Append a question to the log mined for the frequent questions.
+
+        :param question: the question
+        """
+        if not config.QUESTIONS_LOG_PATH:
+            return
+        with self.questions_log_lock:
+            with open(config.QUESTIONS_LOG_PATH, "a") as file:
+                file.write(json.dumps({"question": question}) + "\n")
+
+    def get_precomputed_answer(
+        self, question: str, controls: GenerationControls
+    ) -> Optional[Answer]:
+        """
+        Get the precomputed answer of a question, for the current version of the index.
+
+        :param question: the question
+        :param controls: the controls of the generation, the precomputed answers use the default ones
+        :return: the answer, None when it must be generated
+        """
+        if (
+            self.precomputed_answers is None
+            or controls.stop
+            or controls.max_new_tokens
+            or self.execution_context.value != ExecutionContext.LOCAL.value
+        ):
+            return None
+        return self.precomputed_answers.get(question, self.index_version)
+
+    def refresh_precomputed_answer(
+        self, answer: Answer, controls: GenerationControls
+    ) -> None:
+        """
+        Replace the stale precomputed answer of a question by an answer generated with the current index.
+
+        :param answer: the generated answer
+        :param controls: the controls of the generation, the precomputed answers use the default ones
+        """
+        if (
+            self.precomputed_answers is None
+            or controls.stop
+            or controls.max_new_tokens
+            or answer.question not in self.precomputed_answers
+        ):
+            return
+        logging.info(f"Rebuilding the stale precomputed answer of {answer.question}")
+        self.precomputed_answers.put(answer)
+        self.precomputed_answers.save()
+
+    def generate_answer(
+        self,
+        question: str,
+        controls: Optional[GenerationControls] = None,
+    ) -> Answer:
+        """
+        Generate the answer of a question from the retrieved chunks, without the precomputed answers.
+
+        :param question: the question
+        :param controls: the stop sequences, the maximum tokens and the deadline of the generation
+        :return: the answer
+        """
+        controls = controls or GenerationControls()
+        start = time.perf_counter()
+        deadline = (
+            time.monotonic() + controls.deadline_seconds
+            if controls.deadline_seconds
+            else None
+        )
+        with self.index_holder.acquire() as generation:
+            scored_docs, relevance = generation.retriever.retrieve_with_relevance(
+                question, k=config.SOURCE_DOCUMENTS_MAX_COUNT
+            )
+        retrieval_seconds = time.perf_counter() - start
+        similar_docs = [document for document, _ in scored_docs]
+        route, llm = self.route(question, relevance)
+        with stage("context_assembly"):
+            # Same prompt as the "stuff" QA chain
+            prompt = self.qa_chain.llm_chain.prompt.format(
+                context="\n\n".join(doc.page_content for doc in similar_docs),
+                question=question,
+            )
+        start = time.perf_counter()
+        stop = controls.stop_sequences
+        with stage("generation"):
+            answer = llm(
+                prompt,
+                stop=stop,
+                max_new_tokens=controls.max_new_tokens,
+                deadline=deadline,
+            )
+        # The LLMs not supporting the stop sequences are cut afterwards
+        answer = truncate_at_stop(answer, stop)
+        generation_seconds = time.perf_counter() - start
+        completion_tokens = self.count_tokens(answer, llm)
+        prompt_tokens = self.count_tokens(prompt, llm)
+        record_generation(
+            prompt_tokens,
+            completion_tokens,
+            generation_seconds,
+            route=route if self.router else None,
+        )
+        for document in similar_docs:
+            source_id = document.metadata["source"]
+            answer += f"\n (Source: {source_id})"
+        return Answer(
+            question=question,
+            answer=answer.strip().capitalize(),
+            retrieval_seconds=retrieval_seconds,
+            generation_seconds=generation_seconds,
+            prompt_tokens=prompt_tokens,
+            completion_tokens=completion_tokens,
+            index_version=generation.version,
+            route=route if self.router else None,
+        )
@@ -0,0 +1,83 @@
+import re
+import threading
+from typing import Callable, Dict, Generic, Hashable, Optional, Tuple, TypeVar
+
+from app.metrics import COALESCED_CALLS
+
+T = TypeVar("T")
+
+TRAILING_PUNCTUATION = re.compile(r"[\s?!.]+$")
+
+
+def normalize_question(question: str) -> str:
+    """
+    Normalize a question to coalesce the questions differing only by their case, spaces or final
+    punctuation.
+
+    :param question: the question
+    :return: the normalized question
+    """
+    return TRAILING_PUNCTUATION.sub("", " ".join(question.lower().split()))
+
+
+class Flight(Generic[T]):
+    """
+    In-flight call shared by the callers of the same key.
+    """
+
+    def __init__(self) -> None:
+        self.done = threading.Event()
+        self.result: Optional[T] = None
+        self.exception: Optional[BaseException] = None
+        self.followers = 0
+
+
+class SingleFlight(Generic[T]):
+    """
+    Coalescing of the concurrent calls of the same key into a single call.
+
+    The first caller of a key runs the call, the callers arriving while it runs wait for its result
+    or its exception. Nothing is kept once the call is done: it is not a cache.
+    """
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.lock = threading.Lock()
+        self.flights: Dict[Hashable, Flight[T]] = dict()
+
+    def do(self, key: Hashable, function: Callable[[], T]) -> Tuple[T, bool]:
+        """
+        Run a call, or wait for the in-flight call of the same key.
+
+        :param key: the key of the call
+        :param function: the call
+        :return: the result of the call and True when it was shared with another caller
+        """
+        with self.lock:
+            flight = self.flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self.flights[key] = Flight()
+            else:
+                flight.followers += 1
+        if not leader:
+            COALESCED_CALLS.labels(flight=self.name, role="follower").inc()
+            flight.done.wait()
+            if flight.exception:
+                raise flight.exception
+            return flight.result, True
+        COALESCED_CALLS.labels(flight=self.name, role="leader").inc()
+        try:
+            flight.result = function()
+        except BaseException as exception:
+            flight.exception = exception
+            raise
+        finally:
+            with self.lock:
+                del self.flights[key]
+            flight.done.set()
+        return flight.result, flight.followers > 0
+
+    @property
+    def in_flight(self) -> int:
+        return len(self.flights)
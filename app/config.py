@@ -1,6 +1,7 @@
 import logging
 import os
 from enum import Enum
+from typing import List
 
 from chromadb.config import Settings
 from dotenv import find_dotenv, load_dotenv
@@ -37,15 +38,190 @@ class DatabricksServingMode(Enum):
     NOTEBOOK_API = "notebook_api"
 
 
+class ModelBackend(Enum):
+    """
+    Define the backend of the LLM and of the embeddings, the stub backend runs offline without any model.
+    """
+
+    HUGGINGFACE = "huggingface"
+    STUB = "stub"
+
+
+class VectorPrecision(Enum):
+    """
+    Define the precision of the embeddings searched by Delta-Buddy, float32 searches the Chroma database.
+    """
+
+    FLOAT32 = "float32"
+    FLOAT16 = "float16"
+    INT8 = "int8"
+
+
+class RetrievalMode(Enum):
+    """
+    Define the retrieval of the chunks, hybrid fuses the vector search with the BM25 search.
+    """
+
+    VECTOR = "vector"
+    HYBRID = "hybrid"
+
+
+class InferenceDevice(Enum):
+    """
+    Define the device running the LLM, auto uses the GPU when there is one.
+    """
+
+    AUTO = "auto"
+    GPU = "gpu"
+    CPU = "cpu"
+
+
+class InferenceQuantization(Enum):
+    """
+    Define the quantization of the LLM, int8 quantizes dynamically its linear layers on CPU.
+    """
+
+    NONE = "none"
+    INT8 = "int8"
+
+
 class Config(BaseModel):
     EXECUTION_CONTEXT: ExecutionContext = ExecutionContext[
         os.environ.get("EXECUTION_CONTEXT", "local").upper()
     ]
+    LLM_BACKEND: ModelBackend = ModelBackend[
+        os.environ.get("LLM_BACKEND", "huggingface").upper()
+    ]
+    EMBEDDINGS_BACKEND: ModelBackend = ModelBackend[
+        os.environ.get("EMBEDDINGS_BACKEND", "huggingface").upper()
+    ]
+    CHATBOT_BACKEND: ModelBackend = ModelBackend[
+        os.environ.get("CHATBOT_BACKEND", "huggingface").upper()
+    ]
+    STUB_CHATBOT_LATENCY_SECONDS: float = float(
+        os.environ.get("STUB_CHATBOT_LATENCY_SECONDS", "0.05")
+    )
+    STUB_CHATBOT_CAPACITY: int = int(os.environ.get("STUB_CHATBOT_CAPACITY", "0"))
     SOURCE_DOCUMENTS_DIRECTORY: str = os.environ["SOURCE_DOCUMENTS_DIRECTORY"]
+    UNSTRUCTURED_LOADER_EXTENSIONS: List[str] = [
+        extension.strip()
+        for extension in os.environ.get("UNSTRUCTURED_LOADER_EXTENSIONS", "").split(",")
+        if extension.strip()
+    ]
+    PIPELINE_CHECKPOINT_PATH: str = os.environ.get(
+        "PIPELINE_CHECKPOINT_PATH", "database_checkpoints.json"
+    )
+    CHUNK_DEDUPLICATION: bool = (
+        os.environ.get("CHUNK_DEDUPLICATION", "true").lower() == "true"
+    )
+    CHUNK_DEDUPLICATION_THRESHOLD: float = float(
+        os.environ.get("CHUNK_DEDUPLICATION_THRESHOLD", "0.8")
+    )
+    SPARK_INGESTION_PARTITIONS: int = int(
+        os.environ.get("SPARK_INGESTION_PARTITIONS", "0")
+    )
     PERSIST_DIRECTORY: str = os.environ["PERSIST_DIRECTORY"]
+    VECTOR_STORE_PRECISION: VectorPrecision = VectorPrecision[
+        os.environ.get("VECTOR_STORE_PRECISION", "float32").upper()
+    ]
+    VECTOR_STORE_RESCORE_CANDIDATES: int = int(
+        os.environ.get("VECTOR_STORE_RESCORE_CANDIDATES", "0")
+    )
+    QUANTIZED_INDEX_DIRECTORY: str = os.environ.get(
+        "QUANTIZED_INDEX_DIRECTORY", "database_quantized"
+    )
+    RETRIEVAL_MODE: RetrievalMode = RetrievalMode[
+        os.environ.get("RETRIEVAL_MODE", "hybrid").upper()
+    ]
+    LEXICAL_INDEX_DIRECTORY: str = os.environ.get(
+        "LEXICAL_INDEX_DIRECTORY", "database_lexical"
+    )
+    LEXICAL_FAST_PATH: bool = (
+        os.environ.get("LEXICAL_FAST_PATH", "true").lower() == "true"
+    )
+    HYBRID_CANDIDATES: int = int(os.environ.get("HYBRID_CANDIDATES", "20"))
+    SEARCH_MAX_RESULTS: int = int(os.environ.get("SEARCH_MAX_RESULTS", "100"))
+    SEARCH_MAX_BATCH_QUERIES: int = int(
+        os.environ.get("SEARCH_MAX_BATCH_QUERIES", "64")
+    )
+    QUERY_ENCODER_CACHE_SIZE: int = int(
+        os.environ.get("QUERY_ENCODER_CACHE_SIZE", "1024")
+    )
+    QUERY_ENCODER_BATCH_SIZE: int = int(
+        os.environ.get("QUERY_ENCODER_BATCH_SIZE", "32")
+    )
+    QUERY_ENCODER_BATCH_WAIT_SECONDS: float = float(
+        os.environ.get("QUERY_ENCODER_BATCH_WAIT_SECONDS", "0.002")
+    )
+    QUERY_ENCODER_MAX_SEQ_LENGTH: int = int(
+        os.environ.get("QUERY_ENCODER_MAX_SEQ_LENGTH", "128")
+    )
+    VECTOR_STORE_SHARDING: bool = (
+        os.environ.get("VECTOR_STORE_SHARDING", "false").lower() == "true"
+    )
+    INDEX_ARTIFACT_DIRECTORY: str = os.environ.get("INDEX_ARTIFACT_DIRECTORY", "")
+    INDEX_ARTIFACT_VERSION: str = os.environ.get("INDEX_ARTIFACT_VERSION", "")
+    INDEX_ARTIFACT_VERIFY: bool = (
+        os.environ.get("INDEX_ARTIFACT_VERIFY", "false").lower() == "true"
+    )
+    INDEX_WATCH_SECONDS: float = float(os.environ.get("INDEX_WATCH_SECONDS", "0"))
+    INDEX_DRAIN_TIMEOUT_SECONDS: float = float(
+        os.environ.get("INDEX_DRAIN_TIMEOUT_SECONDS", "60")
+    )
+    ADMIN_TOKEN: str = os.environ.get("ADMIN_TOKEN", "")
     SOURCE_DOCUMENTS_MAX_COUNT: int = int(os.environ["SOURCE_DOCUMENTS_MAX_COUNT"])
     PREPARATION_MODEL_NAME: str = os.environ["PREPARATION_MODEL_NAME"]
     DATABRICKS_MODEL_NAME: str = os.environ["DATABRICKS_MODEL_NAME"]
+    INFERENCE_DEVICE: InferenceDevice = InferenceDevice[
+        os.environ.get("INFERENCE_DEVICE", "auto").upper()
+    ]
+    INFERENCE_QUANTIZATION: InferenceQuantization = InferenceQuantization[
+        os.environ.get("INFERENCE_QUANTIZATION", "none").upper()
+    ]
+    INFERENCE_INTRA_OP_THREADS: int = int(
+        os.environ.get("INFERENCE_INTRA_OP_THREADS", "0")
+    )
+    INFERENCE_INTER_OP_THREADS: int = int(
+        os.environ.get("INFERENCE_INTER_OP_THREADS", "0")
+    )
+    MAX_NEW_TOKENS: int = int(os.environ.get("MAX_NEW_TOKENS", "1024"))
+    GENERATION_DEADLINE_SECONDS: float = float(
+        os.environ.get("GENERATION_DEADLINE_SECONDS", "0")
+    )
+    PROMPT_PREFIX_CACHE: bool = (
+        os.environ.get("PROMPT_PREFIX_CACHE", "true").lower() == "true"
+    )
+    DRAFT_MODEL_NAME: str = os.environ.get("DRAFT_MODEL_NAME", "")
+    DRAFT_MODEL_TOKENS: int = int(os.environ.get("DRAFT_MODEL_TOKENS", "5"))
+    SMALL_MODEL_NAME: str = os.environ.get("SMALL_MODEL_NAME", "")
+    ROUTING_MAX_QUESTION_WORDS: int = int(
+        os.environ.get("ROUTING_MAX_QUESTION_WORDS", "20")
+    )
+    ROUTING_MIN_SCORE_SPREAD: float = float(
+        os.environ.get("ROUTING_MIN_SCORE_SPREAD", "0.05")
+    )
+    ROUTING_HARD_KEYWORDS: List[str] = [
+        keyword.strip()
+        for keyword in os.environ.get(
+            "ROUTING_HARD_KEYWORDS",
+            "why,explain,compare,difference,differences,design,architecture,"
+            "debug,error,tune,migrate,troubleshoot",
+        ).split(",")
+        if keyword.strip()
+    ]
+    SINGLE_FLIGHT: bool = os.environ.get("SINGLE_FLIGHT", "true").lower() == "true"
+    PRECOMPUTED_ANSWERS_DIRECTORY: str = os.environ.get(
+        "PRECOMPUTED_ANSWERS_DIRECTORY", "database_answers"
+    )
+    FREQUENT_QUESTIONS_PATH: str = os.environ.get("FREQUENT_QUESTIONS_PATH", "")
+    FREQUENT_QUESTIONS_COUNT: int = int(
+        os.environ.get("FREQUENT_QUESTIONS_COUNT", "300")
+    )
+    QUESTIONS_LOG_PATH: str = os.environ.get("QUESTIONS_LOG_PATH", "")
+    METRICS_PORT: int = int(os.environ.get("METRICS_PORT", "0"))
+    SLOW_REQUEST_PROFILING_SECONDS: float = float(
+        os.environ.get("SLOW_REQUEST_PROFILING_SECONDS", "0")
+    )
     DATABRICKS_CLUSTER_ID: str = os.environ.get("DATABRICKS_CLUSTER_ID", "")
     DATABRICKS_TEXT_TO_SQL_MODEL: str = os.environ.get(
         "DATABRICKS_TEXT_TO_SQL_MODEL", ""
@@ -58,13 +234,54 @@ class Config(BaseModel):
     ]
     DATABRICKS_HTTP_PATH = os.environ.get("DATABRICKS_HTTP_PATH", "")
     DATABRICKS_TOKEN = os.environ.get("DATABRICKS_TOKEN", "")
+    DATABRICKS_LLM_CONCURRENCY: int = int(
+        os.environ.get("DATABRICKS_LLM_CONCURRENCY", "8")
+    )
+    DATABRICKS_LLM_TIMEOUT_SECONDS: float = float(
+        os.environ.get("DATABRICKS_LLM_TIMEOUT_SECONDS", "120")
+    )
+    DATABRICKS_LLM_MAX_RETRIES: int = int(
+        os.environ.get("DATABRICKS_LLM_MAX_RETRIES", "2")
+    )
+    DATABRICKS_LLM_HEDGE_AFTER_SECONDS: float = float(
+        os.environ.get("DATABRICKS_LLM_HEDGE_AFTER_SECONDS", "0")
+    )
+    DATABRICKS_JOB_QUEUE_DIRECTORY: str = os.environ.get(
+        "DATABRICKS_JOB_QUEUE_DIRECTORY", "/delta-buddy/queue"
+    )
+    DATABRICKS_JOB_CONCURRENCY: int = int(
+        os.environ.get("DATABRICKS_JOB_CONCURRENCY", "4")
+    )
+    DATABRICKS_JOB_BATCH_SIZE: int = int(
+        os.environ.get("DATABRICKS_JOB_BATCH_SIZE", "8")
+    )
+    DATABRICKS_JOB_TIMEOUT_SECONDS: int = int(
+        os.environ.get("DATABRICKS_JOB_TIMEOUT_SECONDS", "600")
+    )
+    DATABRICKS_JOB_IDLE_TIMEOUT_SECONDS: int = int(
+        os.environ.get("DATABRICKS_JOB_IDLE_TIMEOUT_SECONDS", "900")
+    )
+    DATABRICKS_JOB_MAX_LIFETIME_SECONDS: int = int(
+        os.environ.get("DATABRICKS_JOB_MAX_LIFETIME_SECONDS", "86400")
+    )
 
 
 config = Config()
 
+
+def get_chroma_settings(persist_directory: str) -> Settings:
+    """
+    Get the Chroma settings of a database, Chroma ignores the persist directory given without them.
+
+    :param persist_directory: the directory of the database
+    :return: the settings
+    """
+    return Settings(
+        chroma_db_impl="duckdb+parquet",
+        persist_directory=persist_directory,
+        anonymized_telemetry=False,
+    )
+
+
 # Define the Chroma settings
-CHROMA_SETTINGS = Settings(
-    chroma_db_impl="duckdb+parquet",
-    persist_directory=config.PERSIST_DIRECTORY,
-    anonymized_telemetry=False,
-)
+CHROMA_SETTINGS = get_chroma_settings(config.PERSIST_DIRECTORY)
@@ -16,3 +16,18 @@ PROMPT_FORMAT = f"""{INTRO_BLURB}
 
 {RESPONSE_KEY}
 """
+
+# The instruction template of the Dolly models, applied by their own text generation pipeline
+DOLLY_INTRO_BLURB = (
+    "Below is an instruction that describes a task. "
+    "Write a response that appropriately completes the request."
+)
+DOLLY_INSTRUCTION_FORMAT = f"""{DOLLY_INTRO_BLURB}
+
+### Instruction:
+{"{instruction}"}
+
+### Response:
+"""
+# The special token ending the responses of the Dolly models
+DOLLY_END_KEY = "### End"
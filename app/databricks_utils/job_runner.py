@@ -0,0 +1,471 @@
+import base64
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from typing import Callable, Dict, List, Optional, Set
+
+from databricks.sdk import WorkspaceClient
+from databricks.sdk.core import DatabricksError
+from databricks.sdk.service import jobs
+from pydantic import BaseModel
+
+from app.config import config
+from app.metrics import QUEUE_DEPTH
+from app.models import Answer
+
+REQUESTS_DIRECTORY = "requests"
+PROCESSING_DIRECTORY = "processing"
+RESPONSES_DIRECTORY = "responses"
+ALIVE_LIFE_CYCLE_STATES = ("PENDING", "QUEUED", "RUNNING")
+MISSING_OR_EXISTING_ERROR_CODES = ("RESOURCE_DOES_NOT_EXIST", "RESOURCE_ALREADY_EXISTS")
+
+
+class JobQueueStorage(ABC):
+    """
+    Storage shared by the warm job runner and the worker notebook to exchange questions and answers.
+    """
+
+    @abstractmethod
+    def list_names(self, directory: str) -> List[str]:
+        """
+        List the file names of a queue directory.
+
+        :param directory: the queue directory
+        :return: the file names
+        """
+
+    @abstractmethod
+    def write(self, path: str, content: bytes) -> None:
+        """
+        Write a file in the queue.
+
+        :param path: the relative path of the file
+        :param content: the content to write
+        """
+
+    @abstractmethod
+    def read(self, path: str) -> bytes:
+        """
+        Read a file of the queue.
+
+        :param path: the relative path of the file
+        :return: the content of the file
+        """
+
+    @abstractmethod
+    def delete(self, path: str) -> None:
+        """
+        Delete a file of the queue.
+
+        :param path: the relative path of the file
+        """
+
+    @abstractmethod
+    def move(self, source: str, destination: str) -> bool:
+        """
+        Move a file of the queue, it is used to claim a question.
+
+        :param source: the relative path of the file to move
+        :param destination: the relative destination path
+        :return: True if the file has been moved by this caller
+        """
+
+
+class LocalQueueStorage(JobQueueStorage):
+    """
+    Queue storage on a local file system, the worker notebook uses it through the /dbfs mount.
+    """
+
+    def __init__(self, root: str) -> None:
+        self.root = root
+        for directory in (
+            REQUESTS_DIRECTORY,
+            PROCESSING_DIRECTORY,
+            RESPONSES_DIRECTORY,
+        ):
+            os.makedirs(os.path.join(self.root, directory), exist_ok=True)
+
+    def list_names(self, directory: str) -> List[str]:
+        return sorted(os.listdir(os.path.join(self.root, directory)))
+
+    def write(self, path: str, content: bytes) -> None:
+        # Write then rename to never expose a half-written file to the reader
+        temporary_path = os.path.join(self.root, f"{path}.tmp")
+        with open(temporary_path, "wb") as file:
+            file.write(content)
+        os.replace(temporary_path, os.path.join(self.root, path))
+
+    def read(self, path: str) -> bytes:
+        with open(os.path.join(self.root, path), "rb") as file:
+            return file.read()
+
+    def delete(self, path: str) -> None:
+        try:
+            os.remove(os.path.join(self.root, path))
+        except FileNotFoundError:
+            pass
+
+    def move(self, source: str, destination: str) -> bool:
+        try:
+            os.rename(
+                os.path.join(self.root, source), os.path.join(self.root, destination)
+            )
+            return True
+        except FileNotFoundError:
+            return False
+
+
+class DbfsQueueStorage(JobQueueStorage):
+    """
+    Queue storage on DBFS accessed with the Databricks API, it is used from outside the cluster.
+    """
+
+    def __init__(self, workspace: WorkspaceClient, root: str) -> None:
+        self.dbfs = workspace.dbfs
+        self.root = root.rstrip("/")
+        for directory in (
+            REQUESTS_DIRECTORY,
+            PROCESSING_DIRECTORY,
+            RESPONSES_DIRECTORY,
+        ):
+            self.dbfs.mkdirs(self._path(directory))
+
+    def _path(self, path: str) -> str:
+        return f"{self.root}/{path}"
+
+    def list_names(self, directory: str) -> List[str]:
+        files = self.dbfs.list(self._path(directory)) or list()
+        return sorted(file.path.rsplit("/", 1)[-1] for file in files)
+
+    def write(self, path: str, content: bytes) -> None:
+        self.dbfs.put(
+            self._path(path),
+            contents=base64.b64encode(content).decode("utf-8"),
+            overwrite=True,
+        )
+
+    def read(self, path: str) -> bytes:
+        return base64.b64decode(self.dbfs.read(self._path(path)).data)
+
+    def delete(self, path: str) -> None:
+        try:
+            self.dbfs.delete(self._path(path))
+        except DatabricksError as error:
+            if error.error_code != "RESOURCE_DOES_NOT_EXIST":
+                raise
+
+    def move(self, source: str, destination: str) -> bool:
+        # The move fails when another worker has already claimed the file
+        try:
+            self.dbfs.move(self._path(source), self._path(destination))
+            return True
+        except DatabricksError as error:
+            if error.error_code in MISSING_OR_EXISTING_ERROR_CODES:
+                return False
+            raise
+
+
+class JobRunnerStats(BaseModel):
+    """
+    Statistics of the warm job runner, the submission overhead is kept apart from the answer time.
+    """
+
+    worker_submissions: int = 0
+    questions: int = 0
+    timeouts: int = 0
+    errors: int = 0
+    submission_seconds: float = 0.0
+    answer_seconds: float = 0.0
+
+
+class WarmJobRunner:
+    """
+    Answer questions with a long-lived Databricks run pulling them from a queue.
+
+    The run is submitted once and kept warm: the questions are written to the queue and the answers
+    are read back from it, so they do not pay for the job scheduling and the notebook start-up.
+    The questions timing out are removed from the queue and their late answers are deleted, like the
+    answers older than the orphan delay that no caller waits for anymore.
+    """
+
+    def __init__(
+        self,
+        workspace: WorkspaceClient,
+        storage: Optional[JobQueueStorage] = None,
+        concurrency: int = config.DATABRICKS_JOB_CONCURRENCY,
+        timeout_in_seconds: int = config.DATABRICKS_JOB_TIMEOUT_SECONDS,
+        poll_interval_in_seconds: float = 1.0,
+        orphan_after_in_seconds: Optional[float] = None,
+    ) -> None:
+        """
+        :param workspace: the Databricks workspace running the worker
+        :param storage: the queue storage, DBFS by default
+        :param concurrency: the maximum number of questions waiting for an answer
+        :param timeout_in_seconds: the default time to wait for an answer
+        :param poll_interval_in_seconds: the time between two reads of the answers
+        :param orphan_after_in_seconds: the age of the answers deleted without a caller, twice the timeout by default
+        """
+        self.workspace = workspace
+        self.storage = storage or DbfsQueueStorage(
+            workspace=workspace, root=config.DATABRICKS_JOB_QUEUE_DIRECTORY
+        )
+        self.timeout_in_seconds = timeout_in_seconds
+        self.poll_interval_in_seconds = poll_interval_in_seconds
+        self.orphan_after_in_seconds = orphan_after_in_seconds or 2 * timeout_in_seconds
+        self.stats = JobRunnerStats()
+        self.run_id: Optional[int] = None
+        self._slots = threading.BoundedSemaphore(concurrency)
+        self._lock = threading.Lock()
+        self._pending: Dict[str, Future] = dict()
+        self._abandoned: Set[str] = set()
+        self._poller: Optional[threading.Thread] = None
+
+    def _submit_worker(self) -> int:
+        """
+        Submit the long-lived worker run on the cluster.
+
+        :return: the run identifier
+        """
+        name = "delta-buddy-warm-runner-from-sdk"
+        logging.info(f"Submitting the warm runner to Databricks with name: {name}")
+        waiter = self.workspace.jobs.submit(
+            run_name=name,
+            tasks=[
+                jobs.JobTaskSettings(
+                    description="Delta Buddy warm runner",
+                    existing_cluster_id=config.DATABRICKS_CLUSTER_ID,
+                    notebook_task=jobs.NotebookTask(
+                        notebook_path=config.DATABRICKS_NOTEBOOK_PATH,
+                        base_parameters={
+                            "serving_mode": config.DATABRICKS_SERVING_MODE.NOTEBOOK_API.value,
+                            "runner": "warm",
+                            "queue_directory": config.DATABRICKS_JOB_QUEUE_DIRECTORY,
+                        },
+                    ),
+                    task_key="Delta_Buddy_Warm_Runner",
+                    timeout_seconds=config.DATABRICKS_JOB_MAX_LIFETIME_SECONDS,
+                )
+            ],
+        )
+        self.stats.worker_submissions += 1
+        return waiter.run_id
+
+    def _is_worker_alive(self) -> bool:
+        if self.run_id is None:
+            return False
+        state = self.workspace.jobs.get_run(run_id=self.run_id).state
+        return state.life_cycle_state.value in ALIVE_LIFE_CYCLE_STATES
+
+    def _ensure_worker(self) -> None:
+        with self._lock:
+            if not self._is_worker_alive():
+                self.run_id = self._submit_worker()
+            if self._poller is None or not self._poller.is_alive():
+                self._poller = threading.Thread(target=self._poll_answers, daemon=True)
+                self._poller.start()
+
+    def _is_orphan(self, question_id: str) -> bool:
+        """
+        Check if no caller waits for the answer of a question anymore, from the time of its identifier.
+
+        :param question_id: the identifier of the question
+        :return: True if the question is older than the orphan delay
+        """
+        try:
+            asked_at = int(question_id.split("-", 1)[0]) / 1e9
+        except ValueError:
+            return False
+        return time.time() - asked_at > self.orphan_after_in_seconds
+
+    def _poll_answers(self) -> None:
+        """
+        Read the answers from the queue until no question is pending or abandoned.
+
+        The storage errors are logged and the polling goes on, the callers time out if they persist.
+        """
+        while True:
+            with self._lock:
+                self._abandoned = {
+                    question_id
+                    for question_id in self._abandoned
+                    if not self._is_orphan(question_id)
+                }
+                if not self._pending and not self._abandoned:
+                    self._poller = None
+                    return
+            try:
+                self._collect_answers()
+            except Exception:
+                logging.exception("Failed to read the answers of the warm runner.")
+            time.sleep(self.poll_interval_in_seconds)
+
+    def _collect_answers(self) -> None:
+        """
+        Resolve the pending questions with their answers and delete the answers no caller waits for.
+        """
+        for name in self.storage.list_names(RESPONSES_DIRECTORY):
+            question_id = name.rsplit(".", 1)[0]
+            path = f"{RESPONSES_DIRECTORY}/{name}"
+            with self._lock:
+                future = self._pending.get(question_id)
+                abandoned = question_id in self._abandoned
+            if future is not None:
+                response = json.loads(self.storage.read(path))
+                with self._lock:
+                    self._pending.pop(question_id, None)
+                future.set_result(response)
+            elif abandoned or self._is_orphan(question_id):
+                logging.info(f"Deleting the answer without caller: {name}")
+                with self._lock:
+                    self._abandoned.discard(question_id)
+            else:
+                # The question of another runner sharing the queue
+                continue
+            self.storage.delete(path)
+
+    def ask(self, question: str, timeout_in_seconds: Optional[int] = None) -> Answer:
+        """
+        Ask a question to the warm runner, the runner is submitted if it is not running.
+
+        :param question: the question to ask
+        :param timeout_in_seconds: the maximum time to wait for the answer
+        :return: the answer to the question
+        """
+        timeout_in_seconds = timeout_in_seconds or self.timeout_in_seconds
+        with QUEUE_DEPTH.labels(
+            queue="warm_job_runner"
+        ).track_inprogress(), self._slots:
+            start = time.perf_counter()
+            # Identifiers are prefixed by the time to answer the questions in order
+            question_id = f"{time.time_ns()}-{uuid.uuid4().hex}"
+            future = Future()
+            with self._lock:
+                self._pending[question_id] = future
+            try:
+                self._ensure_worker()
+                self.storage.write(
+                    f"{REQUESTS_DIRECTORY}/{question_id}.json",
+                    json.dumps({"id": question_id, "question": question}).encode(
+                        "utf-8"
+                    ),
+                )
+            except Exception:
+                # The poller stops once no question is pending
+                with self._lock:
+                    self._pending.pop(question_id, None)
+                raise
+            submitted = time.perf_counter()
+            self.stats.submission_seconds += submitted - start
+            try:
+                response = future.result(timeout=timeout_in_seconds)
+            except FutureTimeoutError:
+                self.stats.timeouts += 1
+                with self._lock:
+                    self._pending.pop(question_id, None)
+                    # The answer of a question already claimed by the worker is deleted on arrival
+                    self._abandoned.add(question_id)
+                try:
+                    self.storage.delete(f"{REQUESTS_DIRECTORY}/{question_id}.json")
+                except Exception:
+                    logging.exception("Failed to remove the question from the queue.")
+                raise TimeoutError(
+                    f"No answer from the warm runner after {timeout_in_seconds} seconds."
+                )
+            self.stats.questions += 1
+            self.stats.answer_seconds += time.perf_counter() - submitted
+            logging.info(
+                f"Answer received from the warm runner[{self.run_id}] in "
+                f"{time.perf_counter() - submitted:.2f}s "
+                f"(submission overhead {submitted - start:.2f}s)"
+            )
+            if response.get("error"):
+                self.stats.errors += 1
+                raise RuntimeError(
+                    f"The warm runner failed to answer: {response['error']}"
+                )
+            return Answer(question=question, answer=response["answer"])
+
+    def stop(self) -> None:
+        """
+        Cancel the worker run.
+        """
+        with self._lock:
+            if self.run_id is not None:
+                self.workspace.jobs.cancel_run(run_id=self.run_id)
+                self.run_id = None
+
+
+class JobQueueWorker:
+    """
+    Worker running in the long-lived notebook run, it answers the questions of the queue by batches.
+    """
+
+    def __init__(
+        self,
+        storage: JobQueueStorage,
+        answer: Callable[[str], str],
+        batch_size: int = config.DATABRICKS_JOB_BATCH_SIZE,
+        concurrency: int = config.DATABRICKS_JOB_CONCURRENCY,
+        idle_timeout_in_seconds: int = config.DATABRICKS_JOB_IDLE_TIMEOUT_SECONDS,
+        poll_interval_in_seconds: float = 0.5,
+    ) -> None:
+        self.storage = storage
+        self.answer = answer
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.idle_timeout_in_seconds = idle_timeout_in_seconds
+        self.poll_interval_in_seconds = poll_interval_in_seconds
+
+    def _claim_batch(self) -> List[str]:
+        claimed = list()
+        for name in self.storage.list_names(REQUESTS_DIRECTORY):
+            if len(claimed) == self.batch_size:
+                break
+            if name.endswith(".json") and self.storage.move(
+                f"{REQUESTS_DIRECTORY}/{name}", f"{PROCESSING_DIRECTORY}/{name}"
+            ):
+                claimed.append(name)
+        return claimed
+
+    def _answer_question(self, name: str) -> None:
+        path = f"{PROCESSING_DIRECTORY}/{name}"
+        request = json.loads(self.storage.read(path))
+        start = time.perf_counter()
+        response = {"id": request["id"]}
+        try:
+            response["answer"] = self.answer(request["question"])
+        except Exception as exception:
+            logging.exception("An error occurred while answering the question.")
+            response["error"] = str(exception)
+        response["answer_seconds"] = time.perf_counter() - start
+        self.storage.write(
+            f"{RESPONSES_DIRECTORY}/{name}", json.dumps(response).encode("utf-8")
+        )
+        self.storage.delete(path)
+
+    def serve(self) -> int:
+        """
+        Answer the questions of the queue until it stays empty for the idle timeout.
+
+        :return: the number of questions answered
+        """
+        answered = 0
+        last_activity = time.monotonic()
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            while time.monotonic() - last_activity < self.idle_timeout_in_seconds:
+                batch = self._claim_batch()
+                if not batch:
+                    time.sleep(self.poll_interval_in_seconds)
+                    continue
+                logging.info(f"Answering a batch of {len(batch)} questions.")
+                list(executor.map(self._answer_question, batch))
+                answered += len(batch)
+                last_activity = time.monotonic()
+        logging.info(f"The warm runner is idle, stopping after {answered} answers.")
+        return answered
@@ -0,0 +1,210 @@
+import asyncio
+import logging
+import random
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from aiohttp import (
+    ClientError,
+    ClientResponseError,
+    ClientSession,
+    ClientTimeout,
+    TCPConnector,
+)
+
+from app.config import config
+from app.latency import LatencyRecorder
+from app.metrics import QUEUE_DEPTH
+
+RETRYABLE_EXCEPTIONS = (asyncio.TimeoutError, ClientError)
+
+
+class RetryBudget:
+    """
+    Limit the retries and the hedged requests to a ratio of the requests to avoid retry storms.
+    """
+
+    def __init__(self, ratio: float = 0.2, max_tokens: float = 10.0) -> None:
+        self.ratio = ratio
+        self.max_tokens = max_tokens
+        self.tokens = max_tokens
+
+    def deposit(self) -> None:
+        self.tokens = min(self.tokens + self.ratio, self.max_tokens)
+
+    def withdraw(self) -> bool:
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
+class AsyncLLMClient:
+    """
+    Asynchronous client of the LLM API hosted by the Delta-Buddy notebook behind the driver proxy.
+
+    The connections are pooled and kept alive, the concurrency is limited, the failed calls on 5xx
+    or timeouts are retried with jittered backoff and slow calls can be hedged by a second request.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        token: Optional[str] = None,
+        concurrency: int = config.DATABRICKS_LLM_CONCURRENCY,
+        timeout_in_seconds: float = config.DATABRICKS_LLM_TIMEOUT_SECONDS,
+        max_retries: int = config.DATABRICKS_LLM_MAX_RETRIES,
+        hedge_after_in_seconds: float = config.DATABRICKS_LLM_HEDGE_AFTER_SECONDS,
+        backoff_in_seconds: float = 0.5,
+        keepalive_timeout_in_seconds: float = 60.0,
+    ) -> None:
+        self.url = url
+        self.headers = {"Authorization": f"Bearer {token}"} if token else dict()
+        self.concurrency = concurrency
+        self.timeout_in_seconds = timeout_in_seconds
+        self.max_retries = max_retries
+        self.hedge_after_in_seconds = hedge_after_in_seconds
+        self.backoff_in_seconds = backoff_in_seconds
+        self.keepalive_timeout_in_seconds = keepalive_timeout_in_seconds
+        self.latencies = LatencyRecorder()
+        self.attempt_latencies = LatencyRecorder()
+        self.counters = {"calls": 0, "attempts": 0, "retries": 0, "hedges": 0}
+        self.retry_budget = RetryBudget()
+        self._session: Optional[ClientSession] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_lock = threading.Lock()
+
+    async def _get_session(self) -> ClientSession:
+        if self._session is None or self._session.closed:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+            self._session = ClientSession(
+                connector=TCPConnector(
+                    limit=self.concurrency * 2,
+                    keepalive_timeout=self.keepalive_timeout_in_seconds,
+                ),
+                headers=self.headers,
+                timeout=ClientTimeout(total=self.timeout_in_seconds),
+            )
+        return self._session
+
+    async def _post(self, payload: Dict[str, Any]) -> str:
+        session = await self._get_session()
+        start = time.perf_counter()
+        self.counters["attempts"] += 1
+        async with session.post(self.url, json=payload) as response:
+            response.raise_for_status()
+            answer = await response.json()
+        self.attempt_latencies.record(time.perf_counter() - start)
+        return answer
+
+    async def _post_hedged(self, payload: Dict[str, Any]) -> str:
+        """
+        Post the payload and hedge it with a second request if it is slower than the hedge delay.
+
+        :param payload: the payload to post
+        :return: the first answer received
+        """
+        if self.hedge_after_in_seconds <= 0:
+            return await self._post(payload)
+        primary = asyncio.ensure_future(self._post(payload))
+        done, _ = await asyncio.wait({primary}, timeout=self.hedge_after_in_seconds)
+        if done or not self.retry_budget.withdraw():
+            return await primary
+        self.counters["hedges"] += 1
+        hedge = asyncio.ensure_future(self._post(payload))
+        pending = {primary, hedge}
+        error: Optional[BaseException] = None
+        while pending:
+            done, pending = await asyncio.wait(
+                pending, return_when=asyncio.FIRST_COMPLETED
+            )
+            for task in done:
+                if task.exception() is None:
+                    for other in pending:
+                        other.cancel()
+                    return task.result()
+                error = task.exception()
+        raise error
+
+    def _is_retryable(self, exception: Exception) -> bool:
+        if isinstance(exception, ClientResponseError):
+            return exception.status >= 500
+        return isinstance(exception, RETRYABLE_EXCEPTIONS)
+
+    async def complete(self, prompt: str, stop: Optional[List[str]] = None) -> str:
+        """
+        Ask the LLM API to complete the prompt.
+
+        :param prompt: the prompt to complete
+        :param stop: the stop sequences
+        :return: the completion
+        """
+        payload = {"prompt": prompt, "stop": stop or list()}
+        await self._get_session()
+        with QUEUE_DEPTH.labels(queue="llm_client").track_inprogress():
+            return await self._complete(payload)
+
+    async def _complete(self, payload: Dict[str, Any]) -> str:
+        async with self._semaphore:
+            start = time.perf_counter()
+            self.counters["calls"] += 1
+            self.retry_budget.deposit()
+            attempt = 0
+            while True:
+                try:
+                    answer = await self._post_hedged(payload)
+                    self.latencies.record(time.perf_counter() - start)
+                    return answer
+                except Exception as exception:
+                    if (
+                        attempt >= self.max_retries
+                        or not self._is_retryable(exception)
+                        or not self.retry_budget.withdraw()
+                    ):
+                        raise
+                    backoff = random.uniform(0, self.backoff_in_seconds * 2**attempt)
+                    logging.warning(
+                        f"Retrying the LLM call in {backoff:.2f}s after: {exception}"
+                    )
+                    self.counters["retries"] += 1
+                    attempt += 1
+                    await asyncio.sleep(backoff)
+
+    def _get_loop(self) -> asyncio.AbstractEventLoop:
+        with self._loop_lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(target=self._loop.run_forever, daemon=True).start()
+            return self._loop
+
+    def complete_sync(self, prompt: str, stop: Optional[List[str]] = None) -> str:
+        """
+        Ask the LLM API to complete the prompt from synchronous code.
+
+        The calls run on a background event loop to share the connection pool between callers.
+
+        :param prompt: the prompt to complete
+        :param stop: the stop sequences
+        :return: the completion
+        """
+        return asyncio.run_coroutine_threadsafe(
+            self.complete(prompt=prompt, stop=stop), self._get_loop()
+        ).result()
+
+    def metrics(self) -> Dict[str, Any]:
+        """
+        Get the metrics of the client.
+
+        :return: the counters with the call and the attempt latencies
+        """
+        return {
+            **self.counters,
+            "latency": self.latencies.summary(),
+            "attempt_latency": self.attempt_latencies.summary(),
+        }
+
+    async def close(self) -> None:
+        if self._session is not None:
+            await self._session.close()
@@ -13,6 +13,8 @@ from langchain.llms import Databricks
 from pydantic import BaseModel
 
 from app.config import config
+from app.databricks_utils.job_runner import WarmJobRunner
+from app.databricks_utils.llm_client import AsyncLLMClient
 from app.models import Answer
 
 
@@ -23,6 +25,8 @@ class DatabricksManager(BaseModel):
 
     llm: Optional[Databricks] = None
     workspace: WorkspaceClient = None
+    job_runner: Optional[WarmJobRunner] = None
+    llm_client: Optional[AsyncLLMClient] = None
     clean_job: bool = True
 
     class Config:
@@ -80,6 +84,33 @@ class DatabricksManager(BaseModel):
             question=question,
         )
 
+    def get_llm_client(self) -> AsyncLLMClient:
+        """
+        Get or create the pooled client of the LLM API hosted by the notebook behind the driver proxy.
+
+        :return: the LLM client
+        """
+        if not self.llm_client:
+            self.llm_client = AsyncLLMClient(
+                url=f"https://{self.llm.host}/driver-proxy-api/o/0/"
+                f"{self.llm.cluster_id}/{self.llm.cluster_driver_port}",
+                token=self.llm.api_token,
+            )
+        return self.llm_client
+
+    def ask_warm_job_runner(self, question: str) -> Answer:
+        """
+        Ask a question to the long-lived Delta-Buddy run, it is submitted on the first question.
+
+        :param question: the question to ask.
+        :return: the answer to the question.
+        """
+        if not self.job_runner:
+            self.job_runner = WarmJobRunner(
+                workspace=self._get_or_create_databricks_workspace()
+            )
+        return self.job_runner.ask(question=question)
+
     @classmethod
     async def launch_llm_fast_api_from_notebook(
         cls,
@@ -0,0 +1,123 @@
+import logging
+import threading
+import time
+from typing import Any, Dict
+
+import torch
+from transformers import AutoModelForCausalLM, PreTrainedModel
+
+from app.generation.profiles import InferenceProfile
+
+
+class DraftModel:
+    """
+    Small draft model proposing the tokens verified by the LLM in assisted generation.
+
+    The draft model must share the tokenizer of the LLM, like a smaller model of the same family.
+    The generations run one at a time: the draft length adapted by transformers during a generation
+    is stored on the draft model, it is reset to the configured draft length for each generation.
+    """
+
+    def __init__(self, model: PreTrainedModel, draft_tokens: int = 5):
+        self.model = model
+        self.draft_tokens = draft_tokens
+        self.lock = threading.Lock()
+        self.reset_metrics()
+        self._draft_calls = 0
+        # Each forward pass of the draft model proposes one token
+        self.model.register_forward_hook(self._count_draft_call)
+
+    @classmethod
+    def load(
+        cls,
+        model_name: str,
+        profile: InferenceProfile,
+        device: torch.device,
+        draft_tokens: int,
+    ) -> "DraftModel":
+        """
+        Load the draft model with the precision of the inference profile on the device of the LLM.
+
+        :param model_name: the name of the draft model
+        :param profile: the inference profile of the LLM
+        :param device: the device of the LLM
+        :param draft_tokens: the number of tokens proposed before each verification
+        :return: the draft model
+        """
+        logging.info(f"Loading the draft model {model_name}...")
+        model = AutoModelForCausalLM.from_pretrained(
+            model_name, torch_dtype=profile.dtype, trust_remote_code=True
+        )
+        return cls(model=model.to(device).eval(), draft_tokens=draft_tokens)
+
+    def _count_draft_call(self, *_) -> None:
+        self._draft_calls += 1
+
+    def generate(
+        self, model: PreTrainedModel, input_ids: torch.Tensor, **generate_kwargs
+    ) -> torch.Tensor:
+        """
+        Generate with the LLM verifying the tokens proposed by the draft model.
+
+        :param model: the LLM
+        :param input_ids: the input ids
+        :param generate_kwargs: the generation arguments
+        :return: the input ids followed by the generated ids
+        """
+        verifications = 0
+
+        def count_verification(*_) -> None:
+            nonlocal verifications
+            verifications += 1
+
+        with self.lock:
+            self.model.max_assistant_tokens = float(self.draft_tokens)
+            self._draft_calls = 0
+            handle = model.register_forward_hook(count_verification)
+            start = time.perf_counter()
+            try:
+                output = model.generate(
+                    input_ids=input_ids, assistant_model=self.model, **generate_kwargs
+                )
+            finally:
+                handle.remove()
+            seconds = time.perf_counter() - start
+            new_tokens = output.shape[1] - input_ids.shape[1]
+            # Each verification keeps the accepted draft tokens and one token of the LLM
+            accepted_tokens = max(new_tokens - verifications, 0)
+            self.generations += 1
+            self.proposed_tokens += self._draft_calls
+            self.accepted_tokens += accepted_tokens
+            self.new_tokens += new_tokens
+            self.generation_seconds += seconds
+        logging.info(
+            f"Accepted {accepted_tokens}/{self._draft_calls} draft tokens, "
+            f"{new_tokens / seconds:.1f} tokens/s."
+        )
+        return output
+
+    def reset_metrics(self) -> None:
+        self.generations = 0
+        self.proposed_tokens = 0
+        self.accepted_tokens = 0
+        self.new_tokens = 0
+        self.generation_seconds = 0.0
+
+    def metrics(self) -> Dict[str, Any]:
+        """
+        Get the acceptance rate of the draft tokens and the throughput of the generations.
+
+        :return: the metrics
+        """
+        return {
+            "draft_tokens": self.draft_tokens,
+            "generations": self.generations,
+            "proposed_tokens": self.proposed_tokens,
+            "accepted_tokens": self.accepted_tokens,
+            "acceptance_rate": self.accepted_tokens / self.proposed_tokens
+            if self.proposed_tokens
+            else 0.0,
+            "tokens_per_second": self.new_tokens / self.generation_seconds
+            if self.generation_seconds
+            else 0.0,
+        }
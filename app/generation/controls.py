@@ -0,0 +1,121 @@
+import time
+from typing import List, Optional, Sequence
+
+import torch
+from pydantic import BaseModel, Field
+from transformers import StoppingCriteria
+
+from app.config import config
+from app.consts import CONTEXT_KEY, INSTRUCTION_KEY
+from app.models import LLMInput
+
+# The model keeps going with a made-up turn of the prompt after its answer
+DEFAULT_STOP_SEQUENCES = [INSTRUCTION_KEY, CONTEXT_KEY]
+
+
+class GenerationControls(BaseModel):
+    """
+    Per-request limits of the generation of an answer.
+    """
+
+    stop: List[str] = Field(default_factory=list)
+    max_new_tokens: Optional[int] = None
+    deadline_seconds: Optional[float] = config.GENERATION_DEADLINE_SECONDS or None
+
+    @classmethod
+    def from_llm_input(cls, llm_input: LLMInput) -> "GenerationControls":
+        """
+        Get the controls of a request of the API, the deadline defaults to the configured one.
+
+        :param llm_input: the request
+        :return: the controls
+        """
+        return cls(
+            stop=llm_input.stop or list(),
+            max_new_tokens=llm_input.max_new_tokens,
+            deadline_seconds=llm_input.deadline_seconds
+            or config.GENERATION_DEADLINE_SECONDS
+            or None,
+        )
+
+    @property
+    def stop_sequences(self) -> List[str]:
+        """
+        Get the stop sequences of the caller followed by the markers of the prompt.
+        """
+        return list(
+            dict.fromkeys(
+                sequence for sequence in self.stop + DEFAULT_STOP_SEQUENCES if sequence
+            )
+        )
+
+
+def truncate_at_stop(text: str, stop: List[str]) -> str:
+    """
+    Cut a text at the first occurrence of any stop sequence.
+
+    :param text: the text
+    :param stop: the stop sequences
+    :return: the text before the first stop sequence
+    """
+    positions = [text.find(sequence) for sequence in stop if sequence]
+    positions = [position for position in positions if position >= 0]
+    return text[: min(positions)] if positions else text
+
+
+class StopSequenceCriteria(StoppingCriteria):
+    """
+    Stop the generation as soon as a stop sequence is generated.
+
+    Only the tokens generated since the previous step are decoded, after enough tokens to hold the longest
+    stop sequence: the assisted generation can accept several tokens in one step.
+    The stop tokens, like the end key of the instruction models, are removed by the decoding: they are
+    matched on the token ids generated since the previous step.
+    """
+
+    def __init__(
+        self,
+        tokenizer,
+        stop: List[str],
+        prompt_length: int,
+        stop_token_ids: Sequence[int] = (),
+    ) -> None:
+        self.tokenizer = tokenizer
+        self.stop = stop
+        self.prompt_length = prompt_length
+        self.stop_token_ids = set(stop_token_ids)
+        self.checked_length = prompt_length
+        self.window = (
+            max(len(tokenizer.encode(sequence)) for sequence in stop) + 2 if stop else 0
+        )
+        self.stopped = False
+
+    def __call__(
+        self, input_ids: torch.LongTensor, scores: torch.FloatTensor, **kwargs
+    ) -> bool:
+        checked_length, self.checked_length = self.checked_length, input_ids.shape[1]
+        if self.stop_token_ids.intersection(input_ids[0, checked_length:].tolist()):
+            self.stopped = True
+            return True
+        if not self.window:
+            return False
+        start = max(self.prompt_length, checked_length - self.window)
+        tail = self.tokenizer.decode(input_ids[0, start:], skip_special_tokens=True)
+        self.stopped = any(sequence in tail for sequence in self.stop)
+        return self.stopped
+
+
+class DeadlineCriteria(StoppingCriteria):
+    """
+    Stop the generation once the wall-clock deadline of the request is reached.
+    """
+
+    def __init__(self, deadline: float) -> None:
+        self.deadline = deadline
+        self.expired = False
+
+    def __call__(
+        self, input_ids: torch.LongTensor, scores: torch.FloatTensor, **kwargs
+    ) -> bool:
+        self.expired = time.monotonic() >= self.deadline
+        return self.expired
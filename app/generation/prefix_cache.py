@@ -0,0 +1,230 @@
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+
+import torch
+from langchain.callbacks.manager import CallbackManagerForLLMRun
+from langchain.llms.base import LLM
+from pydantic import Field
+from transformers import Pipeline, StoppingCriteriaList
+
+from app.consts import DOLLY_END_KEY, DOLLY_INSTRUCTION_FORMAT, PROMPT_FORMAT
+from app.generation.assisted import DraftModel
+from app.generation.controls import (
+    DeadlineCriteria,
+    StopSequenceCriteria,
+    truncate_at_stop,
+)
+from app.metrics import GENERATION_STOPS, record_cache, stage
+
+# The static part of the prompt, before the retrieved context
+PROMPT_PREFIX = PROMPT_FORMAT[: PROMPT_FORMAT.index("{context}")]
+
+
+class PrefixCachedLLM(LLM):
+    """
+    LLM reusing the key/value cache of the static prefix of the prompt.
+
+    The cache of the prefix is computed once, so the prefill of each request only covers the retrieved
+    context and the question. The prompts not starting with the prefix tokens are fully prefilled.
+    The instruction models get their instruction template around the prompt and stop on their end key,
+    like their own pipeline, the plain text generation models get the prompt as it is.
+    With a draft model, the tokens proposed by the draft model are verified by the LLM.
+    The generation stops on the stop sequences and on the deadline, only the new text is decoded.
+    """
+
+    model: Any
+    tokenizer: Any
+    prefix: str = ""
+    instruction_format: str = "{instruction}"
+    end_token_ids: List[int] = Field(default_factory=list)
+    max_new_tokens: int = 1024
+    generate_kwargs: Dict[str, Any] = Field(default_factory=dict)
+    prefix_ids: List[int] = Field(default_factory=list)
+    prefix_past_key_values: Any = None
+    draft_model: Optional[DraftModel] = None
+
+    @classmethod
+    def from_pipeline(
+        cls,
+        instruct_pipeline: Pipeline,
+        prefix: str = PROMPT_PREFIX,
+        max_new_tokens: int = 1024,
+        draft_model: Optional[DraftModel] = None,
+        **generate_kwargs,
+    ) -> "PrefixCachedLLM":
+        """
+        Create the LLM from the model and the tokenizer of a text generation pipeline.
+
+        :param instruct_pipeline: the text generation pipeline
+        :param prefix: the static prefix of the prompts, empty to disable the cache
+        :param max_new_tokens: the maximum number of tokens to generate
+        :param draft_model: the draft model of the assisted generation, None to disable it
+        :param generate_kwargs: the generation arguments
+        :return: the LLM with the cache of the prefix
+        """
+        tokenizer = instruct_pipeline.tokenizer
+        instruction_format, end_token_ids = "{instruction}", list()
+        if DOLLY_END_KEY in tokenizer.additional_special_tokens:
+            instruction_format = DOLLY_INSTRUCTION_FORMAT
+            end_token_ids = [tokenizer.convert_tokens_to_ids(DOLLY_END_KEY)]
+        llm = cls(
+            model=instruct_pipeline.model,
+            tokenizer=tokenizer,
+            prefix=prefix,
+            instruction_format=instruction_format,
+            end_token_ids=end_token_ids,
+            max_new_tokens=max_new_tokens,
+            draft_model=draft_model,
+            generate_kwargs=generate_kwargs,
+        )
+        llm.cache_prefix()
+        return llm
+
+    @property
+    def _llm_type(self) -> str:
+        return "prefix_cached_huggingface"
+
+    def get_num_tokens(self, text: str) -> int:
+        return len(self.encode(text))
+
+    def encode(self, text: str) -> List[int]:
+        return self.tokenizer(text, return_token_type_ids=False)["input_ids"]
+
+    def format_prompt(self, prompt: str) -> str:
+        """
+        Wrap a prompt in the instruction template of the model.
+
+        :param prompt: the prompt
+        :return: the instruction given to the model
+        """
+        return self.instruction_format.replace("{instruction}", prompt)
+
+    def _tensor(self, ids: List[int]) -> torch.Tensor:
+        return torch.tensor([ids], device=self.model.device)
+
+    def cache_prefix(self) -> None:
+        """
+        Compute the key/value cache of the prefix.
+
+        Only the prefix tokens unchanged by the text following them are cached: the tokenizer can
+        merge the end of the prefix with the beginning of the context.
+        """
+        if not self.prefix:
+            return
+        template = self.instruction_format
+        prefix = template[: template.index("{instruction}")] + self.prefix
+        ids = self.encode(prefix)
+        for probe in ("a", "\n", " "):
+            probe_ids = self.encode(prefix + probe)
+            stable = 0
+            while stable < len(ids) and ids[stable] == probe_ids[stable]:
+                stable += 1
+            ids = ids[:stable]
+        self.prefix_ids = ids
+        with torch.no_grad():
+            self.prefix_past_key_values = self.model(
+                input_ids=self._tensor(ids), use_cache=True
+            ).past_key_values
+        logging.info(f"The key/value cache of {len(ids)} prefix tokens is computed.")
+
+    def prefill(self, prompt: str) -> Tuple[torch.Tensor, Any, int]:
+        """
+        Prefill the key/value cache of a prompt, reusing the cache of the prefix when possible.
+
+        The last token is not prefilled: the generation starts by feeding it.
+
+        :param prompt: the prompt, without the instruction template
+        :return: the input ids, the key/value cache of all the tokens but the last one
+                 and the number of tokens reused from the cache of the prefix
+        """
+        ids = self.encode(self.format_prompt(prompt))
+        reused = len(self.prefix_ids)
+        if not reused or len(ids) <= reused or ids[:reused] != self.prefix_ids:
+            reused = 0
+        past_key_values = self.prefix_past_key_values if reused else None
+        if len(ids) - 1 > reused:
+            with torch.no_grad():
+                past_key_values = self.model(
+                    input_ids=self._tensor(ids[reused:-1]),
+                    past_key_values=past_key_values,
+                    use_cache=True,
+                ).past_key_values
+        return self._tensor(ids), past_key_values, reused
+
+    def _call(
+        self,
+        prompt: str,
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        max_new_tokens: Optional[int] = None,
+        deadline: Optional[float] = None,
+        **kwargs: Any,
+    ) -> str:
+        """
+        Generate the answer of a prompt.
+
+        :param prompt: the prompt
+        :param stop: the stop sequences, excluded from the answer
+        :param run_manager: the callbacks of the run
+        :param max_new_tokens: the maximum number of tokens to generate, None for the default one
+        :param deadline: the time.monotonic() after which the generation stops, None for no deadline
+        :return: the generated text, without the prompt
+        """
+        with stage("prefill"):
+            input_ids, past_key_values, reused = self.prefill(prompt)
+        if self.prefix_ids:
+            record_cache("prompt_prefix", hit=reused > 0)
+        max_new_tokens = min(max_new_tokens or self.max_new_tokens, self.max_new_tokens)
+        stop_criteria = StopSequenceCriteria(
+            self.tokenizer,
+            stop=stop or list(),
+            prompt_length=input_ids.shape[1],
+            stop_token_ids=self.end_token_ids,
+        )
+        stopping_criteria = StoppingCriteriaList([stop_criteria])
+        deadline_criteria = None
+        if deadline:
+            deadline_criteria = DeadlineCriteria(deadline)
+            stopping_criteria.append(deadline_criteria)
+        generate_kwargs = dict(
+            attention_mask=torch.ones_like(input_ids),
+            past_key_values=past_key_values,
+            max_new_tokens=max_new_tokens,
+            pad_token_id=self.tokenizer.eos_token_id,
+            eos_token_id=[self.tokenizer.eos_token_id, *self.end_token_ids],
+            stopping_criteria=stopping_criteria,
+            **self.generate_kwargs,
+        )
+        with stage("decode"), torch.no_grad():
+            if self.draft_model:
+                output = self.draft_model.generate(
+                    self.model, input_ids, **generate_kwargs
+                )
+            else:
+                output = self.model.generate(input_ids=input_ids, **generate_kwargs)
+        new_ids = output[0, input_ids.shape[1] :].tolist()
+        new_tokens = len(new_ids)
+        ends = [
+            position
+            for position, token_id in enumerate(new_ids)
+            if token_id in self.end_token_ids
+        ]
+        if ends:
+            # The tokens following the end key are not part of the response
+            new_ids = new_ids[: ends[0]]
+            reason = "eos"
+        elif stop_criteria.stopped:
+            reason = "stop_sequence"
+        elif deadline_criteria and deadline_criteria.expired:
+            reason = "deadline"
+        elif new_tokens >= max_new_tokens:
+            reason = "max_tokens"
+        else:
+            reason = "eos"
+        GENERATION_STOPS.labels(reason=reason).inc()
+        if reason == "deadline":
+            logging.warning(
+                f"The generation reached its deadline after {new_tokens} tokens."
+            )
+        text = self.tokenizer.decode(new_ids, skip_special_tokens=True)
+        return truncate_at_stop(text, stop) if stop else text
@@ -0,0 +1,105 @@
+import logging
+from typing import Optional
+
+import torch
+from pydantic import BaseModel
+from transformers import Pipeline, pipeline
+
+from app.config import InferenceDevice, InferenceQuantization, config
+
+
+class InferenceProfile(BaseModel):
+    """
+    Profile of the LLM inference: device, precision, quantization and threads.
+    """
+
+    device: InferenceDevice = InferenceDevice.AUTO
+    quantization: InferenceQuantization = InferenceQuantization.NONE
+    torch_dtype: Optional[str] = None
+    intra_op_threads: int = 0
+    inter_op_threads: int = 0
+    max_new_tokens: int = 1024
+
+    @classmethod
+    def from_config(cls) -> "InferenceProfile":
+        return cls(
+            device=config.INFERENCE_DEVICE,
+            quantization=config.INFERENCE_QUANTIZATION,
+            intra_op_threads=config.INFERENCE_INTRA_OP_THREADS,
+            inter_op_threads=config.INFERENCE_INTER_OP_THREADS,
+            max_new_tokens=config.MAX_NEW_TOKENS,
+        )
+
+    @property
+    def uses_gpu(self) -> bool:
+        if self.device == InferenceDevice.AUTO:
+            return torch.cuda.is_available()
+        return self.device == InferenceDevice.GPU
+
+    @property
+    def dtype(self) -> torch.dtype:
+        """
+        Get the precision of the weights, bfloat16 on GPU and float32 on CPU by default.
+        """
+        if self.torch_dtype:
+            return getattr(torch, self.torch_dtype)
+        return torch.bfloat16 if self.uses_gpu else torch.float32
+
+
+def configure_threads(profile: InferenceProfile) -> None:
+    """
+    Configure the intra-op and inter-op threads of torch, 0 keeps the default of torch.
+
+    :param profile: the inference profile
+    """
+    if profile.intra_op_threads:
+        torch.set_num_threads(profile.intra_op_threads)
+    if profile.inter_op_threads:
+        try:
+            torch.set_num_interop_threads(profile.inter_op_threads)
+        except RuntimeError:
+            # It can only be set once, before any inter-op parallel work has started
+            logging.warning(
+                "The inter-op threads of torch are already configured, keeping "
+                f"{torch.get_num_interop_threads()} threads."
+            )
+    logging.info(
+        f"Torch uses {torch.get_num_threads()} intra-op and "
+        f"{torch.get_num_interop_threads()} inter-op threads."
+    )
+
+
+def load_instruct_pipeline(
+    model_name: str, profile: InferenceProfile, **pipeline_kwargs
+) -> Pipeline:
+    """
+    Load the text generation pipeline of the LLM with an inference profile.
+
+    :param model_name: the name of the LLM
+    :param profile: the inference profile
+    :param pipeline_kwargs: the generation arguments of the pipeline
+    :return: the pipeline
+    """
+    configure_threads(profile)
+    if profile.uses_gpu:
+        torch.cuda.empty_cache()
+        device_kwargs = {"device_map": "auto"}
+    else:
+        device_kwargs = {"device": "cpu"}
+    instruct_pipeline = pipeline(
+        task="text-generation",
+        model=model_name,
+        torch_dtype=profile.dtype,
+        trust_remote_code=True,
+        max_new_tokens=profile.max_new_tokens,
+        **device_kwargs,
+        **pipeline_kwargs,
+    )
+    if profile.quantization == InferenceQuantization.INT8:
+        if profile.uses_gpu:
+            raise ValueError("The int8 dynamic quantization only runs on CPU.")
+        logging.info("Quantizing dynamically the linear layers of the LLM in int8.")
+        instruct_pipeline.model = torch.quantization.quantize_dynamic(
+            instruct_pipeline.model.float(), {torch.nn.Linear}, dtype=torch.qint8
+        )
+    return instruct_pipeline
@@ -0,0 +1,75 @@
+import re
+from typing import List, Tuple
+
+from app.config import config
+
+SMALL = "small"
+LARGE = "large"
+WORD = re.compile(r"\w+")
+
+
+class QuestionRouter:
+    """
+    Router sending the easy questions to the small LLM and the hard ones to the large LLM.
+
+    A question is easy when it is short, asks for no explanation and one retrieved chunk stands out:
+    the answer is then a lookup in the context. The features are computed from the question and the
+    relevance scores of the retrieval shared by both routes, without any model call.
+    """
+
+    def __init__(
+        self,
+        max_question_words: int = 20,
+        min_score_spread: float = 0.05,
+        hard_keywords: Tuple[str, ...] = (),
+    ) -> None:
+        """
+        :param max_question_words: the maximum number of words of an easy question
+        :param min_score_spread: the minimum relative gap of the best and worst relevance scores of an easy question
+        :param hard_keywords: the words of the questions asking for an explanation, a comparison or a diagnosis
+        """
+        self.max_question_words = max_question_words
+        self.min_score_spread = min_score_spread
+        self.hard_keywords = {keyword.lower() for keyword in hard_keywords}
+
+    @classmethod
+    def from_config(cls) -> "QuestionRouter":
+        return cls(
+            max_question_words=config.ROUTING_MAX_QUESTION_WORDS,
+            min_score_spread=config.ROUTING_MIN_SCORE_SPREAD,
+            hard_keywords=tuple(config.ROUTING_HARD_KEYWORDS),
+        )
+
+    @staticmethod
+    def score_spread(scores: List[float]) -> float:
+        """
+        Get the gap between the best and the worst scores relative to the best one.
+
+        The relative gap compares the similarities of the vector search and the BM25 scores of the
+        lexical search alike.
+
+        :param scores: the relevance scores of the retrieved chunks, the best first
+        :return: the relative gap, 0 when the scores are flat
+        """
+        if len(scores) < 2 or scores[0] <= 0:
+            return 0.0
+        return (scores[0] - scores[-1]) / scores[0]
+
+    def route(self, question: str, scores: List[float]) -> Tuple[str, str]:
+        """
+        Route a question from its features.
+
+        :param question: the question
+        :param scores: the relevance scores of the retrieved chunks, the best first
+        :return: the route and its reason
+        """
+        words = WORD.findall(question.lower())
+        if not scores:
+            return LARGE, "no_context"
+        if len(words) > self.max_question_words:
+            return LARGE, "long_question"
+        if self.hard_keywords.intersection(words):
+            return LARGE, "keyword"
+        if self.score_spread(scores) < self.min_score_spread:
+            return LARGE, "flat_scores"
+        return SMALL, "easy"
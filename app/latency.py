@@ -0,0 +1,78 @@
+import math
+import threading
+from collections import deque
+from typing import Deque, Dict, Sequence
+
+
+def percentile(samples: Sequence[float], quantile: float) -> float:
+    """
+    Compute a percentile with the nearest-rank method.
+
+    :param samples: the samples
+    :param quantile: the quantile between 0 and 100
+    :return: the percentile or 0.0 without samples
+    """
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    rank = max(math.ceil(quantile / 100 * len(ordered)), 1)
+    return ordered[rank - 1]
+
+
+class LatencyRecorder:
+    """
+    Thread-safe recorder of latencies in seconds.
+
+    Only the last latencies are kept for the percentiles, the memory stays bounded in a long-lived
+    process, the count covers all the recorded latencies.
+    """
+
+    def __init__(self, max_samples: int = 10000) -> None:
+        """
+        :param max_samples: the number of last latencies kept for the percentiles
+        """
+        self._samples: Deque[float] = deque(maxlen=max_samples)
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float) -> None:
+        """
+        Record a latency.
+
+        :param seconds: the latency in seconds
+        """
+        with self._lock:
+            self._samples.append(seconds)
+            self._count += 1
+
+    @property
+    def count(self) -> int:
+        return self._count
+
+    def percentile(self, quantile: float) -> float:
+        """
+        Get a percentile of the recorded latencies.
+
+        :param quantile: the quantile between 0 and 100
+        :return: the percentile in seconds
+        """
+        with self._lock:
+            return percentile(self._samples, quantile)
+
+    def summary(self) -> Dict[str, float]:
+        """
+        Summarize the recorded latencies.
+
+        :return: the count of all the latencies, the mean, p50, p95, p99 and max of the last ones
+        """
+        with self._lock:
+            samples = list(self._samples)
+            count = self._count
+        return {
+            "count": count,
+            "mean": sum(samples) / len(samples) if samples else 0.0,
+            "p50": percentile(samples, 50),
+            "p95": percentile(samples, 95),
+            "p99": percentile(samples, 99),
+            "max": max(samples, default=0.0),
+        }
@@ -1,8 +1,22 @@
 import logging
+from typing import Any, Dict, List, Optional
 
-from fastapi import FastAPI
+from fastapi import FastAPI, Header, HTTPException, Response
+from fastapi.concurrency import run_in_threadpool
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
 
-from app.models import LLMInput
+from app.config import config
+from app.generation.controls import GenerationControls
+from app.models import (
+    Answer,
+    LLMInput,
+    SearchBatchInput,
+    SearchBatchResults,
+    SearchInput,
+    SearchOptions,
+    SearchResults,
+)
+from app.retrieval.artifact import list_versions
 from app.state import chat_bot
 
 app = FastAPI()
@@ -11,6 +25,114 @@ app = FastAPI()
 @app.post("/")
 async def llm(llm_input: LLMInput):
     logging.info(f"Received input: {llm_input})")
-    answer = chat_bot.chat(question=llm_input.prompt)
+    answer = await run_in_threadpool(
+        chat_bot.chat,
+        question=llm_input.prompt,
+        controls=GenerationControls.from_llm_input(llm_input),
+    )
     logging.info(f"Answering with the answer: {answer}")
     return answer.answer
+
+
+@app.post("/chat")
+async def chat(llm_input: LLMInput) -> Answer:
+    logging.info(f"Received input: {llm_input})")
+    return await run_in_threadpool(
+        chat_bot.chat,
+        question=llm_input.prompt,
+        controls=GenerationControls.from_llm_input(llm_input),
+    )
+
+
+async def search_chunks(
+    queries: List[str], options: SearchOptions
+) -> List[SearchResults]:
+    if chat_bot.index_holder is None:
+        raise HTTPException(status_code=404, detail="No local index is served.")
+    if options.offset + options.limit > config.SEARCH_MAX_RESULTS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Only the first {config.SEARCH_MAX_RESULTS} chunks can be paginated.",
+        )
+    if len(queries) > config.SEARCH_MAX_BATCH_QUERIES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"At most {config.SEARCH_MAX_BATCH_QUERIES} queries can be searched together.",
+        )
+    where = {"source": options.sources} if options.sources else None
+    try:
+        index_version, results = await run_in_threadpool(
+            chat_bot.search,
+            queries=queries,
+            # Every page is cut from the same ranking, for the pages to follow each other
+            k=max(config.HYBRID_CANDIDATES, config.SEARCH_MAX_RESULTS),
+            where=where,
+        )
+    except ValueError as exception:
+        raise HTTPException(status_code=400, detail=str(exception))
+    return [
+        SearchResults.from_scored_documents(
+            query=query,
+            scored_documents=scored_documents,
+            options=options,
+            max_results=config.SEARCH_MAX_RESULTS,
+            index_version=index_version,
+        )
+        for query, scored_documents in zip(queries, results)
+    ]
+
+
+@app.post("/search")
+async def search(search_input: SearchInput) -> SearchResults:
+    logging.info(f"Received search: {search_input}")
+    return (await search_chunks([search_input.query], search_input))[0]
+
+
+@app.post("/search/batch")
+async def search_batch(search_input: SearchBatchInput) -> SearchBatchResults:
+    logging.info(f"Received {len(search_input.queries)} searches")
+    return SearchBatchResults(
+        results=await search_chunks(search_input.queries, search_input)
+    )
+
+
+@app.get("/metrics")
+async def metrics() -> Response:
+    return Response(content=generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+
+def check_admin_token(admin_token: Optional[str]) -> None:
+    if not config.ADMIN_TOKEN:
+        raise HTTPException(
+            status_code=403, detail="The admin endpoints require an ADMIN_TOKEN."
+        )
+    if admin_token != config.ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Invalid admin token.")
+    if chat_bot.index_holder is None:
+        raise HTTPException(status_code=404, detail="No local index is served.")
+
+
+@app.get("/admin/index")
+async def index_status(
+    x_admin_token: Optional[str] = Header(default=None),
+) -> Dict[str, Any]:
+    check_admin_token(x_admin_token)
+    return chat_bot.index_holder.status()
+
+
+@app.post("/admin/index/reload", status_code=202)
+async def reload_index(
+    version: Optional[str] = None,
+    x_admin_token: Optional[str] = Header(default=None),
+) -> Dict[str, Any]:
+    check_admin_token(x_admin_token)
+    if version and not config.INDEX_ARTIFACT_DIRECTORY:
+        raise HTTPException(
+            status_code=400,
+            detail="Only the versions of the index artifact can be loaded.",
+        )
+    if version and version not in list_versions(config.INDEX_ARTIFACT_DIRECTORY):
+        raise HTTPException(status_code=404, detail=f"Unknown version {version}.")
+    if not chat_bot.index_holder.reload(version=version):
+        raise HTTPException(status_code=409, detail="The index is already reloading.")
+    return chat_bot.index_holder.status()
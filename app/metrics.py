@@ -0,0 +1,229 @@
+import logging
+import sys
+import threading
+import time
+import traceback
+from collections import Counter as SampleCounter
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional
+
+from prometheus_client import Counter, Gauge, Histogram, Info, start_http_server
+
+from app.config import config
+
+STAGE_SECONDS = Histogram(
+    "delta_buddy_stage_seconds",
+    "Latency of the stages of the question answering and of the ingestion.",
+    ["pipeline", "stage"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300),
+)
+TOKENS = Counter(
+    "delta_buddy_tokens", "Tokens of the prompts and of the completions.", ["kind"]
+)
+TOKENS_PER_SECOND = Histogram(
+    "delta_buddy_generation_tokens_per_second",
+    "Completion tokens generated by second of generation.",
+    buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500, 1000),
+)
+GENERATION_STOPS = Counter(
+    "delta_buddy_generation_stops",
+    "Generations by reason of their end: eos, stop_sequence, max_tokens or deadline.",
+    ["reason"],
+)
+ROUTED_QUESTIONS = Counter(
+    "delta_buddy_routed_questions",
+    "Questions by route of their generation, small or large LLM, and reason of the route.",
+    ["route", "reason"],
+)
+ROUTE_GENERATION_SECONDS = Histogram(
+    "delta_buddy_route_generation_seconds",
+    "Latency of the generations by route.",
+    ["route"],
+    buckets=(0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300),
+)
+ROUTE_TOKENS = Counter(
+    "delta_buddy_route_tokens",
+    "Tokens of the prompts and of the completions by route.",
+    ["route", "kind"],
+)
+QUEUE_DEPTH = Gauge(
+    "delta_buddy_queue_depth", "Requests in progress or waiting.", ["queue"]
+)
+CACHE_REQUESTS = Counter(
+    "delta_buddy_cache_requests",
+    "Lookups of the caches by result.",
+    ["cache", "result"],
+)
+COALESCED_CALLS = Counter(
+    "delta_buddy_coalesced_calls",
+    "Calls of the single flights: the leaders run the call, the followers share its result.",
+    ["flight", "role"],
+)
+QUERY_BATCH_SIZE = Histogram(
+    "delta_buddy_query_encoder_batch_size",
+    "Queries embedded by forward pass of the query encoder.",
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128),
+)
+RETRIEVALS = Counter(
+    "delta_buddy_retrievals",
+    "Retrievals of the chunks by mode: vector, hybrid or lexical only.",
+    ["mode"],
+)
+SHARD_SEARCHES = Counter(
+    "delta_buddy_shard_searches", "Searches of the shards of the chunks.", ["shard"]
+)
+INDEX_RELOADS = Counter(
+    "delta_buddy_index_reloads",
+    "Reloads of the index by result: swapped, unchanged or failed.",
+    ["result"],
+)
+INDEX_VERSION = Info("delta_buddy_index", "Version of the served index.")
+INGESTED = Counter(
+    "delta_buddy_ingested", "Documents and chunks ingested in the database.", ["kind"]
+)
+SLOW_REQUESTS = Counter(
+    "delta_buddy_slow_requests",
+    "Requests profiled for being slower than the threshold.",
+)
+
+
+@contextmanager
+def stage(name: str, pipeline: str = "chat") -> Iterator[None]:
+    """
+    Time a stage in the latency histogram of its pipeline.
+
+    :param name: the name of the stage
+    :param pipeline: the name of the pipeline, chat or ingestion
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.labels(pipeline=pipeline, stage=name).observe(
+            time.perf_counter() - start
+        )
+
+
+def record_cache(cache: str, hit: bool) -> None:
+    CACHE_REQUESTS.labels(cache=cache, result="hit" if hit else "miss").inc()
+
+
+def record_generation(
+    prompt_tokens: int,
+    completion_tokens: int,
+    generation_seconds: float,
+    route: Optional[str] = None,
+) -> None:
+    """
+    Record the tokens of a generation and its throughput.
+
+    :param prompt_tokens: the number of tokens of the prompt
+    :param completion_tokens: the number of generated tokens
+    :param generation_seconds: the duration of the generation
+    :param route: the route of the generation, None without routing
+    """
+    TOKENS.labels(kind="prompt").inc(prompt_tokens)
+    TOKENS.labels(kind="completion").inc(completion_tokens)
+    if generation_seconds > 0:
+        TOKENS_PER_SECOND.observe(completion_tokens / generation_seconds)
+    if route:
+        ROUTE_GENERATION_SECONDS.labels(route=route).observe(generation_seconds)
+        ROUTE_TOKENS.labels(route=route, kind="prompt").inc(prompt_tokens)
+        ROUTE_TOKENS.labels(route=route, kind="completion").inc(completion_tokens)
+
+
+def stage_summary(pipeline: str) -> Dict[str, Dict[str, float]]:
+    """
+    Summarize the stages of a pipeline recorded by this process.
+
+    :param pipeline: the name of the pipeline
+    :return: the count and the total seconds by stage
+    """
+    summary = dict()
+    for metric in STAGE_SECONDS.collect():
+        for sample in metric.samples:
+            if sample.labels.get("pipeline") != pipeline:
+                continue
+            name = sample.labels["stage"]
+            if sample.name.endswith("_count"):
+                summary.setdefault(name, dict())["count"] = sample.value
+            elif sample.name.endswith("_sum"):
+                summary.setdefault(name, dict())["seconds"] = sample.value
+    return summary
+
+
+def start_metrics_server(port: int = config.METRICS_PORT) -> None:
+    """
+    Expose the metrics on a dedicated HTTP server, for the processes without the API.
+
+    :param port: the port of the server, 0 disables it
+    """
+    if port:
+        start_http_server(port)
+        logging.info(f"The metrics are exposed on the port {port}.")
+
+
+class SlowRequestProfiler:
+    """
+    Sampling profiler logging where the time goes in the requests slower than a threshold.
+
+    The stacks of the profiled thread are sampled at a fixed interval and logged in the folded format
+    of the flame graphs. A threshold of 0 disables the profiler and its sampling thread.
+    """
+
+    def __init__(
+        self,
+        threshold_in_seconds: float = config.SLOW_REQUEST_PROFILING_SECONDS,
+        interval_in_seconds: float = 0.01,
+        top_stacks: int = 5,
+    ) -> None:
+        self.threshold_in_seconds = threshold_in_seconds
+        self.interval_in_seconds = interval_in_seconds
+        self.top_stacks = top_stacks
+
+    @staticmethod
+    def _fold(frame) -> str:
+        return ";".join(
+            f"{frame.f_code.co_name} ({frame.f_code.co_filename}:{line})"
+            for frame, line in reversed(list(traceback.walk_stack(frame)))
+        )
+
+    @contextmanager
+    def profile(self, name: str) -> Iterator[None]:
+        """
+        Profile the current thread while running a request.
+
+        :param name: the name of the request in the logs
+        """
+        if self.threshold_in_seconds <= 0:
+            yield
+            return
+        thread_id = threading.get_ident()
+        samples = SampleCounter()
+        done = threading.Event()
+
+        def sample() -> None:
+            while not done.wait(self.interval_in_seconds):
+                frame = sys._current_frames().get(thread_id)
+                if frame is not None:
+                    samples[self._fold(frame)] += 1
+
+        sampler = threading.Thread(target=sample, daemon=True)
+        start = time.perf_counter()
+        sampler.start()
+        try:
+            yield
+        finally:
+            done.set()
+            sampler.join()
+            seconds = time.perf_counter() - start
+            if seconds >= self.threshold_in_seconds:
+                SLOW_REQUESTS.inc()
+                stacks = "\n".join(
+                    f"{stack} {count}"
+                    for stack, count in samples.most_common(self.top_stacks)
+                )
+                logging.warning(
+                    f"Slow request {name} in {seconds:.2f}s, "
+                    f"top stacks of {sum(samples.values())} samples:\n{stacks}"
+                )
@@ -1,6 +1,6 @@
-from typing import List, Optional
+from typing import Any, Dict, List, Optional, Tuple
 
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 
 
 class Answer(BaseModel):
@@ -10,6 +10,12 @@ class Answer(BaseModel):
 
     question: str
     answer: str
+    retrieval_seconds: Optional[float] = None
+    generation_seconds: Optional[float] = None
+    prompt_tokens: Optional[int] = None
+    completion_tokens: Optional[int] = None
+    index_version: Optional[str] = None
+    route: Optional[str] = None
 
     @classmethod
     def to_html(cls, question: str, answer: str) -> "Answer":
@@ -33,3 +39,111 @@ class LLMInput(BaseModel):
 
     prompt: str
     stop: Optional[List[str]]
+    max_new_tokens: Optional[int] = None
+    deadline_seconds: Optional[float] = None
+
+
+class SearchOptions(BaseModel):
+    """
+    Pagination and filters of the retrieval of chunks.
+    """
+
+    limit: int = Field(default=10, ge=1)
+    offset: int = Field(default=0, ge=0)
+    sources: Optional[List[str]] = None
+
+
+class SearchInput(SearchOptions):
+    """
+    Input of the retrieval of the chunks of a query.
+    """
+
+    query: str
+
+
+class SearchBatchInput(SearchOptions):
+    """
+    Input of the retrieval of the chunks of queries, searched together.
+    """
+
+    queries: List[str] = Field(min_items=1)
+
+
+class SearchHit(BaseModel):
+    """
+    Chunk retrieved for a query.
+    """
+
+    text: str
+    score: float = Field(
+        description="The reciprocal rank fusion score with a lexical index, the vector similarity without it"
+    )
+    source: Optional[str] = None
+    metadata: Dict[str, Any] = Field(default_factory=dict)
+
+
+class SearchResults(BaseModel):
+    """
+    Page of the chunks retrieved for a query, the best first.
+    """
+
+    query: str
+    hits: List[SearchHit]
+    offset: int
+    next_offset: Optional[int] = None
+    index_version: Optional[str] = None
+
+    @classmethod
+    def from_scored_documents(
+        cls,
+        query: str,
+        scored_documents: List[Tuple[Any, float]],
+        options: SearchOptions,
+        max_results: int,
+        index_version: Optional[str] = None,
+    ) -> "SearchResults":
+        """
+        Build the page of the chunks retrieved for a query.
+
+        :param query: the query
+        :param scored_documents: the chunks retrieved for the query, up to the maximum results, and their scores
+        :param options: the pagination of the search
+        :param max_results: the maximum number of chunks retrieved for a query, the last page ends there
+        :param index_version: the version of the searched index
+        :return: the page
+        """
+        end = options.offset + options.limit
+        # The ties are ordered by source and text, the same way for every page
+        scored_documents = sorted(
+            scored_documents,
+            key=lambda scored: (
+                -scored[1],
+                scored[0].metadata.get("source") or "",
+                scored[0].page_content,
+            ),
+        )
+        return cls(
+            query=query,
+            hits=[
+                SearchHit(
+                    text=document.page_content,
+                    score=score,
+                    source=document.metadata.get("source"),
+                    metadata=document.metadata,
+                )
+                for document, score in scored_documents[options.offset : end]
+            ],
+            offset=options.offset,
+            next_offset=end
+            if len(scored_documents) > end and end < max_results
+            else None,
+            index_version=index_version,
+        )
+
+
+class SearchBatchResults(BaseModel):
+    """
+    Pages of the chunks retrieved for queries, in the order of the queries.
+    """
+
+    results: List[SearchResults]
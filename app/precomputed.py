@@ -0,0 +1,167 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import Counter
+from typing import Any, Dict, List, Optional
+
+from app.coalescing import normalize_question
+from app.metrics import record_cache
+from app.models import Answer
+from app.retrieval.artifact import checksum
+
+ANSWERS_FILE = "answers.json"
+VERSION_CONTROL_DIRECTORIES = {".git"}
+
+
+def directory_fingerprint(directories: List[str], contents: bool = False) -> str:
+    """
+    Fingerprint the files of directories with their paths, sizes and modification times, or contents.
+
+    The sizes and modification times are read without opening the files, the server fingerprints its
+    index on each load. The contents are only hashed by the offline stages, without the version control
+    directories of the git clones.
+
+    :param directories: the directories or the files, the missing ones are skipped
+    :param contents: hash the contents of the files instead of their sizes and modification times
+    :return: the fingerprint, it changes when a file is added, removed or modified
+    """
+
+    def describe(path: str) -> str:
+        if contents:
+            return checksum(path)
+        status = os.stat(path)
+        return f"{status.st_size}:{status.st_mtime_ns}"
+
+    digest = hashlib.sha256()
+    for directory in directories:
+        if os.path.isfile(directory):
+            digest.update(f"{directory}:{describe(directory)}\n".encode())
+            continue
+        for root, directory_names, names in os.walk(directory):
+            directory_names[:] = sorted(
+                set(directory_names) - VERSION_CONTROL_DIRECTORIES
+            )
+            for name in sorted(names):
+                path = os.path.join(root, name)
+                digest.update(
+                    f"{os.path.relpath(path, directory)}:{describe(path)}\n".encode()
+                )
+    return digest.hexdigest()[:16]
+
+
+def read_frequent_questions(path: str, count: int) -> List[str]:
+    """
+    Read the most frequent questions of a JSONL file with a "question" by line.
+
+    The file can be a curated list of questions or a log of the asked questions, the questions
+    are counted once normalized and the first wording of each question is kept.
+
+    :param path: the path of the JSONL file
+    :param count: the number of questions to keep
+    :return: the questions, the most frequent first
+    """
+    frequencies: Counter = Counter()
+    wordings: Dict[str, str] = dict()
+    with open(path) as file:
+        for line in file:
+            if not line.strip():
+                continue
+            question = json.loads(line)["question"]
+            key = normalize_question(question)
+            frequencies[key] += 1
+            wordings.setdefault(key, question)
+    return [wordings[key] for key, _ in frequencies.most_common(count)]
+
+
+class PrecomputedAnswers:
+    """
+    Table of the answers of the frequent questions, computed offline for a version of the index.
+
+    The questions are matched once normalized. The answers computed for another version of the index
+    are stale: they are not served, and they are replaced by the next answer computed for the question.
+    """
+
+    def __init__(
+        self, directory: str, entries: Optional[Dict[str, Dict[str, Any]]] = None
+    ) -> None:
+        self.directory = directory
+        self.entries = entries or dict()
+        self.lock = threading.Lock()
+
+    @classmethod
+    def open(cls, directory: str) -> "PrecomputedAnswers":
+        """
+        Open the table persisted in a directory, it is empty if it does not exist.
+
+        :param directory: the directory of the table
+        :return: the table
+        """
+        path = os.path.join(directory, ANSWERS_FILE)
+        entries = dict()
+        if os.path.exists(path):
+            with open(path) as file:
+                entries = json.load(file)
+        logging.info(f"Opened {len(entries)} precomputed answers in {directory}")
+        return cls(directory=directory, entries=entries)
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def __contains__(self, question: str) -> bool:
+        return normalize_question(question) in self.entries
+
+    def get(self, question: str, index_version: str) -> Optional[Answer]:
+        """
+        Get the answer of a question computed for a version of the index.
+
+        :param question: the question
+        :param index_version: the version of the served index
+        :return: the answer, None when the question is unknown or its answer is stale
+        """
+        entry = self.entries.get(normalize_question(question))
+        hit = entry is not None and entry["index_version"] == index_version
+        record_cache("precomputed_answers", hit=hit)
+        if not hit:
+            return None
+        return Answer(
+            question=question,
+            answer=entry["answer"],
+            prompt_tokens=entry.get("prompt_tokens"),
+            completion_tokens=entry.get("completion_tokens"),
+            index_version=entry["index_version"],
+        )
+
+    def is_stale(self, question: str, index_version: str) -> bool:
+        entry = self.entries.get(normalize_question(question))
+        return entry is None or entry["index_version"] != index_version
+
+    def put(self, answer: Answer) -> None:
+        """
+        Store the answer of a question with the version of the index used to compute it.
+
+        :param answer: the answer
+        """
+        with self.lock:
+            self.entries[normalize_question(answer.question)] = {
+                "question": answer.question,
+                "answer": answer.answer,
+                "prompt_tokens": answer.prompt_tokens,
+                "completion_tokens": answer.completion_tokens,
+                "index_version": answer.index_version,
+                "built_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            }
+
+    def save(self) -> None:
+        """
+        Persist the table, the file is replaced atomically for the processes reading it.
+        """
+        with self.lock:
+            entries = json.dumps(self.entries, indent=2)
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, ANSWERS_FILE)
+        with open(f"{path}.{os.getpid()}.tmp", "w") as file:
+            file.write(entries)
+        os.replace(f"{path}.{os.getpid()}.tmp", path)
@@ -0,0 +1,431 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+import stat
+import time
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+from app.config import VectorPrecision
+from app.retrieval.base import SOURCE_KEY, SOURCES_KEY, VectorIndex
+from app.retrieval.quantization import (
+    CODES_FILE,
+    EMBEDDINGS_FILE,
+    SCALES_FILE,
+    QuantizedIndex,
+)
+from app.retrieval.shards import ShardedIndex, shard_directory
+
+ARTIFACT_FORMAT = 1
+MANIFEST_FILE = "manifest.json"
+CURRENT_FILE = "CURRENT"
+TEXTS_FILE = "texts.bin"
+TEXT_OFFSETS_FILE = "text_offsets.npy"
+METADATA_FILE = "metadata.json"
+METADATA_CODES_FILE = "metadata_codes.npy"
+LEXICAL_DIRECTORY = "lexical"
+STAGING_PREFIX = ".staging-"
+
+
+class ChunkTexts(Sequence):
+    """
+    Texts of the chunks decoded on access from a memory-mapped UTF-8 buffer.
+    """
+
+    def __init__(self, data: np.ndarray, offsets: np.ndarray) -> None:
+        self.data = data
+        self.offsets = offsets
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, row: int) -> str:
+        start, end = self.offsets[row], self.offsets[row + 1]
+        return self.data[start:end].tobytes().decode("utf-8")
+
+
+class MetadataColumns(Sequence):
+    """
+    Metadata of the chunks stored by column, each value is encoded as a code of its column dictionary.
+
+    The code -1 marks a chunk without a value for the column.
+    """
+
+    def __init__(
+        self, columns: List[str], values: List[List[Any]], codes: np.ndarray
+    ) -> None:
+        self.columns = columns
+        self.values = values
+        self.codes = codes
+        self.lookups = [
+            {value: code for code, value in enumerate(column_values)}
+            for column_values in values
+        ]
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    def __getitem__(self, row: int) -> Dict[str, Any]:
+        return {
+            column: self.values[position][code]
+            for position, (column, code) in enumerate(
+                zip(self.columns, self.codes[row])
+            )
+            if code >= 0
+        }
+
+    def column_mask(self, key: str, values: List[Any]) -> np.ndarray:
+        if key not in self.columns:
+            return np.zeros(len(self.codes), dtype=bool)
+        position = self.columns.index(key)
+        codes = [self.lookups[position].get(value, -2) for value in values]
+        return np.isin(self.codes[:, position], codes)
+
+    def mask(self, where: Dict[str, Any]) -> np.ndarray:
+        """
+        Match the chunks against metadata values, with a comparison of the codes by column.
+
+        The source matches any of the sources of the chunks, the ones of their removed near-duplicates
+        included.
+
+        :param where: the metadata values the chunks must match, a list of values matches any of them
+        :return: the mask of the matching chunks
+        """
+        mask = np.ones(len(self.codes), dtype=bool)
+        for key, value in where.items():
+            values = value if isinstance(value, list) else [value]
+            key_mask = self.column_mask(key, values)
+            if key == SOURCE_KEY and SOURCES_KEY in self.columns:
+                merged = [
+                    sources
+                    for sources in self.values[self.columns.index(SOURCES_KEY)]
+                    if set(values).intersection(json.loads(sources))
+                ]
+                key_mask |= self.column_mask(SOURCES_KEY, merged)
+            mask &= key_mask
+        return mask
+
+    @staticmethod
+    def save(directory: str, metadatas: List[Dict[str, Any]]) -> None:
+        """
+        Save metadata by column in a directory.
+
+        :param directory: the directory of the index
+        :param metadatas: the metadata of the chunks
+        """
+        columns: List[str] = list()
+        lookups: List[Dict[Any, int]] = list()
+        for metadata in metadatas:
+            for key in metadata:
+                if key not in columns:
+                    columns.append(key)
+                    lookups.append(dict())
+        codes = np.full((len(metadatas), len(columns)), -1, dtype=np.int32)
+        for row, metadata in enumerate(metadatas):
+            for position, key in enumerate(columns):
+                if key in metadata:
+                    lookup = lookups[position]
+                    codes[row, position] = lookup.setdefault(metadata[key], len(lookup))
+        np.save(os.path.join(directory, METADATA_CODES_FILE), codes)
+        with open(os.path.join(directory, METADATA_FILE), "w") as file:
+            json.dump(
+                {"columns": columns, "values": [list(lookup) for lookup in lookups]},
+                file,
+            )
+
+    @classmethod
+    def load(cls, directory: str) -> "MetadataColumns":
+        with open(os.path.join(directory, METADATA_FILE)) as file:
+            metadata = json.load(file)
+        return cls(
+            columns=metadata["columns"],
+            values=metadata["values"],
+            codes=np.load(os.path.join(directory, METADATA_CODES_FILE), mmap_mode="r"),
+        )
+
+
+class ArtifactIndex(QuantizedIndex):
+    """
+    Quantized index opened from the read-only files of an index artifact.
+
+    The embeddings, the texts and the metadata codes are memory-mapped: nothing is copied at startup
+    and the processes opening the same artifact share the page cache.
+    """
+
+    @staticmethod
+    def write(
+        directory: str,
+        embeddings: np.ndarray,
+        texts: List[str],
+        metadatas: List[Dict[str, Any]],
+        precision: VectorPrecision,
+        keep_full_precision: bool = False,
+    ) -> None:
+        """
+        Save the chunks in the files of an index artifact.
+
+        :param directory: the directory of the index
+        :param embeddings: the float32 embeddings by row
+        :param texts: the texts of the chunks
+        :param metadatas: the metadata of the chunks
+        :param precision: the precision of the searched embeddings
+        :param keep_full_precision: save the float32 embeddings too, they are needed for the rescoring
+        """
+        index = QuantizedIndex.from_embeddings(
+            embeddings=embeddings, texts=texts, metadatas=metadatas, precision=precision
+        )
+        index.save_vectors(
+            directory,
+            embeddings=embeddings
+            if keep_full_precision and precision != VectorPrecision.FLOAT32
+            else None,
+        )
+        encoded_texts = [text.encode("utf-8") for text in texts]
+        offsets = np.zeros(len(texts) + 1, dtype=np.int64)
+        np.cumsum([len(text) for text in encoded_texts], out=offsets[1:])
+        with open(os.path.join(directory, TEXTS_FILE), "wb") as file:
+            file.write(b"".join(encoded_texts))
+        np.save(os.path.join(directory, TEXT_OFFSETS_FILE), offsets)
+        MetadataColumns.save(directory, metadatas)
+
+    @classmethod
+    def open(cls, directory: str, rescore_candidates: int = 0) -> "ArtifactIndex":
+        """
+        Open the index of an artifact without reading its files.
+
+        :param directory: the directory of the index
+        :param rescore_candidates: the number of candidates to rescore in full precision, 0 to disable
+        :return: the index
+        """
+        scales_path = os.path.join(directory, SCALES_FILE)
+        embeddings_path = os.path.join(directory, EMBEDDINGS_FILE)
+        codes = np.load(os.path.join(directory, CODES_FILE), mmap_mode="r")
+        texts_path = os.path.join(directory, TEXTS_FILE)
+        data = (
+            np.memmap(texts_path, dtype=np.uint8, mode="r")
+            if os.path.getsize(texts_path)
+            else np.empty(0, dtype=np.uint8)
+        )
+        return cls(
+            codes=codes,
+            texts=ChunkTexts(
+                data=data,
+                offsets=np.load(os.path.join(directory, TEXT_OFFSETS_FILE)),
+            ),
+            metadatas=MetadataColumns.load(directory),
+            scales=np.load(scales_path) if os.path.exists(scales_path) else None,
+            embeddings=np.load(embeddings_path, mmap_mode="r")
+            if rescore_candidates and os.path.exists(embeddings_path)
+            else None,
+            rescore_candidates=rescore_candidates,
+        )
+
+    def _mask(self, where: Optional[Dict[str, str]]) -> Optional[np.ndarray]:
+        if not where:
+            return None
+        return self.metadatas.mask(where)
+
+
+def checksum(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def list_files(directory: str) -> List[str]:
+    return sorted(
+        os.path.relpath(os.path.join(root, name), directory)
+        for root, _, names in os.walk(directory)
+        for name in names
+        if name != MANIFEST_FILE
+    )
+
+
+def publish_artifact(
+    artifact_directory: str, staging_directory: str, manifest: Dict[str, Any]
+) -> str:
+    """
+    Publish the files of a staging directory as a new immutable version of the artifact.
+
+    The version is named after its creation time and the checksum of its files, the files are made
+    read-only and the staging directory is renamed atomically to the version directory.
+
+    :param artifact_directory: the directory of the artifact versions
+    :param staging_directory: the directory of the files of the version
+    :param manifest: the description of the version, completed with its files
+    :return: the version
+    """
+    files = {
+        path: {
+            "bytes": os.path.getsize(os.path.join(staging_directory, path)),
+            "sha256": checksum(os.path.join(staging_directory, path)),
+        }
+        for path in list_files(staging_directory)
+    }
+    digest = hashlib.sha256(json.dumps(files, sort_keys=True).encode()).hexdigest()
+    version = f"{time.strftime('%Y%m%dT%H%M%SZ', time.gmtime())}-{digest[:8]}"
+    manifest = {
+        **manifest,
+        "format": ARTIFACT_FORMAT,
+        "version": version,
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "files": files,
+    }
+    with open(os.path.join(staging_directory, MANIFEST_FILE), "w") as file:
+        json.dump(manifest, file, indent=2)
+    read_only = stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH
+    for path in list_files(staging_directory) + [MANIFEST_FILE]:
+        os.chmod(os.path.join(staging_directory, path), read_only)
+    os.rename(staging_directory, os.path.join(artifact_directory, version))
+    return version
+
+
+def list_versions(artifact_directory: str) -> List[str]:
+    """
+    List the published versions of an artifact, the oldest first.
+
+    :param artifact_directory: the directory of the artifact versions
+    :return: the versions
+    """
+    if not os.path.isdir(artifact_directory):
+        return list()
+    return sorted(
+        name
+        for name in os.listdir(artifact_directory)
+        if not name.startswith(STAGING_PREFIX)
+        and os.path.exists(os.path.join(artifact_directory, name, MANIFEST_FILE))
+    )
+
+
+def current_version(artifact_directory: str) -> Optional[str]:
+    """
+    Get the version of an artifact served by default.
+
+    :param artifact_directory: the directory of the artifact versions
+    :return: the active version, None when no version is active
+    """
+    path = os.path.join(artifact_directory, CURRENT_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path) as file:
+        return file.read().strip() or None
+
+
+def activate_version(artifact_directory: str, version: str) -> None:
+    """
+    Make a version of an artifact the one served by default, to roll out or to roll back.
+
+    :param artifact_directory: the directory of the artifact versions
+    :param version: the version to activate
+    """
+    if version not in list_versions(artifact_directory):
+        raise ValueError(f"The version {version} is not in {artifact_directory}.")
+    path = os.path.join(artifact_directory, CURRENT_FILE)
+    with open(f"{path}.tmp", "w") as file:
+        file.write(version)
+    os.replace(f"{path}.tmp", path)
+    logging.info(f"The version {version} of {artifact_directory} is active.")
+
+
+def remove_staging_directories(artifact_directory: str) -> None:
+    if not os.path.isdir(artifact_directory):
+        return
+    for name in os.listdir(artifact_directory):
+        if name.startswith(STAGING_PREFIX):
+            shutil.rmtree(os.path.join(artifact_directory, name), ignore_errors=True)
+
+
+class IndexArtifact:
+    """
+    Version of the index artifact: the read-only vectors, chunks and lexical index exported after the
+    ingestion, described by a manifest with the checksums of its files.
+    """
+
+    def __init__(self, directory: str, manifest: Dict[str, Any]) -> None:
+        self.directory = directory
+        self.manifest = manifest
+
+    @classmethod
+    def open(
+        cls,
+        artifact_directory: str,
+        version: Optional[str] = None,
+        verify: bool = False,
+    ) -> "IndexArtifact":
+        """
+        Open a version of an artifact, the sizes of its files are always checked.
+
+        :param artifact_directory: the directory of the artifact versions
+        :param version: the version to open, None for the active one
+        :param verify: verify the checksums of the files too, it reads all of them
+        :return: the artifact
+        """
+        version = version or current_version(artifact_directory)
+        if not version:
+            raise ValueError(f"No active version in {artifact_directory}.")
+        directory = os.path.join(artifact_directory, version)
+        with open(os.path.join(directory, MANIFEST_FILE)) as file:
+            manifest = json.load(file)
+        if manifest.get("format") != ARTIFACT_FORMAT:
+            raise ValueError(
+                f"The format {manifest.get('format')} of the version {version} is not supported."
+            )
+        artifact = cls(directory=directory, manifest=manifest)
+        artifact.verify(checksums=verify)
+        return artifact
+
+    @property
+    def version(self) -> str:
+        return self.manifest["version"]
+
+    @property
+    def lexical_index_directory(self) -> Optional[str]:
+        if not self.manifest.get("lexical"):
+            return None
+        return os.path.join(self.directory, LEXICAL_DIRECTORY)
+
+    def verify(self, checksums: bool = True) -> None:
+        """
+        Verify that the files of the artifact are the ones of its manifest.
+
+        :param checksums: compare the checksums of the files, otherwise only their sizes
+        """
+        for path, expected in self.manifest["files"].items():
+            full_path = os.path.join(self.directory, path)
+            if not os.path.exists(full_path):
+                raise ValueError(
+                    f"The file {path} of the version {self.version} is missing."
+                )
+            if os.path.getsize(full_path) != expected["bytes"] or (
+                checksums and checksum(full_path) != expected["sha256"]
+            ):
+                raise ValueError(
+                    f"The file {path} of the version {self.version} is corrupted."
+                )
+
+    def load_index(self, rescore_candidates: int = 0) -> VectorIndex:
+        """
+        Open the index of the artifact, sharded when the artifact was exported from shards.
+
+        :param rescore_candidates: the number of candidates to rescore in full precision, 0 to disable
+        :return: the index
+        """
+        shards = self.manifest.get("shards")
+        if not shards:
+            return ArtifactIndex.open(
+                self.directory, rescore_candidates=rescore_candidates
+            )
+        return ShardedIndex(
+            {
+                shard: ArtifactIndex.open(
+                    shard_directory(self.directory, shard),
+                    rescore_candidates=rescore_candidates,
+                )
+                for shard in shards
+            }
+        )
@@ -0,0 +1,220 @@
+import atexit
+import heapq
+import itertools
+import json
+import threading
+from abc import ABC, abstractmethod
+from typing import Any, Dict, List, Optional, Tuple
+
+from langchain.docstore.document import Document
+from langchain.vectorstores import Chroma
+
+ScoredDocuments = List[Tuple[Document, float]]
+
+SOURCE_KEY = "source"
+# The sources of a chunk and of its removed near-duplicates, as a JSON list
+SOURCES_KEY = "sources"
+
+
+def sources_of(metadata: Dict[str, Any]) -> List[str]:
+    """
+    Get all the sources of a chunk, the ones of its removed near-duplicates included.
+
+    :param metadata: the metadata of the chunk
+    :return: the sources
+    """
+    if metadata.get(SOURCES_KEY):
+        return json.loads(metadata[SOURCES_KEY])
+    return [metadata[SOURCE_KEY]] if metadata.get(SOURCE_KEY) else list()
+
+
+def matches(metadata: Dict[str, Any], where: Dict[str, Any]) -> bool:
+    """
+    Match the metadata of a chunk against metadata values, a list of values matches any of them.
+
+    The source matches any of the sources of the chunk, the ones of its removed near-duplicates included.
+
+    :param metadata: the metadata of the chunk
+    :param where: the metadata values the chunk must match
+    :return: True when the chunk matches
+    """
+    return all(
+        any(
+            item in (value if isinstance(value, list) else [value])
+            for item in (
+                sources_of(metadata) if key == SOURCE_KEY else [metadata.get(key)]
+            )
+        )
+        for key, value in where.items()
+    )
+
+
+def expand_where(where: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """
+    Expand the lists of values of a filter into the filters of each combination of values.
+
+    :param where: the metadata values the chunks must match, a list of values matches any of them
+    :return: the filters with a single value by key
+    """
+    keys = list(where)
+    values = [
+        where[key] if isinstance(where[key], list) else [where[key]] for key in keys
+    ]
+    return [dict(zip(keys, combination)) for combination in itertools.product(*values)]
+
+
+class VectorIndex(ABC):
+    """
+    Index searching the chunks closest to query embeddings.
+
+    The scores are similarities: the higher, the closer (cosine similarity for normalized embeddings).
+    """
+
+    @abstractmethod
+    def search(
+        self,
+        embeddings: List[List[float]],
+        k: int,
+        where: Optional[Dict[str, str]] = None,
+    ) -> List[ScoredDocuments]:
+        """
+        Search the chunks closest to each query embedding.
+
+        :param embeddings: the query embeddings
+        :param k: the number of chunks to return by query
+        :param where: the metadata values the chunks must match
+        :return: the scored chunks of each query, the closest first
+        """
+
+    def search_by_vector(
+        self,
+        embedding: List[float],
+        k: int,
+        where: Optional[Dict[str, str]] = None,
+    ) -> ScoredDocuments:
+        """
+        Search the chunks closest to a query embedding.
+
+        :param embedding: the query embedding
+        :param k: the number of chunks to return
+        :param where: the metadata values the chunks must match
+        :return: the scored chunks, the closest first
+        """
+        return self.search([embedding], k=k, where=where)[0]
+
+    def close(self) -> None:
+        """
+        Release the resources of the index once it is not searched anymore.
+        """
+
+
+class ChromaIndex(VectorIndex):
+    """
+    Index searching a Chroma collection.
+
+    The queries are serialized, the DuckDB backend of Chroma mixes up the results of concurrent queries.
+    Chroma only matches single metadata values: a filter with lists of values runs a query by
+    combination of values, and their chunks are merged by score. A filter on the source also runs a
+    query by list of sources of the chunks merged with near-duplicates from this source.
+    """
+
+    def __init__(self, db: Chroma) -> None:
+        self.db = db
+        self.lock = threading.Lock()
+        self._merged_sources: Optional[List[str]] = None
+        # Chroma persists its in-memory copy at exit: the searched database is only read, rewriting it
+        # would overwrite a newer ingestion and change the modification times fingerprinting it
+        atexit.unregister(self.db._client._db.persist)
+
+    def merged_sources(self) -> List[str]:
+        """
+        Get the distinct lists of sources of the chunks merged with near-duplicates, read once.
+
+        :return: the JSON lists of sources
+        """
+        with self.lock:
+            if self._merged_sources is None:
+                metadatas = self.db._collection.get(
+                    where={SOURCES_KEY: {"$ne": ""}}, include=["metadatas"]
+                )["metadatas"]
+                self._merged_sources = sorted(
+                    {metadata[SOURCES_KEY] for metadata in metadatas}
+                )
+            return self._merged_sources
+
+    def single_value_filters(self, where: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """
+        Expand a filter into the filters Chroma matches, the chunks matching any of them match the filter.
+
+        :param where: the metadata values the chunks must match, a list of values matches any of them
+        :return: the filters with a single value by key
+        """
+        filters = expand_where(where)
+        if SOURCE_KEY in where:
+            values = where[SOURCE_KEY]
+            values = set(values if isinstance(values, list) else [values])
+            merged = [
+                sources
+                for sources in self.merged_sources()
+                if values.intersection(json.loads(sources))
+            ]
+            if merged:
+                others = {
+                    key: value for key, value in where.items() if key != SOURCE_KEY
+                }
+                filters += expand_where({**others, SOURCES_KEY: merged})
+        return filters
+
+    def search(
+        self,
+        embeddings: List[List[float]],
+        k: int,
+        where: Optional[Dict[str, str]] = None,
+    ) -> List[ScoredDocuments]:
+        filters = self.single_value_filters(where) if where else [where]
+        if len(filters) == 1:
+            return self._search(embeddings, k, filters[0])
+        results = [
+            self._search(embeddings, k, single_where) for single_where in filters
+        ]
+        merged_results = list()
+        for query in range(len(embeddings)):
+            # A chunk of a source merged with near-duplicates of this source matches several filters
+            unique = {
+                (document.metadata.get(SOURCE_KEY), document.page_content): (
+                    document,
+                    score,
+                )
+                for filter_results in results
+                for document, score in filter_results[query]
+            }
+            merged_results.append(
+                heapq.nlargest(k, unique.values(), key=lambda scored: scored[1])
+            )
+        return merged_results
+
+    def _search(
+        self,
+        embeddings: List[List[float]],
+        k: int,
+        where: Optional[Dict[str, str]] = None,
+    ) -> List[ScoredDocuments]:
+        # The DuckDB backend of Chroma writes the values in its SQL queries without escaping them
+        if where and any("'" in str(value) for value in where.values()):
+            raise ValueError(
+                "The metadata values of the filters cannot contain quotes."
+            )
+        with self.lock:
+            results = self.db._collection.query(
+                query_embeddings=embeddings, n_results=k, where=where
+            )
+        # Chroma returns squared L2 distances, they are turned into cosine similarities
+        return [
+            [
+                (Document(page_content=text, metadata=metadata or {}), 1 - distance / 2)
+                for text, metadata, distance in zip(texts, metadatas, distances)
+            ]
+            for texts, metadatas, distances in zip(
+                results["documents"], results["metadatas"], results["distances"]
+            )
+        ]
@@ -0,0 +1,205 @@
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Callable, Generic, List, Optional, Tuple, TypeVar
+
+from langchain.embeddings.base import Embeddings
+
+from app.coalescing import normalize_question
+from app.config import config
+from app.metrics import QUERY_BATCH_SIZE, record_cache, stage
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+class LRUCache(Generic[T]):
+    """
+    Thread-safe cache evicting the least recently used entries beyond its size.
+    """
+
+    def __init__(self, size: int) -> None:
+        self.size = size
+        self.lock = threading.Lock()
+        self.entries: "OrderedDict[str, T]" = OrderedDict()
+
+    def get(self, key: str) -> Optional[T]:
+        with self.lock:
+            value = self.entries.get(key)
+            if value is not None:
+                self.entries.move_to_end(key)
+            return value
+
+    def put(self, key: str, value: T) -> None:
+        if self.size <= 0:
+            return
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+
+class MicroBatcher(Generic[T, R]):
+    """
+    Batching of the concurrent calls of a function into a single call on their items.
+
+    The first caller waits for the other callers up to the wait time or the batch size, then runs the
+    function on the items by batches and hands each caller its result. The callers arriving meanwhile
+    start the next batch.
+    """
+
+    def __init__(
+        self,
+        function: Callable[[List[T]], List[R]],
+        max_batch_size: int = 32,
+        max_wait_seconds: float = 0.002,
+    ) -> None:
+        """
+        :param function: the function computing the results of a batch of items, in their order
+        :param max_batch_size: the maximum number of items of a batch
+        :param max_wait_seconds: the time waited for the other items of a batch
+        """
+        self.function = function
+        self.max_batch_size = max_batch_size
+        self.max_wait_seconds = max_wait_seconds
+        self.condition = threading.Condition()
+        self.pending: List[Tuple[T, "Future[R]"]] = list()
+
+    def submit(self, item: T) -> R:
+        """
+        Compute the result of an item in the next batch.
+
+        :param item: the item
+        :return: the result of the item
+        """
+        future: "Future[R]" = Future()
+        with self.condition:
+            self.pending.append((item, future))
+            leader = len(self.pending) == 1
+            if len(self.pending) >= self.max_batch_size:
+                self.condition.notify_all()
+            if leader:
+                self.condition.wait_for(
+                    lambda: len(self.pending) >= self.max_batch_size,
+                    timeout=self.max_wait_seconds,
+                )
+                batch, self.pending = self.pending, list()
+        if leader:
+            for start in range(0, len(batch), self.max_batch_size):
+                self.run(batch[start : start + self.max_batch_size])
+        return future.result()
+
+    def run(self, batch: List[Tuple[T, "Future[R]"]]) -> None:
+        try:
+            results = self.function([item for item, _ in batch])
+        except BaseException as exception:
+            for _, future in batch:
+                future.set_exception(exception)
+            return
+        for (_, future), result in zip(batch, results):
+            future.set_result(result)
+
+
+class QueryEncoder(Embeddings):
+    """
+    Encoder of the queries in front of the embeddings model, for the searches of the vector index.
+
+    The embeddings of the normalized queries are cached, and the concurrent queries missing the cache
+    are embedded together in one forward pass. The queries are embedded like documents: the
+    sentence-transformers models of Delta-Buddy embed both the same way.
+    """
+
+    def __init__(
+        self,
+        embeddings: Embeddings,
+        cache_size: int = 1024,
+        max_batch_size: int = 32,
+        max_wait_seconds: float = 0.002,
+    ) -> None:
+        """
+        :param embeddings: the embeddings model
+        :param cache_size: the number of cached query embeddings, 0 disables the cache
+        :param max_batch_size: the maximum number of queries embedded in one forward pass
+        :param max_wait_seconds: the time waited for the concurrent queries, 0 disables the batching
+        """
+        self.embeddings = embeddings
+        self.cache: LRUCache[List[float]] = LRUCache(cache_size)
+        self.batcher: Optional[MicroBatcher[str, List[float]]] = (
+            MicroBatcher(
+                self.encode,
+                max_batch_size=max_batch_size,
+                max_wait_seconds=max_wait_seconds,
+            )
+            if max_wait_seconds > 0 and max_batch_size > 1
+            else None
+        )
+
+    @classmethod
+    def from_config(cls, embeddings: Embeddings) -> "QueryEncoder":
+        """
+        Build the query encoder of an embeddings model, with the maximum sequence length of the queries.
+
+        :param embeddings: the embeddings model, its sentence-transformers model is truncated when set
+        :return: the query encoder
+        """
+        model = getattr(embeddings, "client", None)
+        if config.QUERY_ENCODER_MAX_SEQ_LENGTH and hasattr(model, "max_seq_length"):
+            logging.info(
+                f"Truncating the queries to {config.QUERY_ENCODER_MAX_SEQ_LENGTH} tokens."
+            )
+            model.max_seq_length = config.QUERY_ENCODER_MAX_SEQ_LENGTH
+        return cls(
+            embeddings,
+            cache_size=config.QUERY_ENCODER_CACHE_SIZE,
+            max_batch_size=config.QUERY_ENCODER_BATCH_SIZE,
+            max_wait_seconds=config.QUERY_ENCODER_BATCH_WAIT_SECONDS,
+        )
+
+    def encode(self, queries: List[str]) -> List[List[float]]:
+        QUERY_BATCH_SIZE.observe(len(queries))
+        with stage("query_encoder_forward"):
+            return self.embeddings.embed_documents(queries)
+
+    def embed_query(self, text: str) -> List[float]:
+        query = normalize_question(text)
+        embedding = self.cache.get(query)
+        record_cache("query_embeddings", hit=embedding is not None)
+        if embedding is None:
+            embedding = (
+                self.batcher.submit(query) if self.batcher else self.encode([query])[0]
+            )
+            self.cache.put(query, embedding)
+        return embedding
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """
+        Embed queries in one forward pass, the cached ones excepted.
+
+        :param texts: the queries
+        :return: the embeddings of the queries
+        """
+        queries = [normalize_question(text) for text in texts]
+        embeddings = [self.cache.get(query) for query in queries]
+        for embedding in embeddings:
+            record_cache("query_embeddings", hit=embedding is not None)
+        missing = list(
+            dict.fromkeys(
+                query
+                for query, embedding in zip(queries, embeddings)
+                if embedding is None
+            )
+        )
+        if missing:
+            encoded = dict(zip(missing, self.encode(missing)))
+            for query, embedding in encoded.items():
+                self.cache.put(query, embedding)
+            embeddings = [
+                embedding if embedding is not None else encoded[query]
+                for query, embedding in zip(queries, embeddings)
+            ]
+        return embeddings
@@ -0,0 +1,189 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, Optional
+
+from app.metrics import INDEX_RELOADS, INDEX_VERSION, stage
+from app.retrieval.hybrid import HybridRetriever
+
+
+class IndexGeneration:
+    """
+    Generation of the index loaded by the server, with the requests searching it.
+    """
+
+    def __init__(self, version: str, retriever: HybridRetriever) -> None:
+        self.version = version
+        self.retriever = retriever
+        self.loaded_at = time.time()
+        self.requests = 0
+        self.idle = threading.Condition()
+
+    def drain(self, timeout: float) -> bool:
+        """
+        Wait until the requests searching the generation are done.
+
+        :param timeout: the maximum number of seconds to wait
+        :return: True when no request is searching the generation anymore
+        """
+        with self.idle:
+            return self.idle.wait_for(lambda: self.requests == 0, timeout=timeout)
+
+    def close(self) -> None:
+        self.retriever.index.close()
+
+
+class IndexHolder:
+    """
+    Double-buffered holder of the index: a new generation is loaded in the background while the
+    active one keeps serving, then the requests are switched to it atomically.
+
+    The previous generation is closed once its requests are drained, the requests always search a
+    single generation from their beginning to their end.
+    """
+
+    def __init__(
+        self,
+        generation: IndexGeneration,
+        loader: Callable[[Optional[str]], IndexGeneration],
+        drain_timeout_seconds: float = 60.0,
+    ) -> None:
+        self.generation = generation
+        self.loader = loader
+        self.drain_timeout_seconds = drain_timeout_seconds
+        self.lock = threading.Lock()
+        self.reloading = threading.Lock()
+        self.last_error: Optional[str] = None
+        INDEX_VERSION.info({"version": generation.version})
+
+    @property
+    def version(self) -> str:
+        return self.generation.version
+
+    @contextmanager
+    def acquire(self) -> Iterator[IndexGeneration]:
+        """
+        Get the active generation, it is not closed before the end of the block.
+        """
+        with self.lock:
+            generation = self.generation
+            with generation.idle:
+                generation.requests += 1
+        try:
+            yield generation
+        finally:
+            with generation.idle:
+                generation.requests -= 1
+                generation.idle.notify_all()
+
+    def reload(self, version: Optional[str] = None, wait: bool = False) -> bool:
+        """
+        Load a new generation of the index and switch the requests to it.
+
+        :param version: the version of the index artifact to load, None for the active one
+        :param wait: wait for the end of the reload instead of running it in the background
+        :return: False when a reload is already running
+        """
+        if not self.reloading.acquire(blocking=False):
+            return False
+        if wait:
+            self._reload(version)
+        else:
+            threading.Thread(
+                target=self._reload, args=(version,), name="index-reload", daemon=True
+            ).start()
+        return True
+
+    def _reload(self, version: Optional[str]) -> None:
+        try:
+            with stage("load_index", pipeline="reload"):
+                generation = self.loader(version)
+        except Exception as exception:
+            logging.exception("The new generation of the index could not be loaded.")
+            self.last_error = repr(exception)
+            INDEX_RELOADS.labels(result="failed").inc()
+            self.reloading.release()
+            return
+        self.last_error = None
+        if generation.version == self.version:
+            logging.info(f"The version {generation.version} of the index is served.")
+            generation.close()
+            INDEX_RELOADS.labels(result="unchanged").inc()
+            self.reloading.release()
+            return
+        with self.lock:
+            previous, self.generation = self.generation, generation
+        INDEX_RELOADS.labels(result="swapped").inc()
+        INDEX_VERSION.info({"version": generation.version})
+        logging.info(
+            f"Switched from the version {previous.version} to the version {generation.version} of the index."
+        )
+        # The next reload can start, the previous generation is drained concurrently
+        self.reloading.release()
+        with stage("drain_index", pipeline="reload"):
+            if not previous.drain(self.drain_timeout_seconds):
+                logging.warning(
+                    f"{previous.requests} requests still search the version {previous.version} "
+                    f"after {self.drain_timeout_seconds} seconds, it is closed anyway."
+                )
+        previous.close()
+
+    def status(self) -> Dict[str, Any]:
+        """
+        Get the served version of the index and the state of the reloads.
+        """
+        generation = self.generation
+        return {
+            "version": generation.version,
+            "loaded_at": time.strftime(
+                "%Y-%m-%dT%H:%M:%SZ", time.gmtime(generation.loaded_at)
+            ),
+            "requests": generation.requests,
+            "reloading": self.reloading.locked(),
+            "last_error": self.last_error,
+        }
+
+
+class IndexWatcher:
+    """
+    Watcher reloading the index when its files change.
+
+    The reload starts once the probed state has been stable for a poll, not while the files are written.
+    """
+
+    def __init__(
+        self,
+        holder: IndexHolder,
+        probe: Callable[[], Any],
+        interval_seconds: float,
+    ) -> None:
+        self.holder = holder
+        self.probe = probe
+        self.interval_seconds = interval_seconds
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(
+            target=self._watch, name="index-watcher", daemon=True
+        )
+
+    def start(self) -> "IndexWatcher":
+        self.thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.stopped.set()
+        self.thread.join()
+
+    def _watch(self) -> None:
+        served = previous = self.probe()
+        while not self.stopped.wait(self.interval_seconds):
+            try:
+                state = self.probe()
+            except OSError:
+                # The files are being replaced
+                continue
+            if state == previous and state != served:
+                logging.info("The index has changed, reloading it.")
+                if self.holder.reload(wait=True):
+                    served = state
+            previous = state
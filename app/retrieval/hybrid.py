@@ -0,0 +1,240 @@
+from typing import Dict, List, Optional, Tuple
+
+from langchain.docstore.document import Document
+from langchain.embeddings.base import Embeddings
+
+from app.metrics import RETRIEVALS, stage
+from app.retrieval.base import ScoredDocuments, VectorIndex
+from app.retrieval.lexical import STOP_WORDS, TOKEN_PATTERN, LexicalIndex, is_exact
+from app.retrieval.shards import QueryRouter, ShardedIndex
+
+# Share of the meaningful query tokens being identifiers to skip the embedding of the query
+LEXICAL_FAST_PATH_RATIO = 0.5
+
+
+def reciprocal_rank_fusion(
+    rankings: List[ScoredDocuments], k: int, rrf_k: int = 60
+) -> ScoredDocuments:
+    """
+    Fuse rankings of chunks with the reciprocal rank fusion, the scores of the rankings are ignored.
+
+    :param rankings: the rankings, the best first
+    :param k: the number of chunks to return
+    :param rrf_k: the constant dampening the weight of the first ranks
+    :return: the chunks scored by the sum of their reciprocal ranks, the best first
+    """
+    fused: Dict[Tuple[Optional[str], str], Tuple[Document, float]] = dict()
+    for ranking in rankings:
+        for rank, (document, _) in enumerate(ranking):
+            key = (document.metadata.get("source"), document.page_content)
+            _, score = fused.get(key, (document, 0.0))
+            fused[key] = (document, score + 1 / (rrf_k + rank + 1))
+    return sorted(fused.values(), key=lambda item: item[1], reverse=True)[:k]
+
+
+class HybridRetriever:
+    """
+    Retriever fusing the vector search with the BM25 search of the lexical index.
+
+    The questions made mostly of identifiers found in the lexical index only use the lexical search,
+    without embedding the question. Without a lexical index, only the vector search is used.
+    With a router, the vector search only covers the shards picked for the question.
+    With a lexical index, the chunks are always scored by their reciprocal ranks, the lexical fast
+    path included, so the scores of all the questions compare.
+    """
+
+    def __init__(
+        self,
+        embeddings: Embeddings,
+        index: VectorIndex,
+        lexical_index: Optional[LexicalIndex] = None,
+        candidates: int = 20,
+        rrf_k: int = 60,
+        lexical_fast_path: bool = True,
+        router: Optional[QueryRouter] = None,
+    ) -> None:
+        self.embeddings = embeddings
+        self.index = index
+        self.lexical_index = lexical_index
+        self.candidates = candidates
+        self.rrf_k = rrf_k
+        self.lexical_fast_path = lexical_fast_path
+        self.router = router
+
+    def is_lexical_query(self, question: str) -> bool:
+        """
+        Check if a question is dominated by identifiers known by the lexical index.
+
+        :param question: the question
+        :return: True to answer it with the lexical search only
+        """
+        tokens = [
+            token
+            for token in TOKEN_PATTERN.findall(question)
+            if token.lower() not in STOP_WORDS
+        ]
+        exact_tokens = [token for token in tokens if is_exact(token)]
+        return (
+            bool(exact_tokens)
+            and len(exact_tokens) >= LEXICAL_FAST_PATH_RATIO * len(tokens)
+            and any(
+                self.lexical_index.document_frequency(token.lower())
+                for token in exact_tokens
+            )
+        )
+
+    def vector_search(
+        self, question: str, k: int, where: Optional[Dict[str, str]] = None
+    ) -> ScoredDocuments:
+        with stage("query_embed"):
+            embedding = self.embeddings.embed_query(question)
+        index = self.index
+        if self.router and isinstance(index, ShardedIndex):
+            index = index.select(self.router.route(question))
+        with stage("vector_search"):
+            return index.search_by_vector(embedding, k=k, where=where)
+
+    def retrieve(
+        self, question: str, k: int, where: Optional[Dict[str, str]] = None
+    ) -> ScoredDocuments:
+        """
+        Retrieve the chunks answering a question.
+
+        :param question: the question
+        :param k: the number of chunks to return
+        :param where: the metadata values the chunks must match
+        :return: the scored chunks, the best first
+        """
+        return self.retrieve_with_relevance(question, k=k, where=where)[0]
+
+    def retrieve_with_relevance(
+        self, question: str, k: int, where: Optional[Dict[str, str]] = None
+    ) -> Tuple[ScoredDocuments, List[float]]:
+        """
+        Retrieve the chunks answering a question, with the relevance scores of the search finding them.
+
+        The fused scores of the hybrid search only rank the chunks, the relevance scores are the
+        similarities of the closest chunks of the vector search, or the BM25 scores on the lexical
+        fast path.
+
+        :param question: the question
+        :param k: the number of chunks to return
+        :param where: the metadata values the chunks must match
+        :return: the scored chunks and the k best relevance scores, the best first
+        """
+        if not self.lexical_index:
+            RETRIEVALS.labels(mode="vector").inc()
+            results = self.vector_search(question, k=k, where=where)
+            return results, [score for _, score in results]
+        if self.lexical_fast_path and self.is_lexical_query(question):
+            RETRIEVALS.labels(mode="lexical").inc()
+            results = self.lexical_search(question, k=k, where=where)
+            return (
+                reciprocal_rank_fusion([results], k=k, rrf_k=self.rrf_k),
+                [score for _, score in results],
+            )
+        RETRIEVALS.labels(mode="hybrid").inc()
+        candidates = max(self.candidates, k)
+        vector_results = self.vector_search(question, k=candidates, where=where)
+        return (
+            self.fuse(question, vector_results, k=k, where=where),
+            [score for _, score in vector_results[:k]],
+        )
+
+    def lexical_search(
+        self, question: str, k: int, where: Optional[Dict[str, str]] = None
+    ) -> ScoredDocuments:
+        with stage("lexical_search"):
+            return self.lexical_index.search(question, k=k, where=where)
+
+    def fuse(
+        self,
+        question: str,
+        vector_results: ScoredDocuments,
+        k: int,
+        where: Optional[Dict[str, str]] = None,
+    ) -> ScoredDocuments:
+        lexical_results = self.lexical_search(
+            question, k=max(self.candidates, k), where=where
+        )
+        with stage("fusion"):
+            return reciprocal_rank_fusion(
+                [vector_results, lexical_results], k=k, rrf_k=self.rrf_k
+            )
+
+    def vector_search_batch(
+        self, questions: List[str], k: int, where: Optional[Dict[str, str]] = None
+    ) -> List[ScoredDocuments]:
+        """
+        Search the chunks closest to questions, embedded in one pass and searched together.
+
+        :param questions: the questions
+        :param k: the number of chunks to return by question
+        :param where: the metadata values the chunks must match
+        :return: the scored chunks of each question, the closest first
+        """
+        with stage("query_embed"):
+            embeddings = self.embeddings.embed_documents(questions)
+        groups: Dict[Tuple[str, ...], List[int]] = {(): list(range(len(questions)))}
+        if self.router and isinstance(self.index, ShardedIndex):
+            groups = dict()
+            for position, question in enumerate(questions):
+                shards = tuple(self.router.route(question))
+                groups.setdefault(shards, list()).append(position)
+        results: List[ScoredDocuments] = [list() for _ in questions]
+        for shards, positions in groups.items():
+            index = self.index.select(list(shards)) if shards else self.index
+            with stage("vector_search"):
+                group_results = index.search(
+                    [embeddings[position] for position in positions], k=k, where=where
+                )
+            for position, scored in zip(positions, group_results):
+                results[position] = scored
+        return results
+
+    def retrieve_batch(
+        self, questions: List[str], k: int, where: Optional[Dict[str, str]] = None
+    ) -> List[ScoredDocuments]:
+        """
+        Retrieve the chunks answering questions, with a single vector search for all of them.
+
+        :param questions: the questions
+        :param k: the number of chunks to return by question
+        :param where: the metadata values the chunks must match
+        :return: the scored chunks of each question, the best first
+        """
+        lexical = {
+            position
+            for position, question in enumerate(questions)
+            if self.lexical_index
+            and self.lexical_fast_path
+            and self.is_lexical_query(question)
+        }
+        vector = [
+            position for position in range(len(questions)) if position not in lexical
+        ]
+        results: List[ScoredDocuments] = [list() for _ in questions]
+        for position in lexical:
+            RETRIEVALS.labels(mode="lexical").inc()
+            results[position] = reciprocal_rank_fusion(
+                [self.lexical_search(questions[position], k=k, where=where)],
+                k=k,
+                rrf_k=self.rrf_k,
+            )
+        if not vector:
+            return results
+        vector_results = self.vector_search_batch(
+            [questions[position] for position in vector],
+            k=max(self.candidates, k) if self.lexical_index else k,
+            where=where,
+        )
+        for position, scored in zip(vector, vector_results):
+            if not self.lexical_index:
+                RETRIEVALS.labels(mode="vector").inc()
+                results[position] = scored
+            else:
+                RETRIEVALS.labels(mode="hybrid").inc()
+                results[position] = self.fuse(
+                    questions[position], scored, k=k, where=where
+                )
+        return results
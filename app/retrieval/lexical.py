@@ -0,0 +1,249 @@
+import heapq
+import json
+import logging
+import math
+import os
+import re
+from collections import Counter
+from typing import Callable, Dict, Iterable, List, Optional
+
+from langchain.docstore.document import Document
+
+from app.retrieval.base import ScoredDocuments, matches
+
+CHUNKS_FILE = "chunks.jsonl"
+DELETED_FILE = "deleted.json"
+
+# Identifiers are kept whole: version tags, config keys, table and function names
+TOKEN_PATTERN = re.compile(r"[A-Za-z0-9]+(?:[._\-/:][A-Za-z0-9]+)*")
+PART_PATTERN = re.compile(r"[A-Z]?[a-z]+|[A-Z]+(?![a-z])|[0-9]+")
+STOP_WORDS = frozenset(
+    """a an and are as at be by can do does for from how i in is it me my of on or show
+    tell that the this to use used using what when where which who why with you""".split()
+)
+
+
+def is_exact(token: str) -> bool:
+    """
+    Check if a token is an identifier better matched exactly than semantically.
+
+    :param token: the token, before lower-casing
+    :return: True for the tokens with digits, separators or inner capitals
+    """
+    return (
+        any(character.isdigit() or character in "._-/:" for character in token)
+        or token[1:] != token[1:].lower()
+    )
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Tokenize a text in lower-cased terms, identifiers are kept whole and split in their parts.
+
+    :param text: the text
+    :return: the terms
+    """
+    terms = list()
+    for token in TOKEN_PATTERN.findall(text):
+        terms.append(token.lower())
+        if is_exact(token):
+            parts = PART_PATTERN.findall(token)
+            if len(parts) > 1:
+                terms.extend(part.lower() for part in parts)
+    return terms
+
+
+class LexicalIndex:
+    """
+    BM25 inverted index of the chunks, persisted in an append-only directory.
+
+    The added chunks are appended to the chunks file and the deleted ones are recorded as tombstones,
+    so the updates do not rewrite the index until it is compacted.
+    """
+
+    def __init__(
+        self, directory: Optional[str] = None, k1: float = 1.2, b: float = 0.75
+    ) -> None:
+        self.directory = directory
+        self.k1 = k1
+        self.b = b
+        self.documents: Dict[int, Document] = dict()
+        self.lengths: Dict[int, int] = dict()
+        self.postings: Dict[str, Dict[int, int]] = dict()
+        self.total_length = 0
+        self.deleted = 0
+        self.next_id = 0
+
+    def __len__(self) -> int:
+        return len(self.documents)
+
+    @classmethod
+    def open(cls, directory: str) -> "LexicalIndex":
+        """
+        Open the index persisted in a directory, it is created if it does not exist.
+
+        :param directory: the directory of the index
+        :return: the index
+        """
+        index = cls(directory=directory)
+        os.makedirs(directory, exist_ok=True)
+        deleted_path = os.path.join(directory, DELETED_FILE)
+        deleted = set()
+        if os.path.exists(deleted_path):
+            with open(deleted_path) as file:
+                deleted = set(json.load(file))
+        chunks_path = os.path.join(directory, CHUNKS_FILE)
+        if os.path.exists(chunks_path):
+            with open(chunks_path) as file:
+                for line in file:
+                    chunk = json.loads(line)
+                    index.next_id = max(index.next_id, chunk["id"] + 1)
+                    if chunk["id"] in deleted:
+                        continue
+                    index._index(
+                        chunk["id"],
+                        Document(
+                            page_content=chunk["text"], metadata=chunk["metadata"]
+                        ),
+                        chunk["terms"],
+                    )
+        index.deleted = len(deleted)
+        logging.info(f"Opened the lexical index of {len(index)} chunks in {directory}")
+        return index
+
+    def _index(self, doc_id: int, document: Document, terms: Dict[str, int]) -> None:
+        self.documents[doc_id] = document
+        self.lengths[doc_id] = sum(terms.values())
+        self.total_length += self.lengths[doc_id]
+        for term, frequency in terms.items():
+            self.postings.setdefault(term, dict())[doc_id] = frequency
+
+    def add_documents(self, documents: Iterable[Document]) -> int:
+        """
+        Add chunks to the index, they are appended to the persisted index.
+
+        :param documents: the chunks
+        :return: the number of added chunks
+        """
+        lines = list()
+        for document in documents:
+            terms = dict(Counter(tokenize(document.page_content)))
+            self._index(self.next_id, document, terms)
+            lines.append(
+                json.dumps(
+                    {
+                        "id": self.next_id,
+                        "text": document.page_content,
+                        "metadata": document.metadata,
+                        "terms": terms,
+                    }
+                )
+            )
+            self.next_id += 1
+        if self.directory and lines:
+            with open(os.path.join(self.directory, CHUNKS_FILE), "a") as file:
+                file.write("\n".join(lines) + "\n")
+        return len(lines)
+
+    def delete_documents(self, predicate: Callable[[Document], bool]) -> int:
+        """
+        Delete the chunks matching a predicate, to re-ingest them.
+
+        :param predicate: the predicate of the chunks to delete
+        :return: the number of deleted chunks
+        """
+        doc_ids = [
+            doc_id for doc_id, document in self.documents.items() if predicate(document)
+        ]
+        for doc_id in doc_ids:
+            document = self.documents.pop(doc_id)
+            self.total_length -= self.lengths.pop(doc_id)
+            for term in set(tokenize(document.page_content)):
+                postings = self.postings.get(term, dict())
+                postings.pop(doc_id, None)
+                if not postings:
+                    self.postings.pop(term, None)
+        if self.directory and doc_ids:
+            deleted_path = os.path.join(self.directory, DELETED_FILE)
+            deleted = list()
+            if os.path.exists(deleted_path):
+                with open(deleted_path) as file:
+                    deleted = json.load(file)
+            with open(deleted_path, "w") as file:
+                json.dump(deleted + doc_ids, file)
+            self.deleted += len(doc_ids)
+            if self.deleted > len(self.documents):
+                self.compact()
+        return len(doc_ids)
+
+    def compact(self) -> None:
+        """
+        Rewrite the persisted index without the deleted chunks.
+        """
+        if not self.directory:
+            return
+        path = os.path.join(self.directory, CHUNKS_FILE)
+        with open(f"{path}.tmp", "w") as file:
+            for doc_id, document in self.documents.items():
+                terms = Counter(tokenize(document.page_content))
+                file.write(
+                    json.dumps(
+                        {
+                            "id": doc_id,
+                            "text": document.page_content,
+                            "metadata": document.metadata,
+                            "terms": terms,
+                        }
+                    )
+                    + "\n"
+                )
+        os.replace(f"{path}.tmp", path)
+        deleted_path = os.path.join(self.directory, DELETED_FILE)
+        if os.path.exists(deleted_path):
+            os.remove(deleted_path)
+        self.deleted = 0
+
+    def document_frequency(self, term: str) -> int:
+        return len(self.postings.get(term, ()))
+
+    def search(
+        self, query: str, k: int, where: Optional[Dict[str, str]] = None
+    ) -> ScoredDocuments:
+        """
+        Search the chunks matching the terms of a query with BM25.
+
+        :param query: the query
+        :param k: the number of chunks to return
+        :param where: the metadata values the chunks must match
+        :return: the scored chunks, the best first
+        """
+        if not self.documents:
+            return list()
+        count = len(self.documents)
+        average_length = self.total_length / count
+        scores: Dict[int, float] = dict()
+        # The postings of the stop words cover most of the chunks for little weight in the scores
+        for term in set(tokenize(query)) - STOP_WORDS:
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+            for doc_id, frequency in postings.items():
+                norm = self.k1 * (
+                    1 - self.b + self.b * self.lengths[doc_id] / average_length
+                )
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * frequency * (
+                    self.k1 + 1
+                ) / (frequency + norm)
+        if where:
+            scores = {
+                doc_id: score
+                for doc_id, score in scores.items()
+                if matches(self.documents[doc_id].metadata, where)
+            }
+        return [
+            (self.documents[doc_id], score)
+            for doc_id, score in heapq.nlargest(
+                k, scores.items(), key=lambda item: item[1]
+            )
+        ]
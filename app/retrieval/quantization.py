@@ -0,0 +1,252 @@
+import json
+import logging
+import os
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+from langchain.docstore.document import Document
+from langchain.vectorstores import Chroma
+
+from app.config import VectorPrecision
+from app.retrieval.base import ScoredDocuments, VectorIndex, matches
+
+CODES_FILE = "codes.npy"
+SCALES_FILE = "scales.npy"
+EMBEDDINGS_FILE = "embeddings.npy"
+CHUNKS_FILE = "chunks.jsonl"
+# Rows scored at once, it bounds the memory used to decode the quantized embeddings
+SEARCH_BLOCK_SIZE = 65536
+
+
+def normalize(embeddings: np.ndarray) -> np.ndarray:
+    """
+    Normalize the embeddings to compare them with the cosine similarity.
+
+    :param embeddings: the embeddings by row
+    :return: the normalized embeddings in float32
+    """
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    norms = np.linalg.norm(embeddings, axis=-1, keepdims=True)
+    return embeddings / np.where(norms == 0, 1, norms)
+
+
+def quantize(
+    embeddings: np.ndarray, precision: VectorPrecision
+) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+    """
+    Quantize the embeddings, the int8 precision uses a symmetric scale per dimension.
+
+    :param embeddings: the normalized float32 embeddings by row
+    :param precision: the precision of the quantized embeddings
+    :return: the quantized embeddings and the scales per dimension for int8
+    """
+    if precision == VectorPrecision.FLOAT32:
+        return embeddings.astype(np.float32), None
+    if precision == VectorPrecision.FLOAT16:
+        return embeddings.astype(np.float16), None
+    scales = np.abs(embeddings).max(axis=0) / 127
+    scales[scales == 0] = 1
+    codes = np.clip(np.rint(embeddings / scales), -127, 127).astype(np.int8)
+    return codes, scales.astype(np.float32)
+
+
+def read_chroma_collection(
+    db: Chroma,
+) -> Tuple[np.ndarray, List[str], List[Dict[str, Any]]]:
+    """
+    Read the embeddings, the texts and the metadata of all the chunks of a Chroma collection.
+
+    :param db: the Chroma collection
+    :return: the float32 embeddings by row, the texts and the metadata
+    """
+    collection = db.get(include=["embeddings", "documents", "metadatas"])
+    return (
+        np.array(collection["embeddings"], dtype=np.float32),
+        collection["documents"],
+        [metadata or {} for metadata in collection["metadatas"]],
+    )
+
+
+class QuantizedIndex(VectorIndex):
+    """
+    Index searching exhaustively embeddings stored in float16 or in int8.
+
+    The full-precision embeddings can be kept on disk and memory-mapped to rescore the best candidates
+    of the quantized search, only the rows of these candidates are then read.
+    """
+
+    def __init__(
+        self,
+        codes: np.ndarray,
+        texts: List[str],
+        metadatas: List[Dict[str, Any]],
+        scales: Optional[np.ndarray] = None,
+        embeddings: Optional[np.ndarray] = None,
+        rescore_candidates: int = 0,
+    ) -> None:
+        self.codes = codes
+        self.texts = texts
+        self.metadatas = metadatas
+        self.scales = scales
+        self.embeddings = embeddings
+        self.rescore_candidates = rescore_candidates if embeddings is not None else 0
+
+    @classmethod
+    def from_embeddings(
+        cls,
+        embeddings: np.ndarray,
+        texts: List[str],
+        metadatas: List[Dict[str, Any]],
+        precision: VectorPrecision,
+        rescore_candidates: int = 0,
+    ) -> "QuantizedIndex":
+        """
+        Build an index from full-precision embeddings.
+
+        :param embeddings: the embeddings by row
+        :param texts: the texts of the chunks
+        :param metadatas: the metadata of the chunks
+        :param precision: the precision of the quantized embeddings
+        :param rescore_candidates: the number of candidates to rescore in full precision, 0 to disable
+        :return: the index
+        """
+        embeddings = normalize(embeddings)
+        codes, scales = quantize(embeddings, precision)
+        return cls(
+            codes=codes,
+            texts=texts,
+            metadatas=metadatas,
+            scales=scales,
+            embeddings=embeddings if rescore_candidates else None,
+            rescore_candidates=rescore_candidates,
+        )
+
+    @property
+    def nbytes(self) -> int:
+        """
+        Get the memory used by the searched embeddings, without the memory-mapped full-precision ones.
+        """
+        return self.codes.nbytes + (
+            self.scales.nbytes if self.scales is not None else 0
+        )
+
+    def save_vectors(
+        self, directory: str, embeddings: Optional[np.ndarray] = None
+    ) -> None:
+        """
+        Save the quantized embeddings of the index in a directory, without the chunks.
+
+        :param directory: the directory of the index
+        :param embeddings: the full-precision embeddings to save for the rescoring
+        """
+        os.makedirs(directory, exist_ok=True)
+        np.save(os.path.join(directory, CODES_FILE), self.codes)
+        if self.scales is not None:
+            np.save(os.path.join(directory, SCALES_FILE), self.scales)
+        embeddings = embeddings if embeddings is not None else self.embeddings
+        if embeddings is not None:
+            np.save(os.path.join(directory, EMBEDDINGS_FILE), normalize(embeddings))
+
+    def save(self, directory: str, embeddings: Optional[np.ndarray] = None) -> None:
+        """
+        Save the index in a directory.
+
+        :param directory: the directory of the index
+        :param embeddings: the full-precision embeddings to save for the rescoring
+        """
+        self.save_vectors(directory, embeddings=embeddings)
+        with open(os.path.join(directory, CHUNKS_FILE), "w") as file:
+            for text, metadata in zip(self.texts, self.metadatas):
+                file.write(json.dumps({"text": text, "metadata": metadata}) + "\n")
+        logging.info(
+            f"Saved {len(self.texts)} embeddings of {self.codes.dtype} in {directory}"
+        )
+
+    @classmethod
+    def load(cls, directory: str, rescore_candidates: int = 0) -> "QuantizedIndex":
+        """
+        Load an index saved in a directory.
+
+        :param directory: the directory of the index
+        :param rescore_candidates: the number of candidates to rescore in full precision, 0 to disable
+        :return: the index
+        """
+        scales_path = os.path.join(directory, SCALES_FILE)
+        embeddings_path = os.path.join(directory, EMBEDDINGS_FILE)
+        texts, metadatas = list(), list()
+        with open(os.path.join(directory, CHUNKS_FILE)) as file:
+            for line in file:
+                chunk = json.loads(line)
+                texts.append(chunk["text"])
+                metadatas.append(chunk["metadata"])
+        return cls(
+            codes=np.load(os.path.join(directory, CODES_FILE)),
+            texts=texts,
+            metadatas=metadatas,
+            scales=np.load(scales_path) if os.path.exists(scales_path) else None,
+            embeddings=np.load(embeddings_path, mmap_mode="r")
+            if rescore_candidates and os.path.exists(embeddings_path)
+            else None,
+            rescore_candidates=rescore_candidates,
+        )
+
+    def _mask(self, where: Optional[Dict[str, str]]) -> Optional[np.ndarray]:
+        if not where:
+            return None
+        return np.array([matches(metadata, where) for metadata in self.metadatas])
+
+    def scores(self, queries: np.ndarray) -> np.ndarray:
+        """
+        Score all the chunks against the queries with the quantized embeddings.
+
+        :param queries: the normalized queries by row
+        :return: the scores with a row by query
+        """
+        if self.scales is not None:
+            # The scale is applied on the queries: q . (codes * scales) = (q * scales) . codes
+            queries = queries * self.scales
+        scores = np.empty((len(queries), len(self.codes)), dtype=np.float32)
+        for start in range(0, len(self.codes), SEARCH_BLOCK_SIZE):
+            block = self.codes[start : start + SEARCH_BLOCK_SIZE].astype(np.float32)
+            scores[:, start : start + len(block)] = queries @ block.T
+        return scores
+
+    def search(
+        self,
+        embeddings: List[List[float]],
+        k: int,
+        where: Optional[Dict[str, str]] = None,
+    ) -> List[ScoredDocuments]:
+        queries = normalize(np.atleast_2d(np.asarray(embeddings, dtype=np.float32)))
+        scores = self.scores(queries)
+        mask = self._mask(where)
+        if mask is not None:
+            scores[:, ~mask] = -np.inf
+        candidates = min(max(k, self.rescore_candidates), len(self.codes))
+        results = list()
+        for query, query_scores in zip(queries, scores):
+            if candidates == 0:
+                results.append(list())
+                continue
+            top = np.argpartition(-query_scores, candidates - 1)[:candidates]
+            top_scores = query_scores[top]
+            if self.rescore_candidates:
+                # The rows are sorted to read the memory-mapped embeddings sequentially
+                top = np.sort(top)
+                top_scores = np.asarray(self.embeddings[top]) @ query
+                top_scores[~np.isfinite(query_scores[top])] = -np.inf
+            order = np.argsort(-top_scores)[:k]
+            results.append(
+                [
+                    (
+                        Document(
+                            page_content=self.texts[row],
+                            metadata=self.metadatas[row],
+                        ),
+                        float(score),
+                    )
+                    for row, score in zip(top[order], top_scores[order])
+                    if np.isfinite(score)
+                ]
+            )
+        return results
@@ -0,0 +1,162 @@
+import heapq
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Pattern
+
+from app.metrics import SHARD_SEARCHES
+from app.retrieval.base import ScoredDocuments, VectorIndex
+
+# Families of the sources written by data_preparation/utils
+DOCUMENTS_SHARD = "documents"
+REPOSITORIES_SHARD = "repositories"
+RELEASE_NOTES_SHARD = "release_notes"
+DATABRICKS_SHARD = "databricks"
+SHARDS = (DOCUMENTS_SHARD, REPOSITORIES_SHARD, RELEASE_NOTES_SHARD, DATABRICKS_SHARD)
+SHARDS_DIRECTORY = "shards"
+
+ROUTING_RULES: Dict[str, Pattern] = {
+    RELEASE_NOTES_SHARD: re.compile(
+        r"\b(releases?|release notes|changelog|versions?|v?\d+\.\d+(\.\d+)?|new in|"
+        r"deprecat\w*|upgrade|latest)\b",
+        re.IGNORECASE,
+    ),
+    DATABRICKS_SHARD: re.compile(
+        r"\b(databricks|clusters?|alerts?|unity catalog|catalogs?|warehouses?|"
+        r"workspaces?|ml models?|(my|our) \w+)\b",
+        re.IGNORECASE,
+    ),
+    REPOSITORIES_SHARD: re.compile(
+        r"\b(code|functions?|class(es)?|api|examples?|how (to|do)|configur\w*|"
+        r"propert(y|ies)|python|scala|java|rust|sql|spark|merge|vacuum|optimize|"
+        r"z-?order|streaming|delta-rs|delta-sharing|kafka)\b|[a-z_]\w*\.[a-z_]\w*",
+        re.IGNORECASE,
+    ),
+    DOCUMENTS_SHARD: re.compile(
+        r"\b(paper|architecture|design|acid|transaction log|lakehouse|research|why)\b",
+        re.IGNORECASE,
+    ),
+}
+
+
+def shard_of(source: str, source_directory: str) -> str:
+    """
+    Get the shard of a source from its path under the source documents directory.
+
+    :param source: the path of the source document
+    :param source_directory: the source documents directory
+    :return: the shard of the source
+    """
+    path = os.path.relpath(source, source_directory).replace(os.sep, "/")
+    if path.startswith("github_repositories/"):
+        if path.endswith("_releases.txt"):
+            return RELEASE_NOTES_SHARD
+        return REPOSITORIES_SHARD
+    if os.path.basename(path).startswith("databricks_"):
+        return DATABRICKS_SHARD
+    return DOCUMENTS_SHARD
+
+
+def shard_directory(directory: str, shard: str) -> str:
+    return os.path.join(directory, SHARDS_DIRECTORY, shard)
+
+
+def existing_shards(directory: str) -> List[str]:
+    """
+    List the shards persisted in a directory.
+
+    :param directory: the directory of the sharded index
+    :return: the shards
+    """
+    return [
+        shard for shard in SHARDS if os.path.isdir(shard_directory(directory, shard))
+    ]
+
+
+class QueryRouter:
+    """
+    Router picking the shards relevant to a question with keyword rules.
+
+    The questions matching no rule are routed to all the shards.
+    """
+
+    def __init__(
+        self, shards: List[str], rules: Dict[str, Pattern] = ROUTING_RULES
+    ) -> None:
+        self.shards = shards
+        self.rules = rules
+
+    def route(self, question: str) -> List[str]:
+        """
+        Pick the shards to search for a question.
+
+        :param question: the question
+        :return: the shards
+        """
+        shards = [
+            shard
+            for shard in self.shards
+            if shard in self.rules and self.rules[shard].search(question)
+        ]
+        return shards or list(self.shards)
+
+
+class ShardedIndex(VectorIndex):
+    """
+    Index searching shards in parallel and merging their chunks by score.
+
+    The shards must be searched with the same embeddings, so that their scores are comparable.
+    """
+
+    def __init__(
+        self,
+        shards: Dict[str, VectorIndex],
+        executor: Optional[ThreadPoolExecutor] = None,
+    ) -> None:
+        self.shards = shards
+        self.executor = executor or ThreadPoolExecutor(
+            max_workers=max(len(shards), 1), thread_name_prefix="shard-search"
+        )
+
+    def select(self, shards: List[str]) -> "ShardedIndex":
+        """
+        Get the index searching only some shards, sharing the threads of this index.
+
+        :param shards: the shards to search
+        :return: the index of the shards
+        """
+        return ShardedIndex(
+            {shard: self.shards[shard] for shard in shards if shard in self.shards},
+            executor=self.executor,
+        )
+
+    def close(self) -> None:
+        for index in self.shards.values():
+            index.close()
+        self.executor.shutdown(wait=False)
+
+    def search(
+        self,
+        embeddings: List[List[float]],
+        k: int,
+        where: Optional[Dict[str, str]] = None,
+    ) -> List[ScoredDocuments]:
+        for shard in self.shards:
+            SHARD_SEARCHES.labels(shard=shard).inc()
+        futures = [
+            self.executor.submit(index.search, embeddings, k, where)
+            for index in self.shards.values()
+        ]
+        results = [future.result() for future in futures]
+        return [
+            heapq.nlargest(
+                k,
+                (
+                    scored
+                    for shard_results in results
+                    for scored in shard_results[query]
+                ),
+                key=lambda scored: scored[1],
+            )
+            for query in range(len(embeddings))
+        ]
@@ -1,7 +1,8 @@
 import logging
 
 from app.chatbot import ChatBot
-from app.config import ExecutionContext, config
+from app.config import ExecutionContext, ModelBackend, config
+from app.stubs import StubChatBot, StubEmbeddings, StubLLM
 
 
 def prepare_chatbot() -> ChatBot:
@@ -10,9 +11,24 @@ def prepare_chatbot() -> ChatBot:
 
     :return: the chatbot prepared.
     """
+    if config.CHATBOT_BACKEND == ModelBackend.STUB:
+        logging.info("Loading the stub chatbot, the answers are not real.")
+        return StubChatBot(
+            latency_in_seconds=config.STUB_CHATBOT_LATENCY_SECONDS,
+            capacity=config.STUB_CHATBOT_CAPACITY,
+        )
     if config.EXECUTION_CONTEXT == ExecutionContext.LOCAL:
         logging.info("Loading with the LOCAL execution context.")
-        return ChatBot(execution_context=ExecutionContext.LOCAL)
+        return ChatBot(
+            execution_context=ExecutionContext.LOCAL,
+            embeddings=StubEmbeddings()
+            if config.EMBEDDINGS_BACKEND == ModelBackend.STUB
+            else None,
+            llm=StubLLM() if config.LLM_BACKEND == ModelBackend.STUB else None,
+            small_llm=StubLLM(max_tokens=16)
+            if config.LLM_BACKEND == ModelBackend.STUB
+            else None,
+        )
     elif config.EXECUTION_CONTEXT == ExecutionContext.DATABRICKS:
         logging.info("Loading with the DATABRICKS execution context.")
     return ChatBot(execution_context=ExecutionContext.DATABRICKS)
@@ -0,0 +1,108 @@
+import hashlib
+import math
+import re
+import threading
+import time
+from contextlib import nullcontext
+from typing import Any, List, Optional
+
+from langchain.callbacks.manager import CallbackManagerForLLMRun
+from langchain.embeddings.base import Embeddings
+from langchain.llms.base import LLM
+
+from app.consts import CONTEXT_KEY, INSTRUCTION_KEY
+from app.generation.controls import GenerationControls
+from app.metrics import QUEUE_DEPTH
+from app.models import Answer
+
+TOKEN_PATTERN = re.compile(r"\w+")
+
+
+class StubEmbeddings(Embeddings):
+    """
+    Deterministic embeddings hashing the words of the text, to run Delta-Buddy offline without any model.
+    """
+
+    def __init__(self, size: int = 384) -> None:
+        self.size = size
+
+    def _embed(self, text: str) -> List[float]:
+        vector = [0.0] * self.size
+        for token in TOKEN_PATTERN.findall(text.lower()):
+            digest = hashlib.md5(token.encode("utf-8")).digest()
+            index = int.from_bytes(digest[:4], "little") % self.size
+            vector[index] += 1.0 if digest[4] % 2 else -1.0
+        norm = math.sqrt(sum(value * value for value in vector)) or 1.0
+        return [value / norm for value in vector]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed(text)
+
+
+class StubLLM(LLM):
+    """
+    Deterministic LLM answering with the beginning of the context, to run Delta-Buddy offline without any model.
+    """
+
+    max_tokens: int = 64
+    latency_in_seconds: float = 0.0
+    seconds_per_token: float = 0.0
+
+    @property
+    def _llm_type(self) -> str:
+        return "stub"
+
+    def get_num_tokens(self, text: str) -> int:
+        return len(text.split())
+
+    def _call(
+        self,
+        prompt: str,
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        max_new_tokens: Optional[int] = None,
+        **kwargs: Any,
+    ) -> str:
+        context = prompt.split(CONTEXT_KEY, 1)[-1].split(INSTRUCTION_KEY, 1)[0]
+        max_tokens = min(max_new_tokens or self.max_tokens, self.max_tokens)
+        tokens = context.split()[:max_tokens] or ["I", "do", "not", "know."]
+        time.sleep(self.latency_in_seconds + self.seconds_per_token * len(tokens))
+        return " ".join(tokens)
+
+
+class StubChatBot:
+    """
+    Chatbot answering after a fixed latency without retrieval nor model, to load test the serving.
+
+    The capacity bounds the questions answered at the same time, like the generations sharing a GPU,
+    the other questions wait for a free slot.
+    """
+
+    def __init__(self, latency_in_seconds: float = 0.05, capacity: int = 0) -> None:
+        self.latency_in_seconds = latency_in_seconds
+        self.capacity = capacity
+        self.slots = threading.BoundedSemaphore(capacity) if capacity else None
+        self.index_holder = None
+
+    def chat(
+        self,
+        question: str,
+        from_databricks_notebook: bool = False,
+        controls: Optional[GenerationControls] = None,
+    ) -> Answer:
+        with QUEUE_DEPTH.labels(queue="chat").track_inprogress():
+            with self.slots or nullcontext():
+                time.sleep(self.latency_in_seconds)
+        tokens = f"Stub answer to: {question}".split()
+        if controls and controls.max_new_tokens:
+            tokens = tokens[: controls.max_new_tokens]
+        return Answer(
+            question=question,
+            answer=" ".join(tokens),
+            generation_seconds=self.latency_in_seconds,
+            prompt_tokens=len(question.split()),
+            completion_tokens=len(tokens),
+        )
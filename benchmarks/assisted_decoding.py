@@ -0,0 +1,71 @@
+import argparse
+import json
+import time
+from typing import Any, Dict, List, Optional
+
+from app.config import config
+from app.generation.assisted import DraftModel
+from app.generation.prefix_cache import PrefixCachedLLM
+from app.generation.profiles import InferenceProfile, load_instruct_pipeline
+from benchmarks.prefix_cache import build_prompts
+
+
+def measure(llm: PrefixCachedLLM, prompts: List[str], new_tokens: int) -> float:
+    """
+    Measure the tokens/s of the generations of prompts, including their prefill.
+
+    :param llm: the LLM generating exactly new_tokens tokens
+    :param prompts: the prompts
+    :param new_tokens: the number of generated tokens by prompt
+    :return: the tokens/s
+    """
+    start = time.perf_counter()
+    for prompt in prompts:
+        llm(prompt)
+    return len(prompts) * new_tokens / (time.perf_counter() - start)
+
+
+def main(arguments: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+    parser = argparse.ArgumentParser(
+        description="Report the acceptance rate and the tokens/s of the assisted generation."
+    )
+    parser.add_argument("--model", default=config.DATABRICKS_MODEL_NAME)
+    parser.add_argument("--draft-model", default=config.DRAFT_MODEL_NAME)
+    parser.add_argument("--draft-tokens", type=int, nargs="*", default=[3, 5, 8])
+    parser.add_argument("--new-tokens", type=int, default=64)
+    parser.add_argument("--prompts", type=int, default=5)
+    parser.add_argument("--context-words", type=int, default=100)
+    parser.add_argument("--sample", action="store_true", help="sample the tokens")
+    args = parser.parse_args(arguments)
+
+    profile = InferenceProfile.from_config()
+    instruct_pipeline = load_instruct_pipeline(args.model, profile)
+    draft = DraftModel.load(
+        args.draft_model, profile, instruct_pipeline.model.device, draft_tokens=0
+    )
+    prompts = build_prompts(args.prompts, args.context_words)
+    generate_kwargs = {
+        "do_sample": args.sample,
+        # The generations have the same length to compare their throughput
+        "min_new_tokens": args.new_tokens,
+    }
+    llm = PrefixCachedLLM.from_pipeline(
+        instruct_pipeline, max_new_tokens=args.new_tokens, **generate_kwargs
+    )
+    llm(prompts[0])
+    tokens_per_second = measure(llm, prompts, args.new_tokens)
+    report = [{"draft_tokens": 0, "end_to_end_tokens_per_second": tokens_per_second}]
+    print(json.dumps(report[0]))
+    llm.draft_model = draft
+    for draft_tokens in args.draft_tokens:
+        draft.draft_tokens = draft_tokens
+        draft.reset_metrics()
+        tokens_per_second = measure(llm, prompts, args.new_tokens)
+        result = {**draft.metrics(), "end_to_end_tokens_per_second": tokens_per_second}
+        print(json.dumps(result))
+        report.append(result)
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,184 @@
+import argparse
+import asyncio
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from aiohttp import ClientSession, ClientTimeout
+
+from app.latency import percentile
+
+
+def read_questions(path: str) -> List[Dict[str, Any]]:
+    """
+    Read the questions of a JSONL file, each line has a "question" and an optional "id".
+
+    :param path: the path of the JSONL file
+    :return: the questions
+    """
+    with open(path) as file:
+        questions = [json.loads(line) for line in file if line.strip()]
+    for index, question in enumerate(questions):
+        question.setdefault("id", index)
+    return questions
+
+
+def summarize(results: List[Dict[str, Any]], wall_seconds: float) -> Dict[str, Any]:
+    """
+    Aggregate the per-question results in a latency and throughput report.
+
+    :param results: the per-question results
+    :param wall_seconds: the duration of the whole run
+    :return: the report
+    """
+    succeeded = [result for result in results if not result.get("error")]
+    report = {
+        "questions": len(results),
+        "errors": len(results) - len(succeeded),
+        "wall_seconds": wall_seconds,
+        "questions_per_second": len(succeeded) / wall_seconds if wall_seconds else 0.0,
+    }
+    for metric in ("latency_seconds", "retrieval_seconds", "generation_seconds"):
+        samples = [r[metric] for r in succeeded if r.get(metric) is not None]
+        if samples:
+            report[metric] = {
+                f"p{quantile}": percentile(samples, quantile)
+                for quantile in (50, 95, 99)
+            }
+    for metric in ("prompt_tokens", "completion_tokens"):
+        report[metric] = sum(r.get(metric) or 0 for r in succeeded)
+    generation_seconds = sum(r.get("generation_seconds") or 0 for r in succeeded)
+    if generation_seconds:
+        report["completion_tokens_per_second"] = (
+            report["completion_tokens"] / generation_seconds
+        )
+    return report
+
+
+async def run_direct(
+    questions: List[Dict[str, Any]],
+    concurrency: int,
+    stub_llm: bool,
+    stub_embeddings: bool,
+    stub_latency_in_seconds: float,
+) -> Tuple[List[Dict[str, Any]], float]:
+    """
+    Answer the questions with a ChatBot in this process.
+    """
+    from app.chatbot import ChatBot
+    from app.config import ExecutionContext
+    from app.stubs import StubEmbeddings, StubLLM
+
+    chat_bot = ChatBot(
+        execution_context=ExecutionContext.LOCAL,
+        embeddings=StubEmbeddings() if stub_embeddings else None,
+        llm=StubLLM(latency_in_seconds=stub_latency_in_seconds) if stub_llm else None,
+    )
+    loop = asyncio.get_running_loop()
+    executor = ThreadPoolExecutor(max_workers=concurrency)
+
+    async def ask(question: Dict[str, Any]) -> Dict[str, Any]:
+        start = time.perf_counter()
+        answer = await loop.run_in_executor(
+            executor, chat_bot.chat, question["question"]
+        )
+        return {**answer.dict(), "latency_seconds": time.perf_counter() - start}
+
+    return await gather_answers(questions, ask)
+
+
+async def run_http(
+    questions: List[Dict[str, Any]], concurrency: int, url: str, timeout: float
+) -> Tuple[List[Dict[str, Any]], float]:
+    """
+    Answer the questions with the /chat endpoint of the Delta-Buddy API.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    async with ClientSession(timeout=ClientTimeout(total=timeout)) as session:
+
+        async def ask(question: Dict[str, Any]) -> Dict[str, Any]:
+            async with semaphore:
+                start = time.perf_counter()
+                async with session.post(
+                    f"{url.rstrip('/')}/chat", json={"prompt": question["question"]}
+                ) as response:
+                    response.raise_for_status()
+                    answer = await response.json()
+                return {**answer, "latency_seconds": time.perf_counter() - start}
+
+        return await gather_answers(questions, ask)
+
+
+async def gather_answers(
+    questions: List[Dict[str, Any]],
+    ask: Callable[[Dict[str, Any]], Awaitable[Dict[str, Any]]],
+) -> Tuple[List[Dict[str, Any]], float]:
+    """
+    Ask all the questions, the failures are reported in the results instead of stopping the run.
+
+    :return: the results and the duration of the run
+    """
+
+    async def ask_safely(question: Dict[str, Any]) -> Dict[str, Any]:
+        try:
+            result = await ask(question)
+        except Exception as exception:
+            result = {"question": question["question"], "error": str(exception)}
+        return {"id": question["id"], **result}
+
+    start = time.perf_counter()
+    results = await asyncio.gather(*[ask_safely(question) for question in questions])
+    return results, time.perf_counter() - start
+
+
+def main(arguments: Optional[List[str]] = None) -> Dict[str, Any]:
+    parser = argparse.ArgumentParser(
+        description="Answer a JSONL file of questions and report the latency and the throughput."
+    )
+    parser.add_argument("questions", help="JSONL file with a question per line")
+    parser.add_argument("--output", default="answers.jsonl", help="JSONL answers file")
+    parser.add_argument("--report", default=None, help="JSON report file")
+    parser.add_argument("--concurrency", type=int, default=1)
+    parser.add_argument("--mode", choices=["direct", "http"], default="direct")
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--timeout", type=float, default=600.0)
+    parser.add_argument("--stub-llm", action="store_true")
+    parser.add_argument("--stub-embeddings", action="store_true")
+    parser.add_argument("--stub-latency", type=float, default=0.0)
+    args = parser.parse_args(arguments)
+
+    questions = read_questions(args.questions)
+    if args.mode == "direct":
+        results, wall_seconds = asyncio.run(
+            run_direct(
+                questions,
+                concurrency=args.concurrency,
+                stub_llm=args.stub_llm,
+                stub_embeddings=args.stub_embeddings,
+                stub_latency_in_seconds=args.stub_latency,
+            )
+        )
+    else:
+        results, wall_seconds = asyncio.run(
+            run_http(
+                questions,
+                concurrency=args.concurrency,
+                url=args.url,
+                timeout=args.timeout,
+            )
+        )
+    report = summarize(results, wall_seconds=wall_seconds)
+
+    with open(args.output, "w") as file:
+        for result in results:
+            file.write(json.dumps(result) + "\n")
+    if args.report:
+        with open(args.report, "w") as file:
+            json.dump(report, file, indent=2)
+    print(json.dumps(report, indent=2))
+    return report
+
+
+if __name__ == "__main__":
+    main()
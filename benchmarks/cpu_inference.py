@@ -0,0 +1,109 @@
+import argparse
+import itertools
+import json
+import multiprocessing
+import resource
+import time
+from typing import Any, Dict, List, Optional
+
+from app.config import InferenceDevice, InferenceQuantization, config
+
+PROMPT = (
+    "You are a chatbot named Delta Buddy. Explain what the Delta Lake transaction log is "
+    "and how it provides ACID transactions on top of object storage."
+)
+
+
+def measure(
+    model_name: str,
+    profile: Dict[str, Any],
+    prompt: str,
+    new_tokens: int,
+    repeats: int,
+) -> Dict[str, Any]:
+    """
+    Measure the generation throughput and the peak memory of an inference profile.
+
+    It runs in a dedicated process to measure the peak memory of each profile separately.
+
+    :param model_name: the name of the LLM
+    :param profile: the inference profile
+    :param prompt: the prompt to complete
+    :param new_tokens: the number of tokens to generate
+    :param repeats: the number of measured generations, after a warm-up one
+    :return: the profile with its tokens/s and its peak RSS
+    """
+    import torch
+
+    from app.generation.profiles import InferenceProfile, load_instruct_pipeline
+
+    inference_profile = InferenceProfile(**profile, max_new_tokens=new_tokens)
+    start = time.perf_counter()
+    instruct_pipeline = load_instruct_pipeline(model_name, inference_profile)
+    load_seconds = time.perf_counter() - start
+    inputs = instruct_pipeline.tokenizer(
+        prompt, return_tensors="pt", return_token_type_ids=False
+    )
+    generated_tokens, generation_seconds = 0, 0.0
+    with torch.inference_mode():
+        for repeat in range(repeats + 1):
+            start = time.perf_counter()
+            output = instruct_pipeline.model.generate(
+                **inputs,
+                do_sample=False,
+                min_new_tokens=new_tokens,
+                max_new_tokens=new_tokens,
+                pad_token_id=instruct_pipeline.tokenizer.eos_token_id,
+            )
+            if repeat:
+                generation_seconds += time.perf_counter() - start
+                generated_tokens += output.shape[1] - inputs["input_ids"].shape[1]
+    return {
+        **profile,
+        "load_seconds": load_seconds,
+        "prompt_tokens": inputs["input_ids"].shape[1],
+        "tokens_per_second": generated_tokens / generation_seconds,
+        # The maximum resident set size is in kilobytes on Linux
+        "peak_rss_megabytes": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+
+def main(arguments: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+    parser = argparse.ArgumentParser(
+        description="Report the tokens/s and the peak RSS of the CPU inference profiles."
+    )
+    parser.add_argument("--model", default=config.DATABRICKS_MODEL_NAME)
+    parser.add_argument("--dtypes", nargs="*", default=["float32", "bfloat16"])
+    parser.add_argument("--quantizations", nargs="*", default=["none", "int8"])
+    parser.add_argument("--threads", type=int, nargs="*", default=[0])
+    parser.add_argument("--new-tokens", type=int, default=64)
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args(arguments)
+
+    report = list()
+    context = multiprocessing.get_context("spawn")
+    for dtype, quantization, threads in itertools.product(
+        args.dtypes, args.quantizations, args.threads
+    ):
+        if quantization == InferenceQuantization.INT8.value and dtype != "float32":
+            # The dynamic quantization runs on float32 weights
+            continue
+        profile = {
+            "device": InferenceDevice.CPU,
+            "quantization": InferenceQuantization(quantization),
+            "torch_dtype": dtype,
+            "intra_op_threads": threads,
+        }
+        with context.Pool(processes=1) as pool:
+            result = pool.apply(
+                measure, (args.model, profile, PROMPT, args.new_tokens, args.repeats)
+            )
+        result["device"] = result["device"].value
+        result["quantization"] = result["quantization"].value
+        print(json.dumps(result))
+        report.append(result)
+    return report
+
+
+if __name__ == "__main__":
+    main()
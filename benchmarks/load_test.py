@@ -0,0 +1,432 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from aiohttp import ClientSession, ClientTimeout
+from tabulate import tabulate
+
+from app.latency import percentile
+from benchmarks.bulk_questions import read_questions
+
+
+class AsgiTarget:
+    """
+    Target calling the ASGI application of the API in this process, without any socket.
+    """
+
+    def __init__(self, app: Any, path: str) -> None:
+        self.app = app
+        self.path = path
+
+    async def request(self, payload: Dict[str, Any]) -> int:
+        body = json.dumps(payload).encode()
+        scope = {
+            "type": "http",
+            "asgi": {"version": "3.0"},
+            "http_version": "1.1",
+            "method": "POST",
+            "scheme": "http",
+            "path": self.path,
+            "raw_path": self.path.encode(),
+            "root_path": "",
+            "query_string": b"",
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+            ],
+            "client": ("127.0.0.1", 0),
+            "server": ("127.0.0.1", 80),
+        }
+        request_sent = False
+        response_done = asyncio.Event()
+        status = 0
+
+        async def receive() -> Dict[str, Any]:
+            nonlocal request_sent
+            if not request_sent:
+                request_sent = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            await response_done.wait()
+            return {"type": "http.disconnect"}
+
+        async def send(message: Dict[str, Any]) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body" and not message.get(
+                "more_body"
+            ):
+                response_done.set()
+
+        await self.app(scope, receive, send)
+        return status
+
+    async def close(self) -> None:
+        pass
+
+
+class HttpTarget:
+    """
+    Target calling the API over HTTP.
+    """
+
+    def __init__(self, url: str, path: str, timeout: float) -> None:
+        self.url = f"{url.rstrip('/')}{path}"
+        self.session = ClientSession(timeout=ClientTimeout(total=timeout))
+
+    async def request(self, payload: Dict[str, Any]) -> int:
+        async with self.session.post(self.url, json=payload) as response:
+            await response.read()
+            return response.status
+
+    async def close(self) -> None:
+        await self.session.close()
+
+
+def summarize_level(
+    level: float, latencies: List[float], errors: int, wall_seconds: float
+) -> Dict[str, Any]:
+    return {
+        "level": level,
+        "requests": len(latencies) + errors,
+        "errors": errors,
+        "throughput": len(latencies) / wall_seconds if wall_seconds else 0.0,
+        "p50": percentile(latencies, 50),
+        "p95": percentile(latencies, 95),
+        "p99": percentile(latencies, 99),
+    }
+
+
+async def send(
+    target: Any, payload: Dict[str, Any], latencies: List[float], start: float
+) -> bool:
+    """
+    Send a request and record its latency from a start time when it succeeds.
+
+    :return: True when the request succeeded
+    """
+    try:
+        status = await target.request(payload)
+    except Exception:
+        return False
+    if status != 200:
+        return False
+    latencies.append(time.perf_counter() - start)
+    return True
+
+
+async def closed_loop(
+    target: Any, concurrency: int, duration: float, payloads: List[Dict[str, Any]]
+) -> Dict[str, Any]:
+    """
+    Send the requests with a fixed number of clients, each one waiting for its answer before the next.
+
+    :param target: the target of the requests
+    :param concurrency: the number of clients
+    :param duration: the duration of the level in seconds
+    :param payloads: the payloads of the requests, sent in turn
+    :return: the summary of the level
+    """
+    latencies: List[float] = list()
+    errors = 0
+    start = time.perf_counter()
+    deadline = start + duration
+    sent = 0
+
+    async def client() -> None:
+        nonlocal errors, sent
+        while time.perf_counter() < deadline:
+            payload = payloads[sent % len(payloads)]
+            sent += 1
+            if not await send(target, payload, latencies, time.perf_counter()):
+                errors += 1
+
+    await asyncio.gather(*[client() for _ in range(concurrency)])
+    return summarize_level(concurrency, latencies, errors, time.perf_counter() - start)
+
+
+async def open_loop(
+    target: Any,
+    rate: float,
+    duration: float,
+    payloads: List[Dict[str, Any]],
+    seed: int = 0,
+) -> Dict[str, Any]:
+    """
+    Send the requests at a fixed arrival rate, whether the previous ones are answered or not.
+
+    The arrivals follow a Poisson process and the latencies count from the scheduled arrival,
+    so the requests delayed by a saturated client are not hidden.
+
+    :param target: the target of the requests
+    :param rate: the number of requests by second
+    :param duration: the duration of the level in seconds
+    :param payloads: the payloads of the requests, sent in turn
+    :param seed: the seed of the arrivals
+    :return: the summary of the level
+    """
+    generator = random.Random(seed)
+    latencies: List[float] = list()
+    results = list()
+    start = time.perf_counter()
+    arrival = start
+    count = 0
+    while True:
+        arrival += generator.expovariate(rate)
+        if arrival >= start + duration:
+            break
+        await asyncio.sleep(max(arrival - time.perf_counter(), 0))
+        results.append(
+            asyncio.create_task(
+                send(target, payloads[count % len(payloads)], latencies, arrival)
+            )
+        )
+        count += 1
+    succeeded = await asyncio.gather(*results)
+    return summarize_level(
+        rate,
+        latencies,
+        succeeded.count(False),
+        time.perf_counter() - start,
+    )
+
+
+def compare(
+    report: Dict[str, Any],
+    baseline: Dict[str, Any],
+    tolerance: float,
+    latency_slack: float,
+) -> List[str]:
+    """
+    Compare a saturation curve with a baseline curve of the same mode.
+
+    :param report: the measured curve
+    :param baseline: the baseline curve
+    :param tolerance: the relative loss of throughput or gain of p99 latency tolerated
+    :param latency_slack: the absolute gain of p99 latency in seconds tolerated, for the fast levels
+    :return: the regressions, empty when there is none
+    """
+    if report["mode"] != baseline["mode"]:
+        return [
+            f"The baseline is a {baseline['mode']} loop curve, not {report['mode']}."
+        ]
+    regressions = list()
+    baseline_levels = {point["level"]: point for point in baseline["levels"]}
+    for point in report["levels"]:
+        expected = baseline_levels.get(point["level"])
+        if not expected:
+            continue
+        if point["throughput"] < expected["throughput"] * (1 - tolerance):
+            regressions.append(
+                f"Level {point['level']}: {point['throughput']:.1f} requests/s "
+                f"instead of {expected['throughput']:.1f}."
+            )
+        if point["p99"] > max(
+            expected["p99"] * (1 + tolerance), expected["p99"] + latency_slack
+        ):
+            regressions.append(
+                f"Level {point['level']}: p99 of {point['p99']:.3f}s "
+                f"instead of {expected['p99']:.3f}s."
+            )
+        if point["errors"] > expected["errors"]:
+            regressions.append(
+                f"Level {point['level']}: {point['errors']} errors "
+                f"instead of {expected['errors']}."
+            )
+    if report["peak_throughput"] < baseline["peak_throughput"] * (1 - tolerance):
+        regressions.append(
+            f"Peak throughput of {report['peak_throughput']:.1f} requests/s "
+            f"instead of {baseline['peak_throughput']:.1f}."
+        )
+    return regressions
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def spawn_server(env: Dict[str, str]) -> Tuple[subprocess.Popen, str]:
+    """
+    Start the API in a uvicorn process on a free local port and wait until it answers.
+
+    :param env: the environment variables of the server
+    :return: the process and the url of the server
+    """
+    port = free_port()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port)],
+        env={**os.environ, **env},
+    )
+    url = f"http://127.0.0.1:{port}"
+    async with ClientSession() as session:
+        for _ in range(600):
+            if process.poll() is not None:
+                raise RuntimeError("The API server stopped before answering.")
+            try:
+                async with session.get(f"{url}/metrics") as response:
+                    if response.status == 200:
+                        return process, url
+            except OSError:
+                await asyncio.sleep(0.1)
+    process.terminate()
+    raise RuntimeError("The API server did not start in 60 seconds.")
+
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    if args.questions:
+        questions = [
+            question["question"] for question in read_questions(args.questions)
+        ]
+    else:
+        # Distinct questions, the identical ones in flight would be coalesced
+        questions = [
+            f"What is the feature number {index} of Delta Lake?"
+            for index in range(1000)
+        ]
+    payloads = [{"prompt": question} for question in questions]
+    env = dict()
+    if args.backend == "stub":
+        env = {
+            "CHATBOT_BACKEND": "stub",
+            "STUB_CHATBOT_LATENCY_SECONDS": str(args.stub_latency),
+            "STUB_CHATBOT_CAPACITY": str(args.stub_capacity),
+        }
+    process = None
+    if args.target == "asgi":
+        # The configuration is read when the API is imported
+        os.environ.update(env)
+        from app.main import app
+
+        target = AsgiTarget(app, path=args.endpoint)
+    else:
+        url = args.url
+        if args.spawn:
+            process, url = await spawn_server(env)
+        target = HttpTarget(url, path=args.endpoint, timeout=args.timeout)
+    levels = list()
+    try:
+        for level in args.levels:
+            if args.mode == "closed":
+                level = int(level)
+                point = await closed_loop(target, level, args.duration, payloads)
+            else:
+                point = await open_loop(target, level, args.duration, payloads)
+            levels.append(point)
+            print(
+                f"Level {level}: {point['throughput']:.1f} requests/s, "
+                f"p99 {point['p99']:.3f}s, {point['errors']} errors.",
+                file=sys.stderr,
+            )
+    finally:
+        await target.close()
+        if process:
+            process.terminate()
+            process.wait()
+    return {
+        "mode": args.mode,
+        "target": args.target,
+        "backend": args.backend,
+        "stub_latency": args.stub_latency,
+        "stub_capacity": args.stub_capacity,
+        "duration": args.duration,
+        "levels": levels,
+        "peak_throughput": max(point["throughput"] for point in levels),
+    }
+
+
+def main(arguments: Optional[List[str]] = None) -> Dict[str, Any]:
+    parser = argparse.ArgumentParser(
+        description="Load test the API with open or closed loop traffic and report its saturation curve."
+    )
+    parser.add_argument("--mode", choices=["closed", "open"], default="closed")
+    parser.add_argument(
+        "--levels",
+        type=float,
+        nargs="+",
+        default=[1, 2, 4, 8, 16, 32, 64],
+        help="concurrency levels in closed loop, arrival rates by second in open loop",
+    )
+    parser.add_argument("--duration", type=float, default=5.0, help="seconds by level")
+    parser.add_argument("--target", choices=["asgi", "http"], default="asgi")
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument(
+        "--spawn", action="store_true", help="start the API on a free local port"
+    )
+    parser.add_argument("--endpoint", default="/chat")
+    parser.add_argument("--timeout", type=float, default=600.0)
+    parser.add_argument("--questions", default=None, help="JSONL file of questions")
+    parser.add_argument("--backend", choices=["stub", "chatbot"], default="stub")
+    parser.add_argument("--stub-latency", type=float, default=0.05)
+    parser.add_argument(
+        "--stub-capacity",
+        type=int,
+        default=8,
+        help="questions answered at the same time by the stub, 0 for no limit",
+    )
+    parser.add_argument("--report", default=None, help="JSON report file")
+    parser.add_argument("--baseline", default=None, help="JSON baseline report file")
+    parser.add_argument(
+        "--save-baseline", action="store_true", help="write the report as the baseline"
+    )
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    parser.add_argument("--latency-slack", type=float, default=0.01)
+    args = parser.parse_args(arguments)
+
+    report = asyncio.run(run(args))
+    print(
+        tabulate(
+            [
+                [
+                    point["level"],
+                    point["requests"],
+                    point["errors"],
+                    f"{point['throughput']:.1f}",
+                    f"{point['p50']:.3f}",
+                    f"{point['p99']:.3f}",
+                ]
+                for point in report["levels"]
+            ],
+            headers=[
+                "concurrency" if args.mode == "closed" else "rate",
+                "requests",
+                "errors",
+                "requests/s",
+                "p50 (s)",
+                "p99 (s)",
+            ],
+        )
+    )
+    if args.report:
+        with open(args.report, "w") as file:
+            json.dump(report, file, indent=2)
+    if args.baseline and args.save_baseline:
+        with open(args.baseline, "w") as file:
+            json.dump(report, file, indent=2)
+        print(f"The baseline is saved in {args.baseline}.")
+    elif args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        regressions = compare(
+            report,
+            baseline,
+            tolerance=args.tolerance,
+            latency_slack=args.latency_slack,
+        )
+        if regressions:
+            print("\n".join(["The saturation curve regressed:"] + regressions))
+            sys.exit(1)
+        print("The saturation curve does not regress against the baseline.")
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+from typing import Any, Dict, List, Optional
+
+from data_preparation.ingest_documents import FAST_LOADER_MAPPING, LOADER_MAPPING
+
+WORDS = (
+    "delta lake table transaction log checkpoint vacuum optimize merge schema "
+    "evolution partition stream spark version history time travel protocol"
+).split()
+
+
+def sentence(rng: random.Random, words: int = 12) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(words)).capitalize() + "."
+
+
+def synthetic_document(extension: str, rng: random.Random, sections: int) -> str:
+    """
+    Generate a document looking like the ones of the corpus in a text-like format.
+
+    :param extension: the extension of the format
+    :param rng: the random generator
+    :param sections: the number of sections of the document
+    :return: the content of the document
+    """
+    if extension in (".md", ".mdx"):
+        parts = ["---", "title: Synthetic", "---", "import Tabs from '@theme/Tabs'"]
+        for number in range(sections):
+            parts += [
+                f"## Section {number}",
+                f"{sentence(rng)} See [the docs](https://docs.delta.io/{number}).",
+                "```python",
+                "spark.read.format('delta').load('/tmp/table')",
+                "```",
+                "<!-- a comment -->",
+            ]
+        return "\n\n".join(parts)
+    if extension == ".html":
+        body = "".join(
+            f"<h2>Section {number}</h2><p>{sentence(rng)} <b>{sentence(rng)}</b></p>"
+            for number in range(sections)
+        )
+        return f"<html><head><style>p {{}}</style></head><body>{body}<script>var x;</script></body></html>"
+    if extension == ".ipynb":
+        cells = [
+            {"cell_type": "markdown", "source": [sentence(rng)], "metadata": {}}
+            if number % 2
+            else {
+                "cell_type": "code",
+                "source": ["df = spark.read.format('delta')\n", "df.show()"],
+                "outputs": [],
+                "metadata": {},
+                "execution_count": None,
+            }
+            for number in range(sections)
+        ]
+        return json.dumps(
+            {"cells": cells, "metadata": {}, "nbformat": 4, "nbformat_minor": 5}
+        )
+    return "\n\n".join(sentence(rng) for _ in range(sections * 2))
+
+
+def write_corpus(
+    directory: str, extensions: List[str], documents: int, sections: int
+) -> Dict[str, List[str]]:
+    """
+    Write a synthetic corpus of documents by extension.
+
+    :param directory: the directory of the corpus
+    :param extensions: the extensions of the documents
+    :param documents: the number of documents by extension
+    :param sections: the number of sections by document
+    :return: the paths of the documents by extension
+    """
+    rng = random.Random(0)
+    paths = dict()
+    for extension in extensions:
+        paths[extension] = list()
+        for number in range(documents):
+            path = os.path.join(directory, f"document_{number}{extension}")
+            with open(path, "w", encoding="utf8") as file:
+                file.write(synthetic_document(extension, rng, sections))
+            paths[extension].append(path)
+    return paths
+
+
+def measure(loader_class, loader_args: Dict[str, Any], paths: List[str]) -> Dict:
+    """
+    Load documents with a loader.
+
+    :param loader_class: the class of the loader
+    :param loader_args: the arguments of the loader
+    :param paths: the paths of the documents
+    :return: the documents/s and the characters loaded, or the error of the loader
+    """
+    start = time.perf_counter()
+    try:
+        characters = sum(
+            len(document.page_content)
+            for path in paths
+            for document in loader_class(path, **loader_args).load()
+        )
+    except Exception as exception:
+        return {"loader": loader_class.__name__, "error": repr(exception)[:120]}
+    seconds = time.perf_counter() - start
+    return {
+        "loader": loader_class.__name__,
+        "documents_per_second": len(paths) / seconds,
+        "characters": characters,
+    }
+
+
+def main(arguments: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+    parser = argparse.ArgumentParser(
+        description="Compare the documents/s of the fast loaders and of the langchain loaders."
+    )
+    parser.add_argument("--documents", type=int, default=200, help="by extension")
+    parser.add_argument("--sections", type=int, default=20, help="by document")
+    parser.add_argument(
+        "--extensions", nargs="*", default=list(FAST_LOADER_MAPPING), help="to compare"
+    )
+    args = parser.parse_args(arguments)
+
+    report = list()
+    with tempfile.TemporaryDirectory() as directory:
+        corpus = write_corpus(directory, args.extensions, args.documents, args.sections)
+        for extension, paths in corpus.items():
+            fast = measure(*FAST_LOADER_MAPPING[extension], paths)
+            fallback = measure(*LOADER_MAPPING[extension], paths)
+            speedup = (
+                fast["documents_per_second"] / fallback["documents_per_second"]
+                if "error" not in fast and "error" not in fallback
+                else None
+            )
+            report.append(
+                {
+                    "extension": extension,
+                    "fast": fast,
+                    "fallback": fallback,
+                    "speedup": speedup,
+                }
+            )
+    print(json.dumps(report, indent=2))
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+import argparse
+import json
+import random
+import time
+from typing import Any, Dict, List, Optional
+
+from app.config import config
+from app.consts import PROMPT_FORMAT
+from app.generation.prefix_cache import PrefixCachedLLM
+from app.generation.profiles import InferenceProfile, load_instruct_pipeline
+from app.latency import percentile
+
+WORDS = (
+    "delta lake table transaction log commit checkpoint parquet file schema partition "
+    "merge update delete vacuum optimize z-order time travel version stream spark"
+).split()
+
+
+def build_prompts(count: int, context_words: int) -> List[str]:
+    """
+    Build prompts with random contexts of a given number of words.
+
+    :param count: the number of prompts
+    :param context_words: the number of words of each context
+    :return: the prompts
+    """
+    generator = random.Random(0)
+    return [
+        PROMPT_FORMAT.format(
+            context=" ".join(generator.choices(WORDS, k=context_words)),
+            question="How does Delta Lake provide ACID transactions?",
+        )
+        for _ in range(count)
+    ]
+
+
+def measure(llm: PrefixCachedLLM, prompts: List[str]) -> Dict[str, Any]:
+    """
+    Measure the prefill latency of prompts, after a warm-up prefill.
+
+    :param llm: the LLM
+    :param prompts: the prompts
+    :return: the latency percentiles and the mean number of reused tokens
+    """
+    llm.prefill(prompts[0])
+    latencies, reused_tokens = list(), 0
+    for prompt in prompts:
+        start = time.perf_counter()
+        _, _, reused = llm.prefill(prompt)
+        latencies.append(time.perf_counter() - start)
+        reused_tokens += reused
+    return {
+        "prompt_tokens": sum(llm.get_num_tokens(p) for p in prompts) / len(prompts),
+        "reused_tokens": reused_tokens / len(prompts),
+        "p50_milliseconds": percentile(latencies, 50) * 1000,
+        "p95_milliseconds": percentile(latencies, 95) * 1000,
+    }
+
+
+def main(arguments: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+    parser = argparse.ArgumentParser(
+        description="Report the prefill latency with and without the prefix cache."
+    )
+    parser.add_argument("--model", default=config.DATABRICKS_MODEL_NAME)
+    parser.add_argument("--context-words", type=int, nargs="*", default=[50, 200])
+    parser.add_argument("--prompts", type=int, default=20)
+    args = parser.parse_args(arguments)
+
+    instruct_pipeline = load_instruct_pipeline(
+        args.model, InferenceProfile.from_config()
+    )
+    llms = {
+        "full": PrefixCachedLLM.from_pipeline(instruct_pipeline, prefix=""),
+        "cached": PrefixCachedLLM.from_pipeline(instruct_pipeline),
+    }
+    report = list()
+    for context_words in args.context_words:
+        prompts = build_prompts(args.prompts, context_words)
+        for name, llm in llms.items():
+            result = {
+                "prefill": name,
+                "context_words": context_words,
+                **measure(llm, prompts),
+            }
+            print(json.dumps(result))
+            report.append(result)
+    return report
+
+
+if __name__ == "__main__":
+    main()
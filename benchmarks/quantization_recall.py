@@ -0,0 +1,147 @@
+import argparse
+import json
+import time
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+from langchain.embeddings import HuggingFaceEmbeddings
+from langchain.vectorstores import Chroma
+
+from app.config import VectorPrecision, config, get_chroma_settings
+from app.retrieval.quantization import QuantizedIndex, normalize, read_chroma_collection
+from app.retrieval.shards import existing_shards, shard_directory
+from app.stubs import StubEmbeddings
+from benchmarks.bulk_questions import read_questions
+
+
+def recall_at_k(expected: np.ndarray, found: List[List[int]], k: int) -> float:
+    """
+    Compute the recall@k of the rows found against the expected ones.
+
+    :param expected: the expected rows by query
+    :param found: the rows found by query
+    :param k: the number of rows compared
+    :return: the mean recall@k
+    """
+    return float(
+        np.mean(
+            [
+                len(set(expected_rows[:k]) & set(found_rows[:k])) / k
+                for expected_rows, found_rows in zip(expected, found)
+            ]
+        )
+    )
+
+
+def read_embeddings(persist_directory: str) -> np.ndarray:
+    """
+    Read the float32 embeddings of a database, the collections of all the shards of a sharded database.
+
+    :param persist_directory: the directory of the database
+    :return: the embeddings
+    """
+    directories = [
+        shard_directory(persist_directory, shard)
+        for shard in existing_shards(persist_directory)
+    ] or [persist_directory]
+    return np.concatenate(
+        [
+            read_chroma_collection(
+                Chroma(
+                    persist_directory=directory,
+                    client_settings=get_chroma_settings(directory),
+                )
+            )[0]
+            for directory in directories
+        ]
+    )
+
+
+def evaluate(
+    embeddings: np.ndarray,
+    queries: np.ndarray,
+    k: int,
+    precisions: List[VectorPrecision],
+    rescore_candidates: List[int],
+) -> List[Dict[str, Any]]:
+    """
+    Evaluate the quantized indexes against the exhaustive float32 search.
+
+    :param embeddings: the float32 embeddings of the chunks
+    :param queries: the float32 embeddings of the queries
+    :param k: the number of chunks searched
+    :param precisions: the precisions to evaluate
+    :param rescore_candidates: the numbers of rescored candidates to evaluate, 0 without rescoring
+    :return: the recall, the memory and the latency of each configuration
+    """
+    queries = normalize(queries)
+    expected = np.argsort(-(queries @ normalize(embeddings).T), axis=1)[:, :k]
+    # The texts are the row numbers to find the rows of the results
+    texts = [str(row) for row in range(len(embeddings))]
+    metadatas = [dict() for _ in texts]
+    report = list()
+    for precision in precisions:
+        for candidates in rescore_candidates:
+            index = QuantizedIndex.from_embeddings(
+                embeddings, texts, metadatas, precision, rescore_candidates=candidates
+            )
+            start = time.perf_counter()
+            results = [index.search_by_vector(query, k=k) for query in queries]
+            search_seconds = (time.perf_counter() - start) / len(queries)
+            found = [[int(document.page_content) for document, _ in r] for r in results]
+            report.append(
+                {
+                    "precision": precision.value,
+                    "rescore_candidates": candidates,
+                    f"recall@{k}": recall_at_k(expected, found, k),
+                    "bytes": index.nbytes,
+                    "compression": embeddings.astype(np.float32).nbytes / index.nbytes,
+                    "search_milliseconds": search_seconds * 1000,
+                }
+            )
+    return report
+
+
+def main(arguments: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+    parser = argparse.ArgumentParser(
+        description="Report the recall@k of the quantized embeddings against float32."
+    )
+    parser.add_argument("--persist-directory", default=config.PERSIST_DIRECTORY)
+    parser.add_argument("--questions", help="JSONL questions used as queries")
+    parser.add_argument("--sample", type=int, default=200, help="chunks as queries")
+    parser.add_argument("--k", type=int, default=config.SOURCE_DOCUMENTS_MAX_COUNT)
+    parser.add_argument("--rescore", type=int, nargs="*", default=[0, 20])
+    parser.add_argument("--stub-embeddings", action="store_true")
+    args = parser.parse_args(arguments)
+
+    embeddings = read_embeddings(args.persist_directory)
+    if args.questions:
+        if args.stub_embeddings:
+            model = StubEmbeddings(size=embeddings.shape[1])
+        else:
+            model = HuggingFaceEmbeddings(model_name=config.PREPARATION_MODEL_NAME)
+        questions = [
+            question["question"] for question in read_questions(args.questions)
+        ]
+        queries = np.array(model.embed_documents(questions), dtype=np.float32)
+    else:
+        # Perturbed chunks are used as queries when no question is given
+        rows = np.random.default_rng(0).choice(
+            len(embeddings), size=min(args.sample, len(embeddings)), replace=False
+        )
+        noise = np.random.default_rng(1).normal(0, 0.01, embeddings[rows].shape)
+        queries = embeddings[rows] + noise.astype(np.float32)
+
+    report = evaluate(
+        embeddings,
+        queries,
+        k=args.k,
+        precisions=list(VectorPrecision),
+        rescore_candidates=args.rescore,
+    )
+    print(json.dumps(report, indent=2))
+    return report
+
+
+if __name__ == "__main__":
+    main()
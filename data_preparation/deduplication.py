@@ -0,0 +1,161 @@
+import json
+import logging
+import re
+import zlib
+from typing import Dict, List, Tuple
+
+import numpy as np
+from langchain.docstore.document import Document
+from pydantic import BaseModel
+
+from app.retrieval.base import sources_of
+
+WORD = re.compile(r"\w+")
+# Mersenne prime of the universal hash functions, the products of 32-bit values fit in 64 bits
+PRIME = (1 << 31) - 1
+
+
+class DeduplicationReport(BaseModel):
+    """
+    Report of the near-duplicate chunks removed before the embeddings.
+    """
+
+    chunks: int
+    duplicates: int
+    characters: int
+    removed_characters: int
+
+    @property
+    def ratio(self) -> float:
+        return self.duplicates / self.chunks if self.chunks else 0.0
+
+
+def lsh_bands(permutations: int, threshold: float) -> Tuple[int, int]:
+    """
+    Choose the bands of the LSH whose S-curve turns around the similarity threshold.
+
+    :param permutations: the number of permutations of the signatures
+    :param threshold: the Jaccard similarity of the near-duplicates
+    :return: the number of bands, the number of rows by band
+    """
+    return min(
+        (
+            (permutations // rows, rows)
+            for rows in range(1, permutations + 1)
+            if permutations // rows
+        ),
+        key=lambda bands_rows: abs(
+            (1 / bands_rows[0]) ** (1 / bands_rows[1]) - threshold
+        ),
+    )
+
+
+class MinHasher:
+    """
+    MinHash signatures of the word shingles of the texts.
+    """
+
+    def __init__(self, permutations: int = 128, shingle_size: int = 5, seed: int = 0):
+        """
+        :param permutations: the number of hash functions of the signatures
+        :param shingle_size: the number of words by shingle
+        :param seed: the seed of the hash functions
+        """
+        rng = np.random.default_rng(seed)
+        self.a = rng.integers(1, PRIME, size=(permutations, 1), dtype=np.uint64)
+        self.b = rng.integers(0, PRIME, size=(permutations, 1), dtype=np.uint64)
+        self.shingle_size = shingle_size
+
+    def shingles(self, text: str) -> np.ndarray:
+        words = WORD.findall(text.lower())
+        count = max(len(words) - self.shingle_size + 1, 1)
+        return np.fromiter(
+            {
+                zlib.crc32(" ".join(words[i : i + self.shingle_size]).encode())
+                for i in range(count)
+            },
+            dtype=np.uint64,
+        )
+
+    def signature(self, text: str) -> np.ndarray:
+        """
+        Get the MinHash signature of a text.
+
+        :param text: the text
+        :return: the minimum of each hash function over the shingles of the text
+        """
+        return ((self.a * self.shingles(text) + self.b) % PRIME).min(axis=1)
+
+
+def deduplicate_chunks(
+    texts: List[Document],
+    threshold: float = 0.8,
+    permutations: int = 128,
+    shingle_size: int = 5,
+) -> Tuple[List[Document], DeduplicationReport]:
+    """
+    Remove the near-duplicate chunks, found with the MinHash LSH of their word shingles.
+
+    The first chunk in the order of the sources is kept, it lists the sources of its removed
+    near-duplicates in the `sources` metadata as a JSON list, Chroma only storing scalar metadata.
+
+    :param texts: the chunks
+    :param threshold: the estimated Jaccard similarity from which the chunks are near-duplicates
+    :param permutations: the number of hash functions of the signatures
+    :param shingle_size: the number of words by shingle
+    :return: the kept chunks and the report of the removed ones
+    """
+    bands, rows = lsh_bands(permutations, threshold)
+    hasher = MinHasher(permutations=permutations, shingle_size=shingle_size)
+    buckets: List[Dict[bytes, int]] = [dict() for _ in range(bands)]
+    kept: List[Document] = list()
+    signatures: List[np.ndarray] = list()
+    sources: List[List[str]] = list()
+    removed_characters = 0
+    ordered = sorted(
+        enumerate(texts),
+        key=lambda indexed: (indexed[1].metadata.get("source", ""), indexed[0]),
+    )
+    for _, text in ordered:
+        signature = hasher.signature(text.page_content)
+        keys = [
+            signature[band * rows : (band + 1) * rows].tobytes()
+            for band in range(bands)
+        ]
+        candidates = {
+            buckets[band][key] for band, key in enumerate(keys) if key in buckets[band]
+        }
+        duplicate = next(
+            (
+                candidate
+                for candidate in sorted(candidates)
+                if np.mean(signatures[candidate] == signature) >= threshold
+            ),
+            None,
+        )
+        if duplicate is not None:
+            for source in sources_of(text.metadata):
+                if source not in sources[duplicate]:
+                    sources[duplicate].append(source)
+            removed_characters += len(text.page_content)
+            continue
+        for band, key in enumerate(keys):
+            buckets[band].setdefault(key, len(kept))
+        kept.append(text)
+        signatures.append(signature)
+        sources.append(sources_of(text.metadata))
+
+    for text, text_sources in zip(kept, sources):
+        if len(text_sources) > 1:
+            text.metadata["sources"] = json.dumps(text_sources)
+    report = DeduplicationReport(
+        chunks=len(texts),
+        duplicates=len(texts) - len(kept),
+        characters=sum(len(text.page_content) for text in texts),
+        removed_characters=removed_characters,
+    )
+    logging.info(
+        f"Removed {report.duplicates} near-duplicate chunks of {report.chunks} "
+        f"({report.ratio:.1%}, {report.removed_characters} characters)"
+    )
+    return kept, report
@@ -0,0 +1,392 @@
+import argparse
+import asyncio
+import logging
+import os
+import shutil
+import tempfile
+import time
+import uuid
+from typing import TYPE_CHECKING, Any, Dict, Iterator, List, Optional, Tuple
+
+from langchain.docstore.document import Document
+from langchain.embeddings.base import Embeddings
+from langchain.vectorstores import Chroma
+from tabulate import tabulate
+
+from app.config import ModelBackend, config, get_chroma_settings
+from app.metrics import INGESTED, stage
+from app.retrieval.shards import existing_shards
+from data_preparation.ingest_documents import (
+    does_vectorstore_exist,
+    group_by_shard,
+    ingested_sources,
+    list_documents,
+    load_single_document,
+    open_shard,
+    remove_duplicates,
+    split_documents,
+    update_lexical_index,
+)
+
+if TYPE_CHECKING:
+    # Databricks provides pyspark, it is only installed to run the ingestion locally
+    from pyspark.sql import SparkSession
+
+# Chunks added to Chroma by call, to bound the size of its inserts
+ADD_BATCH_SIZE = 5000
+
+# Embeddings models of the Python workers of the executors, loaded by their first partition
+EXECUTOR_EMBEDDINGS: Dict[Tuple[str, ModelBackend], Embeddings] = dict()
+
+
+def executor_embeddings(model_name: str, backend: ModelBackend) -> Embeddings:
+    """
+    Get the embeddings model of the Python worker, loaded once for all its partitions.
+
+    :param model_name: the name of the embeddings model
+    :param backend: the backend of the embeddings
+    :return: the embeddings model
+    """
+    key = (model_name, backend)
+    if key not in EXECUTOR_EMBEDDINGS:
+        if backend == ModelBackend.STUB:
+            from app.stubs import StubEmbeddings
+
+            EXECUTOR_EMBEDDINGS[key] = StubEmbeddings()
+        else:
+            from langchain.embeddings import HuggingFaceEmbeddings
+
+            EXECUTOR_EMBEDDINGS[key] = HuggingFaceEmbeddings(model_name=model_name)
+    return EXECUTOR_EMBEDDINGS[key]
+
+
+def balance_files(files: List[str], partitions: int) -> List[List[str]]:
+    """
+    Spread files over partitions of similar sizes, the largest files first to the least loaded partition.
+
+    :param files: the files
+    :param partitions: the number of partitions
+    :return: the files of each non-empty partition
+    """
+    groups: List[List[str]] = [list() for _ in range(max(partitions, 1))]
+    loads = [0] * len(groups)
+    for file_path in sorted(files, key=os.path.getsize, reverse=True):
+        position = loads.index(min(loads))
+        groups[position].append(file_path)
+        loads[position] += os.path.getsize(file_path)
+    return [group for group in groups if group]
+
+
+def read_files(files: List[str]) -> List[Tuple[str, bytes]]:
+    """
+    Read the files shipped to the executors, the source documents directory only exists on the driver.
+
+    :param files: the files
+    :return: the path and the content of each file
+    """
+    contents = list()
+    for file_path in files:
+        with open(file_path, "rb") as file:
+            contents.append((file_path, file.read()))
+    return contents
+
+
+def load_shipped_document(
+    file_path: str, content: bytes, directory: str
+) -> List[Document]:
+    """
+    Load a document shipped by the driver from a copy of its content, the documents keep the path of the driver.
+
+    :param file_path: the path of the document on the driver
+    :param content: the content of the document
+    :param directory: the directory of the copy on the executor
+    :return: the documents
+    """
+    local_path = os.path.join(directory, os.path.basename(file_path))
+    os.makedirs(directory, exist_ok=True)
+    with open(local_path, "wb") as file:
+        file.write(content)
+    documents = load_single_document(local_path)
+    for document in documents:
+        document.metadata = {
+            key: file_path if value == local_path else value
+            for key, value in document.metadata.items()
+        }
+    return documents
+
+
+def embed_partition(
+    partition: int,
+    files: Iterator[List[Tuple[str, bytes]]],
+    model_name: str,
+    backend: ModelBackend,
+) -> Iterator[Tuple[str, Any]]:
+    """
+    Load, split and embed the documents of a partition on an executor.
+
+    :param partition: the index of the partition
+    :param files: the paths on the driver and the contents of the files of the partition
+    :param model_name: the name of the embeddings model
+    :param backend: the backend of the embeddings
+    :return: a ("chunk", (text, metadata, vector)) record by chunk, then a ("partition", statistics) record
+    """
+    start = time.perf_counter()
+    files = [shipped for group in files for shipped in group]
+    embeddings = executor_embeddings(model_name, backend)
+    model_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    documents, failed = list(), 0
+    with tempfile.TemporaryDirectory() as directory:
+        for position, (file_path, content) in enumerate(files):
+            try:
+                documents.extend(
+                    load_shipped_document(
+                        file_path, content, os.path.join(directory, str(position))
+                    )
+                )
+            except Exception:
+                logging.exception(f"The document {file_path} could not be loaded.")
+                failed += 1
+    load_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    texts = split_documents(documents) if documents else list()
+    split_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    vectors = (
+        embeddings.embed_documents([text.page_content for text in texts])
+        if texts
+        else list()
+    )
+    embed_seconds = time.perf_counter() - start
+
+    for text, vector in zip(texts, vectors):
+        yield "chunk", (text.page_content, text.metadata, list(vector))
+    seconds = model_seconds + load_seconds + split_seconds + embed_seconds
+    yield "partition", {
+        "partition": partition,
+        "host": os.uname().nodename,
+        "files": len(files),
+        "failed": failed,
+        "documents": len(documents),
+        "chunks": len(texts),
+        "model_seconds": model_seconds,
+        "load_seconds": load_seconds,
+        "split_seconds": split_seconds,
+        "embed_seconds": embed_seconds,
+        "chunks_per_second": len(texts) / seconds if seconds else 0.0,
+    }
+
+
+def add_embedded_chunks(
+    db: Chroma, texts: List[Document], vectors: List[List[float]]
+) -> None:
+    """
+    Add chunks embedded on the executors to a Chroma collection, without embedding them again.
+
+    :param db: the Chroma collection
+    :param texts: the chunks
+    :param vectors: the embeddings of the chunks
+    """
+    for start in range(0, len(texts), ADD_BATCH_SIZE):
+        batch = texts[start : start + ADD_BATCH_SIZE]
+        db._collection.add(
+            ids=[str(uuid.uuid1()) for _ in batch],
+            embeddings=vectors[start : start + ADD_BATCH_SIZE],
+            documents=[text.page_content for text in batch],
+            metadatas=[text.metadata for text in batch],
+        )
+
+
+def format_partition_report(partitions: List[Dict[str, Any]]) -> str:
+    """
+    Format the throughput of the partitions of a distributed ingestion.
+
+    :param partitions: the statistics of the partitions
+    :return: the table of the partitions and the total throughput
+    """
+    table = tabulate(
+        [
+            [
+                stats["partition"],
+                stats["host"],
+                stats["files"],
+                stats["failed"],
+                stats["chunks"],
+                f"{stats['model_seconds']:.1f}",
+                f"{stats['load_seconds']:.1f}",
+                f"{stats['split_seconds']:.1f}",
+                f"{stats['embed_seconds']:.1f}",
+                f"{stats['chunks_per_second']:.1f}",
+            ]
+            for stats in sorted(partitions, key=lambda stats: stats["partition"])
+        ],
+        headers=[
+            "partition",
+            "host",
+            "files",
+            "failed",
+            "chunks",
+            "model (s)",
+            "load (s)",
+            "split (s)",
+            "embed (s)",
+            "chunks/s",
+        ],
+        disable_numparse=True,
+    )
+    chunks = sum(stats["chunks"] for stats in partitions)
+    return f"{table}\n\n{chunks} chunks embedded by {len(partitions)} partitions."
+
+
+async def ingest_documents_with_spark(
+    spark: "SparkSession",
+    persist_directory: str,
+    model_name: str,
+    partitions: int = config.SPARK_INGESTION_PARTITIONS,
+    lexical_index_directory: Optional[str] = config.LEXICAL_INDEX_DIRECTORY,
+    sharding: bool = config.VECTOR_STORE_SHARDING,
+    embeddings_backend: ModelBackend = config.EMBEDDINGS_BACKEND,
+) -> List[Dict[str, Any]]:
+    """
+    Ingest the new documents with the executors of a Spark cluster.
+
+    The files are spread over the partitions by size and shipped with their contents, each partition
+    is loaded, split and embedded on an executor with the embeddings model of its Python worker.
+    The driver collects the embedded chunks partition by partition, removes the near-duplicates and
+    adds them to the database, like the ingestion on a single machine. Nothing is added when a
+    document could not be loaded.
+
+    :param spark: the Spark session
+    :param persist_directory: the directory of the database
+    :param model_name: the name of the embeddings model
+    :param partitions: the number of partitions, 0 for the default parallelism of the cluster
+    :param lexical_index_directory: the directory of the lexical index, None to skip it
+    :param sharding: ingest the chunks in a collection by source family
+    :param embeddings_backend: the backend of the embeddings on the executors
+    :return: the statistics of the partitions
+    """
+    if sharding:
+        dbs = {
+            shard: open_shard(persist_directory, shard, None)
+            for shard in existing_shards(persist_directory)
+        }
+    elif does_vectorstore_exist(persist_directory=persist_directory):
+        logging.info(f"Appending to existing vectorstore at {persist_directory}")
+        dbs = {
+            None: Chroma(
+                persist_directory=persist_directory,
+                client_settings=get_chroma_settings(persist_directory),
+            )
+        }
+    else:
+        logging.info("Creating new vectorstore")
+        dbs = dict()
+    existing = {"documents": list(), "metadatas": list()}
+    for db in dbs.values():
+        collection = db.get()
+        existing["documents"].extend(collection["documents"])
+        existing["metadatas"].extend(collection["metadatas"])
+
+    files = list_documents(
+        config.SOURCE_DOCUMENTS_DIRECTORY,
+        ignored_files=ingested_sources(existing["metadatas"]),
+    )
+    if not files:
+        logging.info("No new documents to load")
+        return list()
+    groups = balance_files(files, partitions or spark.sparkContext.defaultParallelism)
+    logging.info(f"Embedding {len(files)} documents in {len(groups)} partitions")
+
+    texts: List[Document] = list()
+    vectors: Dict[int, List[float]] = dict()
+    statistics: List[Dict[str, Any]] = list()
+    with stage("distributed_embed", pipeline="ingestion"):
+        records = (
+            spark.sparkContext.parallelize(
+                [read_files(group) for group in groups], len(groups)
+            )
+            .mapPartitionsWithIndex(
+                lambda partition, files: embed_partition(
+                    partition, files, model_name, embeddings_backend
+                )
+            )
+            .toLocalIterator(prefetchPartitions=True)
+        )
+        for kind, record in records:
+            if kind == "partition":
+                statistics.append(record)
+                continue
+            text, metadata, vector = record
+            texts.append(Document(page_content=text, metadata=metadata))
+            vectors[id(texts[-1])] = vector
+    INGESTED.labels(kind="documents").inc(
+        sum(stats["documents"] for stats in statistics)
+    )
+    INGESTED.labels(kind="chunks").inc(len(texts))
+    logging.info(format_partition_report(statistics))
+    failed = sum(stats["failed"] for stats in statistics)
+    if failed:
+        raise RuntimeError(
+            f"{failed} documents could not be loaded by the executors, nothing was ingested."
+        )
+    texts = remove_duplicates(texts)
+
+    with stage("persist", pipeline="ingestion"):
+        if sharding:
+            for shard, shard_texts in group_by_shard(texts).items():
+                db = dbs.get(shard) or open_shard(persist_directory, shard, None)
+                add_embedded_chunks(
+                    db, shard_texts, [vectors[id(text)] for text in shard_texts]
+                )
+                db.persist()
+        else:
+            db = dbs.get(None) or Chroma(
+                persist_directory=persist_directory,
+                client_settings=get_chroma_settings(persist_directory),
+            )
+            add_embedded_chunks(db, texts, [vectors[id(text)] for text in texts])
+            db.persist()
+    if lexical_index_directory:
+        if not dbs and not sharding:
+            # The lexical index follows the new vectorstore
+            shutil.rmtree(lexical_index_directory, ignore_errors=True)
+        update_lexical_index(lexical_index_directory, texts, existing=existing)
+    logging.info("Distributed ingestion complete!")
+    return statistics
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Ingest the documents with Spark, in local mode by default."
+    )
+    parser.add_argument(
+        "--master", default="local[*]", help="the master of the Spark session"
+    )
+    parser.add_argument(
+        "--partitions", type=int, default=config.SPARK_INGESTION_PARTITIONS
+    )
+    parser.add_argument("--stub-embeddings", action="store_true")
+    args = parser.parse_args()
+
+    import pyspark.sql
+
+    spark = (
+        pyspark.sql.SparkSession.builder.master(args.master)
+        .appName("delta-buddy-ingestion")
+        .getOrCreate()
+    )
+    asyncio.run(
+        ingest_documents_with_spark(
+            spark,
+            persist_directory=config.PERSIST_DIRECTORY,
+            model_name=config.PREPARATION_MODEL_NAME,
+            partitions=args.partitions,
+            embeddings_backend=ModelBackend.STUB
+            if args.stub_embeddings
+            else config.EMBEDDINGS_BACKEND,
+        )
+    )
+    spark.stop()
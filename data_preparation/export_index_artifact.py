@@ -0,0 +1,141 @@
+import argparse
+import asyncio
+import logging
+import os
+import shutil
+import tempfile
+from typing import Optional
+
+from langchain.vectorstores import Chroma
+
+from app.config import VectorPrecision, config, get_chroma_settings
+from app.metrics import stage
+from app.retrieval.artifact import (
+    LEXICAL_DIRECTORY,
+    STAGING_PREFIX,
+    ArtifactIndex,
+    IndexArtifact,
+    activate_version,
+    current_version,
+    list_versions,
+    publish_artifact,
+    remove_staging_directories,
+)
+from app.retrieval.lexical import LexicalIndex
+from app.retrieval.quantization import read_chroma_collection
+from app.retrieval.shards import existing_shards, shard_directory
+
+
+async def export_index_artifact(
+    persist_directory: str,
+    artifact_directory: str,
+    precision: VectorPrecision,
+    keep_full_precision: bool = False,
+    sharding: bool = config.VECTOR_STORE_SHARDING,
+    lexical_index_directory: Optional[str] = config.LEXICAL_INDEX_DIRECTORY,
+    activate: bool = True,
+) -> str:
+    """
+    Pack the Chroma database and the lexical index in a new read-only version of the index artifact.
+
+    :param persist_directory: the directory of the Chroma database
+    :param artifact_directory: the directory of the artifact versions
+    :param precision: the precision of the searched embeddings
+    :param keep_full_precision: save the float32 embeddings too, they are needed for the rescoring
+    :param sharding: export the shards of the Chroma database
+    :param lexical_index_directory: the directory of the lexical index, None to skip it
+    :param activate: make the new version the one served by default
+    :return: the new version
+    """
+    os.makedirs(artifact_directory, exist_ok=True)
+    remove_staging_directories(artifact_directory)
+    staging_directory = tempfile.mkdtemp(prefix=STAGING_PREFIX, dir=artifact_directory)
+    shards = existing_shards(persist_directory) if sharding else list()
+    chunks = 0
+    with stage("export_artifact", pipeline="ingestion"):
+        for shard in shards or [None]:
+            source_directory = (
+                shard_directory(persist_directory, shard)
+                if shard
+                else persist_directory
+            )
+            output_directory = (
+                shard_directory(staging_directory, shard)
+                if shard
+                else staging_directory
+            )
+            os.makedirs(output_directory, exist_ok=True)
+            db = Chroma(
+                persist_directory=source_directory,
+                client_settings=get_chroma_settings(source_directory),
+            )
+            embeddings, texts, metadatas = read_chroma_collection(db)
+            ArtifactIndex.write(
+                output_directory,
+                embeddings=embeddings,
+                texts=texts,
+                metadatas=metadatas,
+                precision=precision,
+                keep_full_precision=keep_full_precision,
+            )
+            chunks += len(texts)
+        lexical = bool(
+            lexical_index_directory and os.path.isdir(lexical_index_directory)
+        )
+        if lexical:
+            # The copy is compacted, the artifact does not keep the deleted chunks
+            lexical_copy = os.path.join(staging_directory, LEXICAL_DIRECTORY)
+            shutil.copytree(lexical_index_directory, lexical_copy)
+            LexicalIndex.open(lexical_copy).compact()
+        version = publish_artifact(
+            artifact_directory,
+            staging_directory,
+            manifest={
+                "model_name": config.PREPARATION_MODEL_NAME,
+                "precision": precision.value,
+                "chunks": chunks,
+                "dimension": int(embeddings.shape[1]) if len(embeddings) else 0,
+                "shards": shards,
+                "lexical": lexical,
+            },
+        )
+    logging.info(
+        f"Exported {chunks} chunks in the version {version} of {artifact_directory}."
+    )
+    if activate:
+        activate_version(artifact_directory, version)
+    return version
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Export, list, verify or activate the versions of the index artifact."
+    )
+    parser.add_argument("--list", action="store_true", help="list the versions")
+    parser.add_argument("--verify", metavar="VERSION", help="verify the checksums")
+    parser.add_argument(
+        "--activate", metavar="VERSION", help="serve a version, to roll back"
+    )
+    args = parser.parse_args()
+    artifact_directory = config.INDEX_ARTIFACT_DIRECTORY
+
+    if args.list:
+        active = current_version(artifact_directory)
+        for version in list_versions(artifact_directory):
+            print(f"{version}{' (active)' if version == active else ''}")
+    elif args.verify:
+        IndexArtifact.open(artifact_directory, version=args.verify, verify=True)
+        print(f"The version {args.verify} is intact. ✅")
+    elif args.activate:
+        activate_version(artifact_directory, args.activate)
+        print(f"The version {args.activate} is active. ✅")
+    else:
+        version = asyncio.run(
+            export_index_artifact(
+                persist_directory=config.PERSIST_DIRECTORY,
+                artifact_directory=artifact_directory,
+                precision=config.VECTOR_STORE_PRECISION,
+                keep_full_precision=config.VECTOR_STORE_RESCORE_CANDIDATES > 0,
+            )
+        )
+        print(f"The index artifact {version} has been exported and activated. ✅")
@@ -1,8 +1,11 @@
+import atexit
 import glob
 import logging
 import os
+import shutil
+import tempfile
 from multiprocessing import Pool
-from typing import List
+from typing import Any, Dict, List, Optional
 
 from langchain.docstore.document import Document
 from langchain.document_loaders import (
@@ -23,7 +26,19 @@ from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain.vectorstores import Chroma
 from tqdm import tqdm
 
-from app.config import CHROMA_SETTINGS, config
+from app.config import config, get_chroma_settings
+from app.metrics import INGESTED, stage
+from app.retrieval.artifact import STAGING_PREFIX
+from app.retrieval.base import sources_of
+from app.retrieval.lexical import LexicalIndex
+from app.retrieval.shards import existing_shards, shard_directory, shard_of
+from data_preparation.deduplication import deduplicate_chunks
+from data_preparation.loaders import (
+    MarkdownLoader,
+    NotebookJSONLoader,
+    PlainTextLoader,
+    SimpleHTMLLoader,
+)
 
 chunk_size = 500
 chunk_overlap = 0
@@ -47,9 +62,24 @@ LOADER_MAPPING = {
     # Add more mappings for other file extensions and loaders as needed
 }
 
+# Map the text-like file extensions to the fast loaders, preferred to the loaders above
+FAST_LOADER_MAPPING = {
+    ".html": (SimpleHTMLLoader, {}),
+    ".md": (MarkdownLoader, {}),
+    ".mdx": (MarkdownLoader, {}),
+    ".txt": (PlainTextLoader, {}),
+    ".ipynb": (NotebookJSONLoader, {}),
+}
+
 
 def load_single_document(file_path: str) -> List[Document]:
     extension = f'.{file_path.rsplit(".", 1)[-1]}'
+    if (
+        extension in FAST_LOADER_MAPPING
+        and extension not in config.UNSTRUCTURED_LOADER_EXTENSIONS
+    ):
+        loader_class, loader_args = FAST_LOADER_MAPPING[extension]
+        return loader_class(file_path, **loader_args).load()
     if extension in LOADER_MAPPING and file_path:
         loader_class, loader_args = LOADER_MAPPING[extension]
         loader = loader_class(file_path, **loader_args)
@@ -58,18 +88,34 @@ def load_single_document(file_path: str) -> List[Document]:
     raise ValueError(f"Unsupported file extension for the document['{file_path}]'")
 
 
-def load_documents(source_dir: str, ignored_files: List[str] = []) -> List[Document]:
+def list_documents(source_dir: str, ignored_files: List[str] = []) -> List[str]:
     """
-    Loads all documents from the source documents directory, ignoring specified files
+    Lists the files of the documents from the source documents directory, ignoring specified files
     """
     all_files = []
     for extension in LOADER_MAPPING:
         all_files.extend(
             glob.glob(os.path.join(source_dir, f"**/*{extension}"), recursive=True)
         )
-    filtered_files = [
-        file_path for file_path in all_files if file_path not in ignored_files
-    ]
+    ignored_files = set(ignored_files)
+    return [file_path for file_path in all_files if file_path not in ignored_files]
+
+
+def ingested_sources(metadatas: List[Optional[Dict[str, Any]]]) -> List[str]:
+    """
+    Get the sources of the chunks already ingested, the sources of their removed near-duplicates included.
+
+    :param metadatas: the metadata of the ingested chunks
+    :return: the sources
+    """
+    return [source for metadata in metadatas for source in sources_of(metadata or {})]
+
+
+def load_documents(source_dir: str, ignored_files: List[str] = []) -> List[Document]:
+    """
+    Loads all documents from the source documents directory, ignoring specified files
+    """
+    filtered_files = list_documents(source_dir, ignored_files)
 
     results = list()
     with Pool(processes=os.cpu_count()) as pool:
@@ -89,25 +135,50 @@ async def process_documents(
 ) -> List[Document]:
     """
     Loads all documents from the source documents directory, ignoring specified files.
-    Splits the documents into chunks of text and returns a list of all chunks.
+    Splits the documents into chunks of text, removes the near-duplicate chunks and returns a list of all chunks.
 
     :param source_directory:
     :param ignored_files:
     :return:
     """
     logging.info(f"Loading documents from {source_directory}")
-    documents = load_documents(source_directory, ignored_files)
+    with stage("load", pipeline="ingestion"):
+        documents = load_documents(source_directory, ignored_files)
+    INGESTED.labels(kind="documents").inc(len(documents))
     if not documents:
         logging.info("No new documents to load")
         return list()
-    text_splitter = RecursiveCharacterTextSplitter.from_tiktoken_encoder(
-        chunk_size=chunk_size, chunk_overlap=chunk_overlap
-    )
     logging.info(f"Loaded {len(documents)} new documents from {source_directory}")
-    texts = text_splitter.split_documents(documents)
+    with stage("split", pipeline="ingestion"):
+        texts = split_documents(documents)
+    INGESTED.labels(kind="chunks").inc(len(texts))
     logging.info(
         f"Split into {len(texts)} chunks of text (max. {chunk_size} tokens each)"
     )
+    return remove_duplicates(texts)
+
+
+def split_documents(documents: List[Document]) -> List[Document]:
+    text_splitter = RecursiveCharacterTextSplitter.from_tiktoken_encoder(
+        chunk_size=chunk_size, chunk_overlap=chunk_overlap
+    )
+    return text_splitter.split_documents(documents)
+
+
+def remove_duplicates(texts: List[Document]) -> List[Document]:
+    """
+    Remove the near-duplicate chunks when the deduplication is enabled.
+
+    :param texts: the chunks
+    :return: the chunks without their near-duplicates
+    """
+    if not config.CHUNK_DEDUPLICATION:
+        return texts
+    with stage("deduplicate", pipeline="ingestion"):
+        texts, report = deduplicate_chunks(
+            texts, threshold=config.CHUNK_DEDUPLICATION_THRESHOLD
+        )
+    INGESTED.labels(kind="duplicate_chunks").inc(report.duplicates)
     return texts
 
 
@@ -128,39 +199,237 @@ def does_vectorstore_exist(persist_directory: str) -> bool:
     return False
 
 
+def update_lexical_index(
+    directory: str, texts: List[Document], existing: Optional[Dict[str, Any]] = None
+) -> LexicalIndex:
+    """
+    Add the new chunks to the lexical index, next to the Chroma database.
+
+    :param directory: the directory of the lexical index
+    :param texts: the new chunks
+    :param existing: the chunks already in the Chroma database, indexed if the lexical index is empty
+    :return: the lexical index
+    """
+    with stage("lexical_index", pipeline="ingestion"):
+        lexical_index = LexicalIndex.open(directory)
+        if not lexical_index and existing and existing["documents"]:
+            logging.info("Indexing the chunks of the existing vectorstore in BM25")
+            lexical_index.add_documents(
+                Document(page_content=text, metadata=metadata or {})
+                for text, metadata in zip(existing["documents"], existing["metadatas"])
+            )
+        lexical_index.add_documents(texts)
+    logging.info(f"The lexical index of {directory} has {len(lexical_index)} chunks")
+    return lexical_index
+
+
+def group_by_shard(texts: List[Document]) -> Dict[str, List[Document]]:
+    """
+    Group the chunks by the shard of their source.
+
+    :param texts: the chunks
+    :return: the chunks by shard
+    """
+    shards = dict()
+    for text in texts:
+        shard = shard_of(text.metadata["source"], config.SOURCE_DOCUMENTS_DIRECTORY)
+        shards.setdefault(shard, list()).append(text)
+    return shards
+
+
+def open_shard(
+    persist_directory: str, shard: str, embeddings: HuggingFaceEmbeddings
+) -> Chroma:
+    directory = shard_directory(persist_directory, shard)
+    return Chroma(
+        persist_directory=directory,
+        embedding_function=embeddings,
+        client_settings=get_chroma_settings(directory),
+    )
+
+
+def add_to_shard(
+    persist_directory: str,
+    shard: str,
+    texts: List[Document],
+    embeddings: HuggingFaceEmbeddings,
+    db: Optional[Chroma] = None,
+) -> Chroma:
+    """
+    Add chunks to the collection of a shard, the collection is created if it does not exist.
+
+    :param persist_directory: the directory of the sharded database
+    :param shard: the shard
+    :param texts: the chunks of the shard
+    :param embeddings: the embeddings of the chunks
+    :param db: the collection of the shard when it exists
+    :return: the collection of the shard
+    """
+    logging.info(f"Adding {len(texts)} chunks to the shard {shard}")
+    with stage("embed", pipeline="ingestion"):
+        if db:
+            db.add_documents(texts)
+        else:
+            directory = shard_directory(persist_directory, shard)
+            db = Chroma.from_documents(
+                texts,
+                embeddings,
+                persist_directory=directory,
+                client_settings=get_chroma_settings(directory),
+            )
+    with stage("persist", pipeline="ingestion"):
+        db.persist()
+    return db
+
+
+async def ingest_documents_in_shards(
+    persist_directory: str,
+    embeddings: HuggingFaceEmbeddings,
+    lexical_index_directory: Optional[str] = config.LEXICAL_INDEX_DIRECTORY,
+) -> None:
+    """
+    Ingest the new documents in a collection by source family.
+
+    :param persist_directory: the directory of the sharded database
+    :param embeddings: the embeddings of the chunks
+    :param lexical_index_directory: the directory of the lexical index, None to skip it
+    """
+    dbs = {
+        shard: open_shard(persist_directory, shard, embeddings)
+        for shard in existing_shards(persist_directory)
+    }
+    existing = {"documents": list(), "metadatas": list()}
+    for db in dbs.values():
+        collection = db.get()
+        existing["documents"].extend(collection["documents"])
+        existing["metadatas"].extend(collection["metadatas"])
+    texts = await process_documents(
+        source_directory=config.SOURCE_DOCUMENTS_DIRECTORY,
+        ignored_files=ingested_sources(existing["metadatas"]),
+    )
+    logging.info("Creating embeddings. May take some minutes...")
+    for shard, shard_texts in group_by_shard(texts).items():
+        add_to_shard(persist_directory, shard, shard_texts, embeddings, dbs.get(shard))
+    if lexical_index_directory:
+        update_lexical_index(lexical_index_directory, texts, existing=existing)
+    logging.info("Ingestion complete!")
+
+
+async def rebuild_shard(
+    persist_directory: str,
+    model_name: str,
+    shard: str,
+    lexical_index_directory: Optional[str] = config.LEXICAL_INDEX_DIRECTORY,
+) -> None:
+    """
+    Rebuild the collection of a shard from its source documents, without touching the other shards.
+
+    The collection is built in a staging directory and swapped with the current one at the end, the
+    current collection is kept when the rebuild fails. The chunks of the shard are replaced in the
+    lexical index, the chunks of the deleted source documents included.
+
+    :param persist_directory: the directory of the sharded database
+    :param model_name: the name of the embeddings model
+    :param shard: the shard to rebuild
+    :param lexical_index_directory: the directory of the lexical index, None to skip it
+    """
+    source_directory = config.SOURCE_DOCUMENTS_DIRECTORY
+    all_files = [
+        file_path
+        for extension in LOADER_MAPPING
+        for file_path in glob.glob(
+            os.path.join(source_directory, f"**/*{extension}"), recursive=True
+        )
+    ]
+    shard_files = [
+        file_path
+        for file_path in all_files
+        if shard_of(file_path, source_directory) == shard
+    ]
+    directory = shard_directory(persist_directory, shard)
+    os.makedirs(os.path.dirname(directory), exist_ok=True)
+    staging_directory = tempfile.mkdtemp(prefix=STAGING_PREFIX, dir=persist_directory)
+    try:
+        texts = await process_documents(
+            source_directory=source_directory,
+            ignored_files=[
+                file_path for file_path in all_files if file_path not in shard_files
+            ],
+        )
+        if texts:
+            embeddings = HuggingFaceEmbeddings(model_name=model_name)
+            db = add_to_shard(staging_directory, shard, texts, embeddings)
+            # Chroma persists its in-memory copy at exit, in the staging directory removed by then
+            atexit.unregister(db._client._db.persist)
+        if os.path.isdir(directory):
+            os.replace(directory, os.path.join(staging_directory, "previous"))
+        if texts:
+            os.replace(shard_directory(staging_directory, shard), directory)
+    finally:
+        shutil.rmtree(staging_directory, ignore_errors=True)
+    if lexical_index_directory:
+        with stage("lexical_index", pipeline="ingestion"):
+            lexical_index = LexicalIndex.open(lexical_index_directory)
+            lexical_index.delete_documents(
+                lambda document: shard_of(document.metadata["source"], source_directory)
+                == shard
+            )
+            lexical_index.add_documents(texts)
+    logging.info(f"The shard {shard} is rebuilt with {len(texts)} chunks.")
+
+
 async def ingest_documents_in_database(
-    persist_directory: str, model_name: str
-) -> List[Document]:
+    persist_directory: str,
+    model_name: str,
+    lexical_index_directory: Optional[str] = config.LEXICAL_INDEX_DIRECTORY,
+    sharding: bool = config.VECTOR_STORE_SHARDING,
+) -> None:
     embeddings = HuggingFaceEmbeddings(model_name=model_name)
+    if sharding:
+        await ingest_documents_in_shards(
+            persist_directory, embeddings, lexical_index_directory
+        )
+        return
     if does_vectorstore_exist(persist_directory=persist_directory):
         logging.info(f"Appending to existing vectorstore at {persist_directory}")
         db = Chroma(
             persist_directory=persist_directory,
             embedding_function=embeddings,
-            client_settings=CHROMA_SETTINGS,
+            client_settings=get_chroma_settings(persist_directory),
         )
         collection = db.get()
         texts = await process_documents(
             source_directory=config.SOURCE_DOCUMENTS_DIRECTORY,
-            ignored_files=[metadata["source"] for metadata in collection["metadatas"]],
+            ignored_files=ingested_sources(collection["metadatas"]),
         )
         logging.info("Creating embeddings. May take some minutes...")
         if texts:
-            db.add_documents(texts)
+            with stage("embed", pipeline="ingestion"):
+                db.add_documents(texts)
+        if lexical_index_directory:
+            update_lexical_index(lexical_index_directory, texts, existing=collection)
     else:
         # Create and store locally vectorstore
         logging.info("Creating new vectorstore")
-        texts = await process_documents(source_directory=config.SOURCE_DOCUMENTS_DIRECTORY)
-        logging.info("Creating embeddings. May take some minutes...")
-        db = Chroma.from_documents(
-            texts,
-            embeddings,
-            persist_directory=persist_directory,
-            client_settings=CHROMA_SETTINGS,
+        texts = await process_documents(
+            source_directory=config.SOURCE_DOCUMENTS_DIRECTORY
         )
+        logging.info("Creating embeddings. May take some minutes...")
+        with stage("embed", pipeline="ingestion"):
+            db = Chroma.from_documents(
+                texts,
+                embeddings,
+                persist_directory=persist_directory,
+                client_settings=get_chroma_settings(persist_directory),
+            )
         # Force flush
         db.similarity_search("dummy")
-    db.persist()
+        if lexical_index_directory:
+            # The lexical index follows the new vectorstore
+            shutil.rmtree(lexical_index_directory, ignore_errors=True)
+            update_lexical_index(lexical_index_directory, texts)
+    with stage("persist", pipeline="ingestion"):
+        db.persist()
     db = None
 
     logging.info("Ingestion complete!")
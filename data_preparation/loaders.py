@@ -0,0 +1,184 @@
+import json
+import re
+from abc import abstractmethod
+from html.parser import HTMLParser
+from typing import IO, List, Tuple
+
+from langchain.docstore.document import Document
+from langchain.document_loaders.base import BaseLoader
+
+BLOCK_SIZE = 1 << 16
+
+IMAGE = re.compile(r"!\[([^\]]*)\]\([^)]*\)")
+LINK = re.compile(r"\[([^\]]*)\]\([^)]*\)")
+LINK_DEFINITION = re.compile(r"^\s*\[[^\]]+\]:\s+\S+")
+HEADING = re.compile(r"^\s{0,3}#{1,6}\s+")
+EMPHASIS = re.compile(r"(\*\*|`)")
+TAG = re.compile(r"</?[A-Za-z][^>]*>")
+MDX_STATEMENT = re.compile(r"^(import|export)\s")
+
+
+class FastLoader(BaseLoader):
+    """
+    Loader streaming a text-like file in a single document, without the Unstructured dependencies.
+
+    The documents have the same metadata as the ones of the langchain loaders.
+    """
+
+    def __init__(self, file_path: str, encoding: str = "utf8") -> None:
+        self.file_path = file_path
+        self.encoding = encoding
+
+    def load(self) -> List[Document]:
+        with open(self.file_path, encoding=self.encoding) as file:
+            text = self.read(file)
+        return [Document(page_content=text, metadata={"source": self.file_path})]
+
+    @abstractmethod
+    def read(self, file: IO[str]) -> str:
+        """
+        Read the text of the document.
+
+        :param file: the file opened in text mode
+        :return: the text
+        """
+
+
+class PlainTextLoader(FastLoader):
+    """
+    Loader of the plain text files, read at once: the whole text is kept anyway.
+    """
+
+    def read(self, file: IO[str]) -> str:
+        return file.read()
+
+
+class MarkdownLoader(FastLoader):
+    """
+    Loader of the Markdown and MDX files, keeping the text and the code without the markup.
+
+    The front matter, the comments, the MDX imports and exports, the link targets and the tags are dropped.
+    """
+
+    def read(self, file: IO[str]) -> str:
+        lines = list()
+        front_matter = in_code = in_comment = False
+        for number, line in enumerate(file):
+            line = line.rstrip("\n")
+            stripped = line.strip()
+            if number == 0 and stripped == "---":
+                front_matter = True
+                continue
+            if front_matter:
+                front_matter = stripped != "---"
+                continue
+            if stripped.startswith("```") or stripped.startswith("~~~"):
+                in_code = not in_code
+                continue
+            if in_code:
+                lines.append(line)
+                continue
+            if in_comment or "<!--" in line:
+                in_comment, line = self.strip_comment(line, in_comment)
+                if not line.strip():
+                    continue
+            if MDX_STATEMENT.match(line) or LINK_DEFINITION.match(line):
+                continue
+            line = HEADING.sub("", line)
+            line = IMAGE.sub(r"\1", line)
+            line = LINK.sub(r"\1", line)
+            line = EMPHASIS.sub("", TAG.sub("", line))
+            if line.strip() or (lines and lines[-1]):
+                lines.append(line.rstrip())
+        return "\n".join(lines).strip()
+
+    @staticmethod
+    def strip_comment(line: str, in_comment: bool) -> Tuple[bool, str]:
+        """
+        Remove the parts of a line inside HTML comments.
+
+        :param line: the line
+        :param in_comment: the line starts inside a comment
+        :return: the line ends inside a comment, the text outside the comments
+        """
+        text = ""
+        while line:
+            if in_comment:
+                end = line.find("-->")
+                if end < 0:
+                    return True, text
+                line, in_comment = line[end + 3 :], False
+            else:
+                start = line.find("<!--")
+                if start < 0:
+                    return False, text + line
+                text, line, in_comment = text + line[:start], line[start + 4 :], True
+        return in_comment, text
+
+
+class NotebookJSONLoader(FastLoader):
+    """
+    Loader of the Jupyter notebooks reading their JSON cells, in the format of the langchain loader.
+    """
+
+    def read(self, file: IO[str]) -> str:
+        cells = json.load(file).get("cells", list())
+        return " ".join(
+            f"'{cell['cell_type']}' cell: '{self.source(cell)}'\n\n" for cell in cells
+        )
+
+    @staticmethod
+    def source(cell: dict) -> str:
+        source = cell.get("source", "")
+        return "".join(source) if isinstance(source, list) else source
+
+
+class TextExtractor(HTMLParser):
+    """
+    Parser collecting the visible text of an HTML page, a line by block.
+    """
+
+    BLOCKS = {
+        "p", "div", "br", "li", "tr", "pre", "section", "article", "blockquote",
+        "h1", "h2", "h3", "h4", "h5", "h6", "table", "ul", "ol", "hr",
+    }  # fmt: skip
+    HIDDEN = {"script", "style", "head", "noscript", "template", "svg"}
+
+    def __init__(self) -> None:
+        super().__init__(convert_charrefs=True)
+        self.parts: List[str] = list()
+        self.hidden = 0
+
+    def handle_starttag(self, tag: str, attrs) -> None:
+        if tag in self.HIDDEN:
+            self.hidden += 1
+        elif tag in self.BLOCKS:
+            self.parts.append("\n")
+
+    def handle_endtag(self, tag: str) -> None:
+        if tag in self.HIDDEN:
+            self.hidden = max(self.hidden - 1, 0)
+        elif tag in self.BLOCKS:
+            self.parts.append("\n")
+
+    def handle_data(self, data: str) -> None:
+        if not self.hidden:
+            self.parts.append(data)
+
+    @property
+    def text(self) -> str:
+        lines = (" ".join(line.split()) for line in "".join(self.parts).splitlines())
+        return "\n".join(line for line in lines if line)
+
+
+class SimpleHTMLLoader(FastLoader):
+    """
+    Loader of the simple HTML pages, keeping their visible text.
+    """
+
+    def read(self, file: IO[str]) -> str:
+        extractor = TextExtractor()
+        for block in iter(lambda: file.read(BLOCK_SIZE), ""):
+            extractor.feed(block)
+        extractor.close()
+        return extractor.text
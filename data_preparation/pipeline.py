@@ -0,0 +1,269 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import time
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional
+
+from pydantic import BaseModel
+from tabulate import tabulate
+
+from app.metrics import stage as timed_stage
+from app.precomputed import directory_fingerprint
+
+DONE = "done"
+SKIPPED = "skipped"
+FAILED = "failed"
+BLOCKED = "blocked"
+
+
+class Stage:
+    """
+    Stage of the data preparation, run once the stages it depends on are finished.
+
+    A stage is skipped when its parameters, its inputs and the outputs of its dependencies are the
+    ones of its last completion, and its outputs have not changed since.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        run: Callable[[], Awaitable[Any]],
+        depends_on: Optional[List[str]] = None,
+        outputs: Optional[List[str]] = None,
+        inputs: Optional[List[str]] = None,
+        parameters: Optional[Dict[str, Any]] = None,
+        optional: bool = False,
+    ) -> None:
+        """
+        :param name: the name of the stage
+        :param run: the coroutine function of the stage
+        :param depends_on: the names of the stages to finish before this one
+        :param outputs: the files and directories written by the stage
+        :param inputs: the files and directories read by the stage, besides the outputs of its dependencies
+        :param parameters: the parameters changing the outputs of the stage
+        :param optional: the stages depending on this one still run when it fails
+        """
+        self.name = name
+        self.run = run
+        self.depends_on = depends_on or list()
+        self.outputs = outputs or list()
+        self.inputs = inputs or list()
+        self.parameters = parameters or dict()
+        self.optional = optional
+
+
+class StageResult(BaseModel):
+    """
+    Result of a stage of a run of the pipeline.
+    """
+
+    name: str
+    status: str
+    start_seconds: float = 0.0
+    seconds: float = 0.0
+    fingerprint: Optional[str] = None
+    error: Optional[str] = None
+
+
+class Pipeline:
+    """
+    Pipeline running the stages concurrently in the order of their dependencies.
+
+    Each stage runs in a thread with its own event loop, the stages blocking their loop (the clones
+    of the repositories, the embeddings) still overlap. The completions are checkpointed in a JSON
+    file, a rerun only runs the stages that failed or whose inputs changed.
+    """
+
+    def __init__(
+        self,
+        stages: List[Stage],
+        checkpoint_path: str,
+        force: Iterable[str] = (),
+    ) -> None:
+        """
+        :param stages: the stages
+        :param checkpoint_path: the JSON file of the checkpoints of the completed stages
+        :param force: the names of the stages to run even when they are unchanged, all to run them all
+        """
+        self.stages = {stage.name: stage for stage in stages}
+        if len(self.stages) != len(stages):
+            raise ValueError("The names of the stages must be unique.")
+        self.order = self.sort(stages)
+        self.checkpoint_path = checkpoint_path
+        self.force = set(force)
+        unknown = self.force - set(self.stages) - {"all"}
+        if unknown:
+            raise ValueError(f"Unknown stages to force: {sorted(unknown)}")
+        self.checkpoints: Dict[str, Dict[str, Any]] = dict()
+
+    @staticmethod
+    def sort(stages: List[Stage]) -> List[Stage]:
+        """
+        Sort the stages after their dependencies.
+
+        :param stages: the stages
+        :return: the sorted stages
+        """
+        names = {stage.name for stage in stages}
+        for stage in stages:
+            missing = set(stage.depends_on) - names
+            if missing:
+                raise ValueError(
+                    f"The stage {stage.name} depends on unknown stages {missing}"
+                )
+        order, done = list(), set()
+        pending = list(stages)
+        while pending:
+            ready = [stage for stage in pending if set(stage.depends_on) <= done]
+            if not ready:
+                raise ValueError(
+                    f"Cycle between the stages {[stage.name for stage in pending]}"
+                )
+            order.extend(ready)
+            done.update(stage.name for stage in ready)
+            pending = [stage for stage in pending if stage.name not in done]
+        return order
+
+    def load_checkpoints(self) -> None:
+        if os.path.exists(self.checkpoint_path):
+            with open(self.checkpoint_path) as file:
+                self.checkpoints = json.load(file)
+
+    def save_checkpoints(self) -> None:
+        directory = os.path.dirname(self.checkpoint_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(f"{self.checkpoint_path}.tmp", "w") as file:
+            json.dump(self.checkpoints, file, indent=2)
+        os.replace(f"{self.checkpoint_path}.tmp", self.checkpoint_path)
+
+    async def run(self) -> List[StageResult]:
+        """
+        Run the stages, the independent stages run concurrently.
+
+        :return: the results of the stages in the order of their dependencies
+        """
+        self.load_checkpoints()
+        self.start = time.perf_counter()
+        tasks: Dict[str, asyncio.Task] = dict()
+        for stage in self.order:
+            tasks[stage.name] = asyncio.ensure_future(
+                self.run_stage(stage, [tasks[name] for name in stage.depends_on])
+            )
+        return list(await asyncio.gather(*tasks.values()))
+
+    async def run_stage(
+        self, stage: Stage, dependencies: List["asyncio.Task[StageResult]"]
+    ) -> StageResult:
+        results = await asyncio.gather(*dependencies)
+        blocking = [
+            result.name
+            for result in results
+            if result.status in (FAILED, BLOCKED)
+            and not self.stages[result.name].optional
+        ]
+        if blocking:
+            logging.warning(f"The stage {stage.name} is blocked by {blocking}.")
+            return StageResult(name=stage.name, status=BLOCKED)
+
+        key = await asyncio.to_thread(self.key, stage, results)
+        checkpoint = self.checkpoints.get(stage.name)
+        if (
+            checkpoint
+            and checkpoint["key"] == key
+            and not {"all", stage.name} & self.force
+        ):
+            fingerprint = await asyncio.to_thread(
+                directory_fingerprint, stage.outputs, contents=True
+            )
+            if fingerprint == checkpoint["fingerprint"]:
+                logging.info(f"The stage {stage.name} is unchanged, skipped.")
+                return StageResult(
+                    name=stage.name, status=SKIPPED, fingerprint=fingerprint
+                )
+
+        start = time.perf_counter()
+        logging.info(f"Running the stage {stage.name}.")
+        try:
+            with timed_stage(stage.name, pipeline="preparation"):
+                await asyncio.to_thread(asyncio.run, stage.run())
+        except Exception as exception:
+            logging.exception(f"The stage {stage.name} failed.")
+            return StageResult(
+                name=stage.name,
+                status=FAILED,
+                start_seconds=start - self.start,
+                seconds=time.perf_counter() - start,
+                error=repr(exception),
+            )
+        fingerprint = await asyncio.to_thread(
+            directory_fingerprint, stage.outputs, contents=True
+        )
+        seconds = time.perf_counter() - start
+        self.checkpoints[stage.name] = {
+            "key": key,
+            "fingerprint": fingerprint,
+            "completed_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "seconds": seconds,
+        }
+        self.save_checkpoints()
+        return StageResult(
+            name=stage.name,
+            status=DONE,
+            start_seconds=start - self.start,
+            seconds=seconds,
+            fingerprint=fingerprint,
+        )
+
+    @staticmethod
+    def key(stage: Stage, dependencies: List[StageResult]) -> str:
+        """
+        Get the key of the inputs of a stage, the stage is run again when it changes.
+
+        :param stage: the stage
+        :param dependencies: the results of the stages it depends on
+        :return: the key
+        """
+        state = {
+            "parameters": stage.parameters,
+            "inputs": directory_fingerprint(stage.inputs, contents=True),
+            "dependencies": {
+                result.name: result.fingerprint for result in dependencies
+            },
+        }
+        return hashlib.sha256(
+            json.dumps(state, sort_keys=True, default=str).encode()
+        ).hexdigest()[:16]
+
+
+def format_report(results: List[StageResult]) -> str:
+    """
+    Format the timings of the stages of a run of the pipeline.
+
+    :param results: the results of the stages
+    :return: the table of the stages and the total durations
+    """
+    table = tabulate(
+        [
+            [
+                result.name,
+                result.status,
+                f"{result.start_seconds:.1f}",
+                f"{result.seconds:.1f}",
+                (result.error or "")[:80],
+            ]
+            for result in results
+        ],
+        headers=["stage", "status", "start (s)", "duration (s)", "error"],
+        disable_numparse=True,
+    )
+    wall_seconds = max(
+        (result.start_seconds + result.seconds for result in results), default=0.0
+    )
+    stage_seconds = sum(result.seconds for result in results)
+    return (
+        f"{table}\n\n{wall_seconds:.1f}s of wall-clock time for "
+        f"{stage_seconds:.1f}s of stages."
+    )
@@ -0,0 +1,102 @@
+import argparse
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+
+from app.chatbot import ChatBot
+from app.config import config
+from app.metrics import stage
+from app.precomputed import PrecomputedAnswers, read_frequent_questions
+
+
+async def precompute_answers(
+    chat_bot: ChatBot,
+    questions: List[str],
+    answers_directory: str,
+    batch_size: int = 8,
+) -> Dict[str, int]:
+    """
+    Answer the frequent questions missing from the precomputed answers, or stale for the current index.
+
+    The table is saved after each batch, an interrupted build restarts from the last saved batch.
+
+    :param chat_bot: the ChatBot loaded with the current index
+    :param questions: the frequent questions
+    :param answers_directory: the directory of the precomputed answers
+    :param batch_size: the number of questions answered concurrently
+    :return: the number of fresh, built and failed answers
+    """
+    answers = PrecomputedAnswers.open(answers_directory)
+    pending = [
+        question
+        for question in questions
+        if answers.is_stale(question, chat_bot.index_version)
+    ]
+    logging.info(
+        f"Precomputing {len(pending)} answers of {len(questions)} frequent questions "
+        f"for the version {chat_bot.index_version} of the index."
+    )
+    loop = asyncio.get_running_loop()
+    built, failed = 0, 0
+    with stage("precompute_answers", pipeline="ingestion"), ThreadPoolExecutor(
+        max_workers=batch_size
+    ) as executor:
+        for start in range(0, len(pending), batch_size):
+            batch = pending[start : start + batch_size]
+            results = await asyncio.gather(
+                *[
+                    loop.run_in_executor(executor, chat_bot.generate_answer, question)
+                    for question in batch
+                ],
+                return_exceptions=True,
+            )
+            for question, result in zip(batch, results):
+                if isinstance(result, Exception):
+                    logging.error(f"No answer precomputed for {question}: {result}")
+                    failed += 1
+                    continue
+                answers.put(result)
+                built += 1
+            answers.save()
+    return {
+        "fresh": len(questions) - len(pending),
+        "built": built,
+        "failed": failed,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Precompute the answers of the frequent questions for the current index."
+    )
+    parser.add_argument(
+        "--questions",
+        default=config.FREQUENT_QUESTIONS_PATH or config.QUESTIONS_LOG_PATH,
+        help="JSONL file with a question by line, curated or logged by the ChatBot",
+    )
+    parser.add_argument("--top", type=int, default=config.FREQUENT_QUESTIONS_COUNT)
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--stub-llm", action="store_true")
+    parser.add_argument("--stub-embeddings", action="store_true")
+    args = parser.parse_args()
+    if not args.questions:
+        parser.error("no questions, set FREQUENT_QUESTIONS_PATH or --questions")
+
+    from app.stubs import StubEmbeddings, StubLLM
+
+    counts = asyncio.run(
+        precompute_answers(
+            chat_bot=ChatBot(
+                embeddings=StubEmbeddings() if args.stub_embeddings else None,
+                llm=StubLLM() if args.stub_llm else None,
+            ),
+            questions=read_frequent_questions(args.questions, args.top),
+            answers_directory=config.PRECOMPUTED_ANSWERS_DIRECTORY,
+            batch_size=args.batch_size,
+        )
+    )
+    print(
+        f"{counts['built']} answers precomputed, {counts['fresh']} still fresh and "
+        f"{counts['failed']} failed in {config.PRECOMPUTED_ANSWERS_DIRECTORY}. ✅"
+    )
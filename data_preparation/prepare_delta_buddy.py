@@ -1,57 +1,236 @@
+import argparse
 import asyncio
+import json
+import os
+from typing import TYPE_CHECKING, Iterable, Optional
 
-from app.config import config
+from app.chatbot import ChatBot
+from app.config import VectorPrecision, config
+from app.metrics import stage_summary, start_metrics_server
+from app.precomputed import read_frequent_questions
+from app.retrieval.artifact import CURRENT_FILE
+from data_preparation.distributed_ingestion import ingest_documents_with_spark
+from data_preparation.export_index_artifact import export_index_artifact
 from data_preparation.ingest_documents import ingest_documents_in_database
+from data_preparation.pipeline import BLOCKED, FAILED, Pipeline, Stage, format_report
+from data_preparation.precompute_answers import precompute_answers
 from data_preparation.prepare_documents import (
     prepare_documents_from_databricks,
     prepare_documents_from_github,
     prepare_documents_from_urls,
 )
+from data_preparation.quantize_embeddings import (
+    export_quantized_index,
+    export_quantized_shards,
+)
 from data_preparation.utils import get_all_releases_notes_from_github_repository
 
-if __name__ == "__main__":
-    asyncio.run(
-        prepare_documents_from_urls(
-            urls=["https://www.vldb.org/pvldb/vol13/p3411-armbrust.pdf"]
-        )
-    )
-    print("Preparation of the documents from URLs is done. ✅")
-    asyncio.run(
-        prepare_documents_from_github(
-            github_urls=[
-                "https://github.com/delta-io/delta",
-                "https://github.com/delta-io/website",
-                "https://github.com/delta-io/delta-docs",
+if TYPE_CHECKING:
+    from pyspark.sql import SparkSession
+
+URLS = ["https://www.vldb.org/pvldb/vol13/p3411-armbrust.pdf"]
+GITHUB_REPOSITORIES = [
+    "https://github.com/delta-io/delta",
+    "https://github.com/delta-io/website",
+    "https://github.com/delta-io/delta-docs",
+]
+RELEASES_NOTES_REPOSITORIES = [
+    "https://github.com/delta-io/delta",
+    "https://github.com/delta-io/delta-rs",
+    "https://github.com/delta-io/delta-sharing",
+    "https://github.com/delta-io/kafka-delta-ingest",
+]
+DATABRICKS_DOCUMENTS = [
+    "databricks_alerts",
+    "databricks_unity_catalog",
+    "databricks_clusters",
+    "databricks_ml_models",
+    "databricks_tables",
+]
+
+
+def build_pipeline(
+    databricks_metadata: bool = True,
+    force: Iterable[str] = (),
+    spark: Optional["SparkSession"] = None,
+) -> Pipeline:
+    """
+    Build the pipeline preparing the documents, the index and the precomputed answers of Delta-Buddy.
+
+    The sources are downloaded concurrently, the ingestion waits for all of them.
+
+    :param databricks_metadata: export the metadata of the Databricks environment
+    :param force: the names of the stages to run even when they are unchanged, all to run them all
+    :param spark: the Spark session embedding the documents on its executors, None to embed them locally
+    :return: the pipeline
+    """
+    source_directory = config.SOURCE_DOCUMENTS_DIRECTORY
+    repositories_directory = f"{source_directory}/github_repositories"
+    stages = [
+        Stage(
+            name="urls",
+            run=lambda: prepare_documents_from_urls(urls=URLS),
+            outputs=[f"{source_directory}/{url.split('/')[-1]}" for url in URLS],
+            parameters={"urls": URLS},
+        ),
+        Stage(
+            name="github",
+            run=lambda: prepare_documents_from_github(github_urls=GITHUB_REPOSITORIES),
+            outputs=[
+                f"{repositories_directory}/{url.split('/')[-1]}"
+                for url in GITHUB_REPOSITORIES
             ],
+            parameters={"github_urls": GITHUB_REPOSITORIES},
+        ),
+        Stage(
+            name="releases_notes",
+            run=lambda: get_all_releases_notes_from_github_repository(
+                github_urls=RELEASES_NOTES_REPOSITORIES
+            ),
+            outputs=[
+                f"{repositories_directory}/{url.split('/')[-1]}_releases.txt"
+                for url in RELEASES_NOTES_REPOSITORIES
+            ],
+            parameters={"github_urls": RELEASES_NOTES_REPOSITORIES},
+        ),
+    ]
+    sources = [stage.name for stage in stages]
+    if databricks_metadata:
+        stages.append(
+            Stage(
+                name="databricks",
+                run=lambda: prepare_documents_from_databricks(show_errors=False),
+                outputs=[
+                    f"{source_directory}/{name}.txt" for name in DATABRICKS_DOCUMENTS
+                ],
+                parameters={"host": config.DATABRICKS_SERVER_HOSTNAME},
+                # Without a Databricks connection, the other sources are still ingested
+                optional=True,
+            )
+        )
+        sources.append("databricks")
+    stages.append(
+        Stage(
+            name="ingest",
+            run=lambda: ingest_documents_with_spark(
+                spark,
+                persist_directory=config.PERSIST_DIRECTORY,
+                model_name=config.PREPARATION_MODEL_NAME,
+            )
+            if spark is not None
+            else ingest_documents_in_database(
+                persist_directory=config.PERSIST_DIRECTORY,
+                model_name=config.PREPARATION_MODEL_NAME,
+            ),
+            depends_on=sources,
+            inputs=[source_directory],
+            outputs=[config.PERSIST_DIRECTORY, config.LEXICAL_INDEX_DIRECTORY],
+            parameters={
+                "model_name": config.PREPARATION_MODEL_NAME,
+                "sharding": config.VECTOR_STORE_SHARDING,
+                "deduplication": config.CHUNK_DEDUPLICATION
+                and config.CHUNK_DEDUPLICATION_THRESHOLD,
+                "distributed": spark is not None,
+            },
         )
     )
-    print("Preparation of the documents from the Github repositories is done. ✅")
-    asyncio.run(
-        get_all_releases_notes_from_github_repository(
-            github_urls=[
-                "https://github.com/delta-io/delta",
-                "https://github.com/delta-io/delta-rs",
-                "https://github.com/delta-io/delta-sharing",
-                "https://github.com/delta-io/kafka-delta-ingest",
-            ],
+    index_stages = ["ingest"]
+    if config.VECTOR_STORE_PRECISION != VectorPrecision.FLOAT32:
+        export = (
+            export_quantized_shards
+            if config.VECTOR_STORE_SHARDING
+            else export_quantized_index
+        )
+        stages.append(
+            Stage(
+                name="quantize",
+                run=lambda: export(
+                    persist_directory=config.PERSIST_DIRECTORY,
+                    output_directory=config.QUANTIZED_INDEX_DIRECTORY,
+                    precision=config.VECTOR_STORE_PRECISION,
+                    keep_full_precision=config.VECTOR_STORE_RESCORE_CANDIDATES > 0,
+                ),
+                depends_on=["ingest"],
+                outputs=[config.QUANTIZED_INDEX_DIRECTORY],
+                parameters={
+                    "precision": config.VECTOR_STORE_PRECISION.value,
+                    "rescore": config.VECTOR_STORE_RESCORE_CANDIDATES > 0,
+                },
+            )
+        )
+        index_stages.append("quantize")
+    if config.INDEX_ARTIFACT_DIRECTORY:
+        stages.append(
+            Stage(
+                name="export_artifact",
+                run=lambda: export_index_artifact(
+                    persist_directory=config.PERSIST_DIRECTORY,
+                    artifact_directory=config.INDEX_ARTIFACT_DIRECTORY,
+                    precision=config.VECTOR_STORE_PRECISION,
+                    keep_full_precision=config.VECTOR_STORE_RESCORE_CANDIDATES > 0,
+                ),
+                depends_on=["ingest"],
+                # The versions are immutable, the active one identifies the output
+                outputs=[os.path.join(config.INDEX_ARTIFACT_DIRECTORY, CURRENT_FILE)],
+                parameters={
+                    "precision": config.VECTOR_STORE_PRECISION.value,
+                    "rescore": config.VECTOR_STORE_RESCORE_CANDIDATES > 0,
+                },
+            )
         )
+        index_stages.append("export_artifact")
+    if config.FREQUENT_QUESTIONS_PATH:
+        stages.append(
+            Stage(
+                name="precompute_answers",
+                run=precompute_frequent_answers,
+                depends_on=index_stages,
+                inputs=[config.FREQUENT_QUESTIONS_PATH],
+                outputs=[config.PRECOMPUTED_ANSWERS_DIRECTORY],
+                parameters={
+                    "count": config.FREQUENT_QUESTIONS_COUNT,
+                    "model_name": config.DATABRICKS_MODEL_NAME,
+                },
+            )
+        )
+    return Pipeline(
+        stages, checkpoint_path=config.PIPELINE_CHECKPOINT_PATH, force=force
     )
-    print("Preparation of the documents from the Github releases notes is done. ✅")
 
-    try:
-        asyncio.run(prepare_documents_from_databricks(show_errors=False))
-    except Exception:
-        print(
-            "No Databricks connection configured, check the environments variables. ⚠️"
-        )
-    print("Preparation of the documents from the Databricks environments is done. ✅")
 
-    asyncio.run(
-        ingest_documents_in_database(
-            persist_directory=config.PERSIST_DIRECTORY,
-            model_name=config.PREPARATION_MODEL_NAME,
-        )
+async def precompute_frequent_answers() -> None:
+    await precompute_answers(
+        chat_bot=ChatBot(),
+        questions=read_frequent_questions(
+            config.FREQUENT_QUESTIONS_PATH, config.FREQUENT_QUESTIONS_COUNT
+        ),
+        answers_directory=config.PRECOMPUTED_ANSWERS_DIRECTORY,
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Prepare the documents, the index and the answers of Delta-Buddy."
+    )
+    parser.add_argument(
+        "--force",
+        nargs="*",
+        default=[],
+        help="the stages to run even when they are unchanged, all to run them all",
     )
+    args = parser.parse_args()
+    start_metrics_server()
+    pipeline = build_pipeline(force=args.force)
+    results = asyncio.run(pipeline.run())
+    print(format_report(results))
     print(
-        f"The documents have been ingested in the Chroma vectorized database in {config.PERSIST_DIRECTORY}. ✅"
+        "Latency of the ingestion stages: "
+        f"{json.dumps(stage_summary(pipeline='ingestion'), indent=2)}"
     )
+    if any(
+        result.status in (FAILED, BLOCKED) and not pipeline.stages[result.name].optional
+        for result in results
+    ):
+        print("The preparation is incomplete, run it again to resume it. ⚠️")
+    else:
+        print("The preparation of Delta-Buddy is done. ✅")
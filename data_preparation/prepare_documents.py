@@ -1,5 +1,6 @@
 from typing import List
 
+from app.metrics import stage
 from data_preparation.utils import (
     clone_github_repositories,
     download_document_from_urls,
@@ -10,14 +11,17 @@ from data_preparation.utils import (
 async def prepare_documents_from_urls(
     urls: List[str],
 ) -> bool:
-    await download_document_from_urls(urls=urls)
+    with stage("download_urls", pipeline="ingestion"):
+        await download_document_from_urls(urls=urls)
 
 
 async def prepare_documents_from_github(github_urls: List[str]) -> None:
-    await clone_github_repositories(
-        github_urls=github_urls,
-    )
+    with stage("clone_github", pipeline="ingestion"):
+        await clone_github_repositories(
+            github_urls=github_urls,
+        )
 
 
 async def prepare_documents_from_databricks(show_errors: bool = False) -> None:
-    await from_databricks_environment(show_errors=show_errors)
+    with stage("databricks_metadata", pipeline="ingestion"):
+        await from_databricks_environment(show_errors=show_errors)
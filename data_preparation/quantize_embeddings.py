@@ -0,0 +1,65 @@
+import logging
+
+from langchain.vectorstores import Chroma
+
+from app.config import VectorPrecision, get_chroma_settings
+from app.metrics import stage
+from app.retrieval.quantization import QuantizedIndex, read_chroma_collection
+from app.retrieval.shards import existing_shards, shard_directory
+
+
+async def export_quantized_index(
+    persist_directory: str,
+    output_directory: str,
+    precision: VectorPrecision,
+    keep_full_precision: bool = False,
+) -> QuantizedIndex:
+    """
+    Export the embeddings of the Chroma database in a quantized index.
+
+    :param persist_directory: the directory of the Chroma database
+    :param output_directory: the directory of the quantized index
+    :param precision: the precision of the quantized embeddings
+    :param keep_full_precision: save the float32 embeddings too, they are needed for the rescoring
+    :return: the quantized index
+    """
+    db = Chroma(
+        persist_directory=persist_directory,
+        client_settings=get_chroma_settings(persist_directory),
+    )
+    embeddings, texts, metadatas = read_chroma_collection(db)
+    with stage("quantize", pipeline="ingestion"):
+        index = QuantizedIndex.from_embeddings(
+            embeddings=embeddings, texts=texts, metadatas=metadatas, precision=precision
+        )
+        index.save(
+            output_directory, embeddings=embeddings if keep_full_precision else None
+        )
+    logging.info(
+        f"Quantized {len(embeddings)} embeddings from {embeddings.nbytes} "
+        f"to {index.nbytes} bytes in {precision.value}."
+    )
+    return index
+
+
+async def export_quantized_shards(
+    persist_directory: str,
+    output_directory: str,
+    precision: VectorPrecision,
+    keep_full_precision: bool = False,
+) -> None:
+    """
+    Export the embeddings of each shard of the Chroma database in a quantized index.
+
+    :param persist_directory: the directory of the sharded Chroma database
+    :param output_directory: the directory of the sharded quantized index
+    :param precision: the precision of the quantized embeddings
+    :param keep_full_precision: save the float32 embeddings too, they are needed for the rescoring
+    """
+    for shard in existing_shards(persist_directory):
+        await export_quantized_index(
+            persist_directory=shard_directory(persist_directory, shard),
+            output_directory=shard_directory(output_directory, shard),
+            precision=precision,
+            keep_full_precision=keep_full_precision,
+        )
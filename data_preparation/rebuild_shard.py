@@ -0,0 +1,36 @@
+import argparse
+import asyncio
+
+from app.config import VectorPrecision, config
+from app.retrieval.shards import SHARDS, shard_directory
+from data_preparation.ingest_documents import rebuild_shard
+from data_preparation.quantize_embeddings import export_quantized_index
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Rebuild a shard of the database from its source documents."
+    )
+    parser.add_argument("shard", choices=SHARDS)
+    args = parser.parse_args()
+
+    asyncio.run(
+        rebuild_shard(
+            persist_directory=config.PERSIST_DIRECTORY,
+            model_name=config.PREPARATION_MODEL_NAME,
+            shard=args.shard,
+        )
+    )
+    print(f"The shard {args.shard} has been rebuilt. ✅")
+
+    if config.VECTOR_STORE_PRECISION != VectorPrecision.FLOAT32:
+        asyncio.run(
+            export_quantized_index(
+                persist_directory=shard_directory(config.PERSIST_DIRECTORY, args.shard),
+                output_directory=shard_directory(
+                    config.QUANTIZED_INDEX_DIRECTORY, args.shard
+                ),
+                precision=config.VECTOR_STORE_PRECISION,
+                keep_full_precision=config.VECTOR_STORE_RESCORE_CANDIDATES > 0,
+            )
+        )
+        print(f"The embeddings of the shard {args.shard} have been quantized. ✅")
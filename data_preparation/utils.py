@@ -1,4 +1,5 @@
 import glob
+import shutil
 from os.path import isfile
 from typing import List
 
@@ -22,15 +23,16 @@ async def download_document_from_urls(
     async with ClientSession() as session:
         for url in urls:
             filename = url.split("/")[-1]
-            if not os.path.exists(f"{config.SOURCE_DOCUMENTS_DIRECTORY}/{filename}"):
+            path = f"{config.SOURCE_DOCUMENTS_DIRECTORY}/{filename}"
+            if not os.path.exists(path):
                 response = await session.request(
                     method=method, url=url, timeout=timeout_in_seconds
                 )
-                async for data in response.content.iter_chunked(chunks):
-                    async with aiofiles.open(
-                        f"{config.SOURCE_DOCUMENTS_DIRECTORY}/{filename}", "ba"
-                    ) as file:
+                # Written aside, an interrupted download is not taken for a complete one
+                async with aiofiles.open(f"{path}.part", "wb") as file:
+                    async for data in response.content.iter_chunked(chunks):
                         await file.write(data)
+                os.replace(f"{path}.part", path)
         return urls
 
 
@@ -47,10 +49,17 @@ async def clone_github_repositories(github_urls: List[str]) -> List[str]:
     for github_url in github_urls:
         repository_name = github_url.split("/")[-1]
         github_repository_names.append(repository_name)
-        path = f"{config.SOURCE_DOCUMENTS_DIRECTORY}/github_repositories/{repository_name}"
+        path = (
+            f"{config.SOURCE_DOCUMENTS_DIRECTORY}/github_repositories/{repository_name}"
+        )
         if not os.path.exists(path):
             os.makedirs(path, exist_ok=True)
-            Repo.clone_from(github_url, path)
+            try:
+                Repo.clone_from(github_url, path)
+            except Exception:
+                # An interrupted clone is not taken for a complete one
+                shutil.rmtree(path, ignore_errors=True)
+                raise
             await keep_only_valid_files_for_ingestion(path=path)
 
 
@@ -22,6 +22,12 @@ dbutils.widgets.dropdown(
     ["True", "False"],
     "Generate Databricks Metadata.",
 )
+dbutils.widgets.dropdown(
+    "distributed_ingestion",
+    "False",
+    ["True", "False"],
+    "Embed the documents on the Spark executors.",
+)
 
 # COMMAND ----------
 
@@ -43,51 +49,29 @@ print("Os is prepared ✅")
 
 # COMMAND ----------
 
-from data_preparation.ingest_documents import ingest_documents_in_database
-from data_preparation.prepare_documents import (
-    prepare_documents_from_databricks,
-    prepare_documents_from_github,
-    prepare_documents_from_urls,
-)
-from data_preparation.utils import get_all_releases_notes_from_github_repository
+from data_preparation.pipeline import BLOCKED, FAILED, format_report
+from data_preparation.prepare_delta_buddy import build_pipeline
 
-await prepare_documents_from_urls(
-    urls=[
-        "https://www.vldb.org/pvldb/vol13/p3411-armbrust.pdf",
-    ]
+pipeline = build_pipeline(
+    databricks_metadata=dbutils.widgets.get("databricks_metadata") == "True",
+    spark=spark if dbutils.widgets.get("distributed_ingestion") == "True" else None,
 )
-print("Preparation of the documents from URLs is done. ✅")
-
-await prepare_documents_from_github(
-    github_urls=[
-        "https://github.com/delta-io/delta",
-        "https://github.com/delta-io/website",
-        "https://github.com/delta-io/delta-docs",
-    ],
-)
-print("Preparation of the documents from the Github repositories is done. ✅")
-
-await get_all_releases_notes_from_github_repository(
-    github_urls=[
-        "https://github.com/delta-io/delta",
-        "https://github.com/delta-io/delta-rs",
-        "https://github.com/delta-io/delta-sharing",
-        "https://github.com/delta-io/kafka-delta-ingest",
-    ],
-)
-print("Preparation of the documents from the Github releases notes is done. ✅")
+results = await pipeline.run()
+print(format_report(results))
+if any(
+    result.status in (FAILED, BLOCKED) and not pipeline.stages[result.name].optional
+    for result in results
+):
+    print("The preparation is incomplete, run this cell again to resume it. ⚠️")
+else:
+    print("The preparation of Delta-Buddy is done. ✅")
 
 # COMMAND ----------
+import json
 
-if dbutils.widgets.get("databricks_metadata") == "True":
-    await prepare_documents_from_databricks()
-    print("Preparation of the documents from the Databricks environments is done. ✅")
-
-# COMMAND ----------
-from app.config import config
+from app.metrics import stage_summary
 
-await ingest_documents_in_database(
-    persist_directory=config.PERSIST_DIRECTORY,
-    model_name=config.PREPARATION_MODEL_NAME,
+print(
+    "Latency of the ingestion stages: "
+    f"{json.dumps(stage_summary(pipeline='ingestion'), indent=2)}"
 )
-print("The documents have been ingested in the Chroma vectorized database. ✅")
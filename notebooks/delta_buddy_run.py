@@ -20,15 +20,38 @@ dbutils.widgets.dropdown(
     ["local", "notebook_hosted_api", "notebook_api"],
     "How to serve the ChatBot",
 )
+dbutils.widgets.dropdown(
+    "runner",
+    "single",
+    ["single", "warm"],
+    "Answer a single question or keep answering the questions of the queue",
+)
+dbutils.widgets.text(
+    "queue_directory",
+    "/delta-buddy/queue",
+)
 
 # COMMAND ----------
 
 from app.databricks_utils.manager import DatabricksManager
 from app.main import app
+from app.models import Answer
 from app.state import chat_bot
 
 if dbutils.widgets.get("serving_mode") == "notebook_hosted_api":
     await DatabricksManager.launch_llm_fast_api_from_notebook(app=app)
+elif dbutils.widgets.get("runner") == "warm":
+    from app.databricks_utils.job_runner import JobQueueWorker, LocalQueueStorage
+
+    answered = JobQueueWorker(
+        storage=LocalQueueStorage(
+            root=f"/dbfs{dbutils.widgets.get('queue_directory')}"
+        ),
+        answer=lambda question: chat_bot.chat(question).answer,
+    ).serve()
+    answer = Answer(
+        question="", answer=f"The warm runner answered {answered} questions."
+    )
 else:
     question = dbutils.widgets.get("question")
     answer = chat_bot.chat(
@@ -0,0 +1,6 @@
+import os
+
+# The tests run offline on the stub models, app.config reads the other variables from the .env file
+os.environ.setdefault("LLM_BACKEND", "stub")
+os.environ.setdefault("EMBEDDINGS_BACKEND", "stub")
+os.environ.setdefault("CHATBOT_BACKEND", "stub")
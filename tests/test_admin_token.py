@@ -0,0 +1,41 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+from app import main
+from app.chatbot import ChatBot
+from app.config import config
+from app.retrieval.hot_swap import IndexGeneration, IndexHolder
+
+
+@pytest.fixture(autouse=True)
+def chat_bot(monkeypatch) -> ChatBot:
+    chat_bot = ChatBot.__new__(ChatBot)
+    chat_bot.index_holder = IndexHolder(
+        IndexGeneration(version="v1", retriever=None), loader=lambda _: None
+    )
+    monkeypatch.setattr(main, "chat_bot", chat_bot)
+    return chat_bot
+
+
+@pytest.mark.parametrize("admin_token", [None, ""])
+def test_the_admin_endpoints_are_refused_without_an_admin_token(
+    monkeypatch, admin_token
+):
+    monkeypatch.setattr(config, "ADMIN_TOKEN", "")
+
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(main.index_status(x_admin_token=admin_token))
+
+    assert error.value.status_code == 403
+
+
+def test_the_admin_endpoints_check_the_admin_token(monkeypatch):
+    monkeypatch.setattr(config, "ADMIN_TOKEN", "secret")
+
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(main.index_status(x_admin_token="guess"))
+    assert error.value.status_code == 403
+
+    assert asyncio.run(main.index_status(x_admin_token="secret"))["version"] == "v1"
@@ -0,0 +1,170 @@
+import asyncio
+import os
+import shutil
+
+import pytest
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+from app.config import ModelBackend, config
+from data_preparation.distributed_ingestion import (
+    balance_files,
+    embed_partition,
+    format_partition_report,
+    ingest_documents_with_spark,
+    read_files,
+)
+from data_preparation.ingest_documents import load_single_document, split_documents
+
+pytest.importorskip("pyspark")
+pytestmark = pytest.mark.skipif(
+    not (os.environ.get("JAVA_HOME") or shutil.which("java")),
+    reason="Spark needs a Java runtime",
+)
+
+WORDS = "delta table merge vacuum optimize zorder stream checkpoint log schema".split()
+
+
+@pytest.fixture(scope="module")
+def spark():
+    from pyspark.sql import SparkSession
+
+    # The Python workers of the executors import the modules of the repository and of the tests
+    tests = os.path.dirname(os.path.abspath(__file__))
+    paths = [os.path.dirname(tests), tests, os.environ.get("PYTHONPATH")]
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        monkeypatch.setenv("PYTHONPATH", os.pathsep.join(filter(None, paths)))
+        session = (
+            SparkSession.builder.master("local[2]")
+            .appName("delta-buddy-tests")
+            .getOrCreate()
+        )
+    yield session
+    session.stop()
+
+
+def split_by_characters(cls, **kwargs) -> RecursiveCharacterTextSplitter:
+    return cls(chunk_size=200, chunk_overlap=0)
+
+
+@pytest.fixture
+def offline_splitter(monkeypatch):
+    # The tokenizer of the splitter is downloaded, the driver and the executors split by characters
+    monkeypatch.setattr(
+        RecursiveCharacterTextSplitter,
+        "from_tiktoken_encoder",
+        classmethod(split_by_characters),
+    )
+
+
+def test_balance_files_spreads_the_sizes(tmp_path):
+    files = list()
+    for size in (900, 500, 400, 300, 200, 100):
+        files.append(str(tmp_path / f"{size}.md"))
+        with open(files[-1], "w") as file:
+            file.write("x" * size)
+
+    groups = balance_files(files, 3)
+
+    assert sorted(len(group) for group in groups) == [1, 2, 3]
+    assert sorted(sum(os.path.getsize(path) for path in group) for group in groups) == [
+        700,
+        800,
+        900,
+    ]
+    assert balance_files(files[:1], 3) == [files[:1]]
+
+
+def test_partitions_are_embedded_on_the_executors(spark, tmp_path, offline_splitter):
+    files = list()
+    for position in range(6):
+        files.append(str(tmp_path / f"doc{position}.md"))
+        with open(files[-1], "w") as file:
+            file.write(
+                "\n\n".join(
+                    " ".join(WORDS[(position + line) % len(WORDS)] for _ in range(30))
+                    for line in range(5 * (position + 1))
+                )
+            )
+    groups = [read_files(group) for group in balance_files(files, 3)]
+
+    def embed_offline(partition, partition_files):
+        RecursiveCharacterTextSplitter.from_tiktoken_encoder = classmethod(
+            split_by_characters
+        )
+        return embed_partition(partition, partition_files, "stub", ModelBackend.STUB)
+
+    expected = split_documents(
+        [document for path in files for document in load_single_document(path)]
+    )
+    # The source documents directory only exists on the driver
+    for path in files:
+        os.remove(path)
+    records = (
+        spark.sparkContext.parallelize(groups, len(groups))
+        .mapPartitionsWithIndex(embed_offline)
+        .collect()
+    )
+
+    chunks = [record for kind, record in records if kind == "chunk"]
+    statistics = [record for kind, record in records if kind == "partition"]
+    assert len(chunks) == len(expected)
+    assert sorted(text for text, _, _ in chunks) == sorted(
+        text.page_content for text in expected
+    )
+    assert sorted(metadata["source"] for _, metadata, _ in chunks) == sorted(
+        text.metadata["source"] for text in expected
+    )
+    assert all(len(vector) == 384 for _, _, vector in chunks)
+    assert sorted(stats["partition"] for stats in statistics) == [0, 1, 2]
+    assert sum(stats["files"] for stats in statistics) == len(files)
+    assert sum(stats["failed"] for stats in statistics) == 0
+    assert sum(stats["chunks"] for stats in statistics) == len(chunks)
+    assert all(stats["chunks_per_second"] > 0 for stats in statistics)
+    report = format_partition_report(statistics)
+    assert f"{len(chunks)} chunks embedded by 3 partitions." in report
+
+
+def test_the_documents_not_loaded_are_counted(offline_splitter):
+    records = list(
+        embed_partition(
+            0,
+            iter(
+                [
+                    [
+                        ("/driver/doc.md", b"vacuum a delta table"),
+                        ("/driver/doc.xyz", b""),
+                    ]
+                ]
+            ),
+            "stub",
+            ModelBackend.STUB,
+        )
+    )
+
+    assert [record for kind, record in records if kind == "chunk"] == [
+        ("vacuum a delta table", {"source": "/driver/doc.md"}, records[0][1][2])
+    ]
+    assert records[-1][1]["failed"] == 1
+
+
+def test_nothing_is_ingested_when_documents_are_not_loaded(
+    spark, tmp_path, monkeypatch
+):
+    source_directory = tmp_path / "source_documents"
+    source_directory.mkdir()
+    (source_directory / "broken.pdf").write_bytes(b"not a pdf")
+    monkeypatch.setattr(config, "SOURCE_DOCUMENTS_DIRECTORY", str(source_directory))
+
+    with pytest.raises(RuntimeError, match="1 documents could not be loaded"):
+        asyncio.run(
+            ingest_documents_with_spark(
+                spark,
+                persist_directory=str(tmp_path / "db"),
+                model_name="stub",
+                partitions=2,
+                lexical_index_directory=None,
+                sharding=False,
+                embeddings_backend=ModelBackend.STUB,
+            )
+        )
+    assert not (tmp_path / "db").exists()
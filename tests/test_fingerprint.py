@@ -0,0 +1,79 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+from app import precomputed
+from app.precomputed import directory_fingerprint
+
+
+def write(path, text: str) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as file:
+        file.write(text)
+
+
+def test_the_served_index_is_fingerprinted_without_reading_it(tmp_path, monkeypatch):
+    write(tmp_path / "db" / "chroma-embeddings.parquet", "embeddings")
+    write(tmp_path / "lexical" / "chunks.jsonl", "chunks")
+    directories = [str(tmp_path / "db"), str(tmp_path / "lexical")]
+
+    def checksum(path: str) -> str:
+        raise AssertionError(f"{path} is read.")
+
+    monkeypatch.setattr(precomputed, "checksum", checksum)
+    fingerprint = directory_fingerprint(directories + [str(tmp_path / "missing")])
+
+    assert directory_fingerprint(directories) == fingerprint
+    write(tmp_path / "lexical" / "chunks.jsonl", "more chunks")
+    assert directory_fingerprint(directories) != fingerprint
+
+
+def test_the_offline_stages_hash_the_contents_without_the_git_directories(tmp_path):
+    write(tmp_path / "delta" / "README.md", "delta lake")
+    write(tmp_path / "delta" / ".git" / "objects" / "1", "commit")
+    directories = [str(tmp_path / "delta")]
+    fingerprint = directory_fingerprint(directories, contents=True)
+
+    write(tmp_path / "delta" / ".git" / "objects" / "2", "commit")
+    assert directory_fingerprint(directories, contents=True) == fingerprint
+    os.utime(tmp_path / "delta" / "README.md", (0, 0))
+    assert directory_fingerprint(directories, contents=True) == fingerprint
+    write(tmp_path / "delta" / "README.md", "delta lake 3.0")
+    assert directory_fingerprint(directories, contents=True) != fingerprint
+
+
+EXIT_SCRIPT = """
+import sys
+
+from langchain.vectorstores import Chroma
+
+from app.config import get_chroma_settings
+from app.retrieval.base import ChromaIndex
+
+directory = sys.argv[1]
+db = Chroma(persist_directory=directory, client_settings=get_chroma_settings(directory))
+db._collection.add(ids=["0"], embeddings=[[1.0, 0.0]], documents=["vacuum"])
+if sys.argv[2] == "served":
+    ChromaIndex(db)
+"""
+
+
+@pytest.mark.parametrize("served", [True, False])
+def test_the_served_chroma_database_is_not_rewritten_at_exit(tmp_path, served):
+    directory = str(tmp_path / "db")
+    subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            EXIT_SCRIPT,
+            directory,
+            "served" if served else "ingested",
+        ],
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        check=True,
+    )
+
+    written = os.path.exists(os.path.join(directory, "chroma-embeddings.parquet"))
+    assert written is not served
@@ -0,0 +1,221 @@
+import itertools
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+from typing import Callable, Dict, List
+
+import pytest
+from databricks.sdk.core import DatabricksError
+
+from app.databricks_utils.job_runner import (
+    PROCESSING_DIRECTORY,
+    REQUESTS_DIRECTORY,
+    RESPONSES_DIRECTORY,
+    DbfsQueueStorage,
+    JobQueueWorker,
+    LocalQueueStorage,
+    WarmJobRunner,
+)
+
+
+class FakeJobs:
+    """
+    Local fake of the Jobs API, a submitted run is a thread serving the queue with a worker.
+    """
+
+    def __init__(
+        self,
+        storage: LocalQueueStorage,
+        answer: Callable[[str], str],
+        start: bool = True,
+    ) -> None:
+        self.storage = storage
+        self.answer = answer
+        self.start = start
+        self.runs: Dict[int, threading.Thread] = dict()
+        self.run_ids = itertools.count(1)
+
+    def submit(self, run_name: str, tasks: List) -> SimpleNamespace:
+        run_id = next(self.run_ids)
+        worker = JobQueueWorker(
+            storage=self.storage,
+            answer=self.answer,
+            batch_size=4,
+            concurrency=4,
+            idle_timeout_in_seconds=2,
+            poll_interval_in_seconds=0.01,
+        )
+        self.runs[run_id] = threading.Thread(target=worker.serve, daemon=True)
+        if self.start:
+            self.runs[run_id].start()
+        return SimpleNamespace(run_id=run_id)
+
+    def get_run(self, run_id: int) -> SimpleNamespace:
+        state = "RUNNING" if self.runs[run_id].is_alive() else "TERMINATED"
+        return SimpleNamespace(
+            state=SimpleNamespace(life_cycle_state=SimpleNamespace(value=state))
+        )
+
+    def cancel_run(self, run_id: int) -> None:
+        pass
+
+
+def wait_until(condition: Callable[[], bool], timeout_in_seconds: float = 5) -> bool:
+    deadline = time.monotonic() + timeout_in_seconds
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return condition()
+
+
+def build_runner(tmp_path, answer: Callable[[str], str], start: bool = True, **kwargs):
+    storage = LocalQueueStorage(str(tmp_path))
+    workspace = SimpleNamespace(jobs=FakeJobs(storage, answer, start=start))
+    runner = WarmJobRunner(
+        workspace=workspace,
+        storage=storage,
+        concurrency=8,
+        timeout_in_seconds=5,
+        poll_interval_in_seconds=0.01,
+        **kwargs,
+    )
+    return runner, storage
+
+
+def test_questions_are_answered_by_a_single_warm_run(tmp_path):
+    runner, storage = build_runner(tmp_path, answer=lambda question: question.upper())
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        questions = [f"question {i}" for i in range(16)]
+        answers = list(executor.map(runner.ask, questions))
+
+    assert [answer.answer for answer in answers] == [q.upper() for q in questions]
+    assert runner.stats.worker_submissions == 1
+    assert runner.stats.questions == 16
+    assert runner.stats.answer_seconds > 0
+    assert storage.list_names(RESPONSES_DIRECTORY) == []
+
+
+def test_timeout_removes_the_unclaimed_question(tmp_path):
+    runner, storage = build_runner(tmp_path, answer=str.upper, start=False)
+
+    with pytest.raises(TimeoutError):
+        runner.ask("question", timeout_in_seconds=0.1)
+
+    assert runner.stats.timeouts == 1
+    assert storage.list_names(REQUESTS_DIRECTORY) == []
+
+
+def test_timeout_drops_the_late_answer_of_a_claimed_question(tmp_path):
+    release = threading.Event()
+
+    def answer(question: str) -> str:
+        release.wait()
+        return question
+
+    runner, storage = build_runner(tmp_path, answer=answer)
+
+    with pytest.raises(TimeoutError):
+        runner.ask("question", timeout_in_seconds=0.2)
+    assert storage.list_names(PROCESSING_DIRECTORY)
+    release.set()
+
+    assert wait_until(
+        lambda: not storage.list_names(PROCESSING_DIRECTORY)
+        and not storage.list_names(RESPONSES_DIRECTORY)
+        and runner._poller is None
+    )
+
+
+def test_orphan_answers_are_deleted(tmp_path):
+    runner, storage = build_runner(
+        tmp_path, answer=str.upper, orphan_after_in_seconds=60
+    )
+    orphan = f"{time.time_ns() - 600 * 10**9}-orphan.json"
+    recent = f"{time.time_ns()}-other-runner.json"
+    for name in (orphan, recent):
+        storage.write(f"{RESPONSES_DIRECTORY}/{name}", b'{"answer": ""}')
+
+    assert runner.ask("question").answer == "QUESTION"
+
+    assert storage.list_names(RESPONSES_DIRECTORY) == [recent]
+
+
+def test_polling_survives_storage_errors(tmp_path):
+    runner, storage = build_runner(tmp_path, answer=str.upper)
+    list_names = storage.list_names
+    failures = iter([True, True])
+
+    def flaky_list_names(directory: str) -> List[str]:
+        if directory == RESPONSES_DIRECTORY and next(failures, False):
+            raise OSError("DBFS is unavailable")
+        return list_names(directory)
+
+    storage.list_names = flaky_list_names
+
+    assert runner.ask("question").answer == "QUESTION"
+
+
+def test_a_failed_submission_leaves_nothing_pending(tmp_path):
+    runner, storage = build_runner(tmp_path, answer=str.upper)
+
+    def failing_write(path: str, content: bytes) -> None:
+        raise OSError("DBFS is unavailable")
+
+    storage.write = failing_write
+    with pytest.raises(OSError):
+        runner.ask("question")
+
+    assert runner._pending == {}
+    assert wait_until(lambda: runner._poller is None)
+
+
+class FakeDbfs:
+    def __init__(self, error_code: str = None) -> None:
+        self.error_code = error_code
+        self.moves = list()
+
+    def mkdirs(self, path: str) -> None:
+        pass
+
+    def move(self, source: str, destination: str) -> None:
+        if self.error_code:
+            raise DatabricksError("move failed", error_code=self.error_code)
+        self.moves.append((source, destination))
+
+
+def test_dbfs_move_tells_if_the_question_is_claimed():
+    storage = DbfsQueueStorage(SimpleNamespace(dbfs=FakeDbfs()), root="/queue/")
+    assert storage.move("requests/1.json", "processing/1.json")
+    assert storage.dbfs.moves == [
+        ("/queue/requests/1.json", "/queue/processing/1.json")
+    ]
+
+    for error_code in ("RESOURCE_DOES_NOT_EXIST", "RESOURCE_ALREADY_EXISTS"):
+        storage.dbfs = FakeDbfs(error_code)
+        assert not storage.move("requests/1.json", "processing/1.json")
+
+    storage.dbfs = FakeDbfs("PERMISSION_DENIED")
+    with pytest.raises(DatabricksError):
+        storage.move("requests/1.json", "processing/1.json")
+
+
+def test_worker_writes_the_errors_in_the_answers(tmp_path):
+    def answer(question: str) -> str:
+        raise ValueError("no model")
+
+    storage = LocalQueueStorage(str(tmp_path))
+    storage.write(
+        f"{REQUESTS_DIRECTORY}/1.json",
+        json.dumps({"id": "1", "question": "question"}).encode("utf-8"),
+    )
+    worker = JobQueueWorker(
+        storage, answer, idle_timeout_in_seconds=0, poll_interval_in_seconds=0.01
+    )
+    worker._answer_question(worker._claim_batch()[0])
+
+    response = json.loads(storage.read(f"{RESPONSES_DIRECTORY}/1.json"))
+    assert response["error"] == "no model"
@@ -0,0 +1,19 @@
+from langchain.docstore.document import Document
+
+from app.retrieval.lexical import LexicalIndex
+
+TEXTS = [
+    "what is the delta log of a table",
+    "vacuum removes the files of a table",
+    "the table is optimized with z-order",
+]
+
+
+def test_the_stop_words_of_the_query_are_ignored():
+    lexical_index = LexicalIndex()
+    lexical_index.add_documents(Document(page_content=text) for text in TEXTS)
+
+    assert lexical_index.search("what is the", k=3) == []
+    assert lexical_index.search("what is the vacuum of a table", k=3) == (
+        lexical_index.search("vacuum table", k=3)
+    )
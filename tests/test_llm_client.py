@@ -0,0 +1,197 @@
+import asyncio
+import socket
+import threading
+import time
+from typing import List, Set
+
+import pytest
+import uvicorn
+from aiohttp import ClientResponseError
+from fastapi import FastAPI, HTTPException, Request
+
+from app.databricks_utils import llm_client
+from app.databricks_utils.llm_client import AsyncLLMClient, RetryBudget
+from app.latency import LatencyRecorder
+from app.models import LLMInput
+
+
+class StandIn:
+    """
+    Local stand-in of the LLM endpoint of app/main.py, failing or slowing down the next requests on demand.
+    """
+
+    def __init__(self) -> None:
+        self.failures = 0
+        self.delays: List[float] = list()
+        self.requests = 0
+        self.client_ports: Set[int] = set()
+        self.app = FastAPI()
+        self.app.post("/")(self.llm)
+
+    async def llm(self, llm_input: LLMInput, request: Request) -> str:
+        self.requests += 1
+        self.client_ports.add(request.client.port)
+        if self.failures:
+            self.failures -= 1
+            raise HTTPException(status_code=503, detail="The model is loading.")
+        if self.delays:
+            await asyncio.sleep(self.delays.pop(0))
+        return f"answer to {llm_input.prompt}"
+
+
+@pytest.fixture(scope="module")
+def server():
+    stand_in = StandIn()
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    server = uvicorn.Server(
+        uvicorn.Config(stand_in.app, host="127.0.0.1", port=port, log_level="warning")
+    )
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.01)
+    yield stand_in, f"http://127.0.0.1:{port}/"
+    server.should_exit = True
+    thread.join()
+
+
+@pytest.fixture
+def stand_in(server):
+    stand_in, _ = server
+    stand_in.failures, stand_in.delays, stand_in.requests = 0, list(), 0
+    stand_in.client_ports.clear()
+    return stand_in
+
+
+@pytest.fixture
+def url(server):
+    return server[1]
+
+
+def run(client: AsyncLLMClient, *prompts: str, sequential: bool = True) -> List[str]:
+    async def complete() -> List[str]:
+        try:
+            if sequential:
+                return [await client.complete(prompt) for prompt in prompts]
+            return await asyncio.gather(
+                *(client.complete(prompt) for prompt in prompts)
+            )
+        finally:
+            await client.close()
+
+    return asyncio.run(complete())
+
+
+def test_connections_are_reused_from_the_pool(stand_in, url):
+    client = AsyncLLMClient(url, concurrency=2, max_retries=0, hedge_after_in_seconds=0)
+
+    answers = run(client, *[f"question {i}" for i in range(10)])
+
+    assert answers == [f"answer to question {i}" for i in range(10)]
+    assert len(stand_in.client_ports) == 1
+    assert client.metrics()["latency"]["count"] == 10
+
+
+def test_concurrency_is_limited(stand_in, url):
+    stand_in.delays = [0.2] * 4
+    client = AsyncLLMClient(url, concurrency=2, max_retries=0, hedge_after_in_seconds=0)
+
+    start = time.perf_counter()
+    run(client, *[f"question {i}" for i in range(4)], sequential=False)
+
+    assert time.perf_counter() - start >= 0.4
+    assert len(stand_in.client_ports) == 2
+
+
+def test_5xx_are_retried_with_jittered_backoff(stand_in, url, monkeypatch):
+    stand_in.failures = 2
+    backoffs = list()
+
+    def uniform(low: float, high: float) -> float:
+        backoffs.append((low, high))
+        return 0.0
+
+    monkeypatch.setattr(llm_client.random, "uniform", uniform)
+    client = AsyncLLMClient(
+        url, max_retries=2, backoff_in_seconds=0.01, hedge_after_in_seconds=0
+    )
+
+    assert run(client, "question") == ["answer to question"]
+    assert backoffs == [(0, 0.01), (0, 0.02)]
+    assert client.counters["retries"] == 2
+    assert client.counters["attempts"] == 3
+
+
+def test_timeouts_are_retried(stand_in, url):
+    stand_in.delays = [1.0]
+    client = AsyncLLMClient(
+        url,
+        timeout_in_seconds=0.3,
+        max_retries=1,
+        backoff_in_seconds=0.01,
+        hedge_after_in_seconds=0,
+    )
+
+    assert run(client, "question") == ["answer to question"]
+    assert client.counters["retries"] == 1
+
+
+def test_retries_stop_when_the_budget_runs_out(stand_in, url):
+    stand_in.failures = 10
+    client = AsyncLLMClient(
+        url, max_retries=5, backoff_in_seconds=0.01, hedge_after_in_seconds=0
+    )
+    client.retry_budget = RetryBudget(ratio=0.0, max_tokens=1.0)
+
+    with pytest.raises(ClientResponseError) as error:
+        run(client, "question")
+
+    assert error.value.status == 503
+    assert client.counters["retries"] == 1
+    assert stand_in.requests == 2
+
+
+def test_retry_budget_is_refilled_by_the_calls():
+    budget = RetryBudget(ratio=0.5, max_tokens=1.0)
+
+    assert budget.withdraw()
+    assert not budget.withdraw()
+    budget.deposit()
+    assert not budget.withdraw()
+    budget.deposit()
+    assert budget.withdraw()
+
+
+def test_only_the_last_latencies_are_kept():
+    recorder = LatencyRecorder(max_samples=3)
+    for seconds in range(1, 6):
+        recorder.record(float(seconds))
+
+    summary = recorder.summary()
+
+    assert recorder.count == summary["count"] == 5
+    assert (summary["mean"], summary["p50"], summary["max"]) == (4.0, 4.0, 5.0)
+
+
+def test_slow_calls_are_hedged(stand_in, url):
+    stand_in.delays = [2.0]
+    client = AsyncLLMClient(url, max_retries=0, hedge_after_in_seconds=0.1)
+
+    start = time.perf_counter()
+    assert run(client, "question") == ["answer to question"]
+
+    assert time.perf_counter() - start < 1.0
+    assert client.counters["hedges"] == 1
+    assert stand_in.requests == 2
+
+
+def test_complete_sync_without_a_running_event_loop(stand_in, url):
+    client = AsyncLLMClient(url, max_retries=0, hedge_after_in_seconds=0)
+
+    answers = [client.complete_sync(f"question {i}") for i in range(3)]
+
+    assert answers == [f"answer to question {i}" for i in range(3)]
+    assert len(stand_in.client_ports) == 1
+    asyncio.run_coroutine_threadsafe(client.close(), client._get_loop()).result()
@@ -0,0 +1,112 @@
+import re
+from typing import List
+
+import pytest
+import torch
+from tokenizers import Tokenizer, models, pre_tokenizers
+from transformers import GPT2Config, GPT2LMHeadModel, PreTrainedTokenizerFast, pipeline
+
+from app.consts import DOLLY_END_KEY, DOLLY_INSTRUCTION_FORMAT, PROMPT_FORMAT
+from app.generation.controls import StopSequenceCriteria
+from app.generation.prefix_cache import PROMPT_PREFIX, PrefixCachedLLM
+
+EOS = "<|endoftext|>"
+PROMPT = PROMPT_FORMAT.format(context="merge rows", question="how to merge")
+
+
+def build_pipeline(special_tokens: List[str]):
+    words = re.findall(r"\S+", DOLLY_INSTRUCTION_FORMAT + PROMPT_FORMAT)
+    vocab = {"[UNK]": 0, EOS: 1}
+    for word in words + "merge rows how to leak".split():
+        vocab.setdefault(word, len(vocab))
+    tokenizer = Tokenizer(models.WordLevel(vocab, unk_token="[UNK]"))
+    tokenizer.pre_tokenizer = pre_tokenizers.WhitespaceSplit()
+    tokenizer = PreTrainedTokenizerFast(
+        tokenizer_object=tokenizer,
+        unk_token="[UNK]",
+        eos_token=EOS,
+    )
+    tokenizer.add_special_tokens({"additional_special_tokens": special_tokens})
+    torch.manual_seed(0)
+    model = GPT2LMHeadModel(
+        GPT2Config(vocab_size=len(tokenizer), n_embd=16, n_layer=1, n_head=2)
+    ).eval()
+    return pipeline("text-generation", model=model, tokenizer=tokenizer)
+
+
+def fixed_generate(llm: PrefixCachedLLM, answer: str, calls: List[dict]):
+    def generate(input_ids, **kwargs):
+        calls.append({"input_ids": input_ids, **kwargs})
+        return torch.cat([input_ids, llm._tensor(llm.encode(answer))], dim=1)
+
+    return generate
+
+
+@pytest.fixture
+def dolly() -> PrefixCachedLLM:
+    return PrefixCachedLLM.from_pipeline(
+        build_pipeline([DOLLY_END_KEY]), prefix=PROMPT_PREFIX, max_new_tokens=8
+    )
+
+
+def test_the_dolly_instruction_template_is_applied_with_the_prefix_cache(dolly):
+    input_ids, _, reused = dolly.prefill(PROMPT)
+
+    assert dolly.instruction_format == DOLLY_INSTRUCTION_FORMAT
+    assert input_ids[0].tolist() == dolly.encode(dolly.format_prompt(PROMPT))
+    assert reused == len(dolly.prefix_ids) > len(dolly.encode(PROMPT_PREFIX))
+
+
+def test_the_answer_stops_at_the_dolly_end_key(dolly, monkeypatch):
+    calls = list()
+    monkeypatch.setattr(
+        dolly.model,
+        "generate",
+        fixed_generate(dolly, f"merge rows {DOLLY_END_KEY} Question: leak", calls),
+    )
+
+    assert dolly(PROMPT) == "merge rows"
+    end_token_id = dolly.tokenizer.convert_tokens_to_ids(DOLLY_END_KEY)
+    assert calls[0]["eos_token_id"] == [dolly.tokenizer.eos_token_id, end_token_id]
+    stop_criteria = calls[0]["stopping_criteria"][0]
+    assert stop_criteria.stop_token_ids == {end_token_id}
+
+
+def test_plain_models_generate_from_the_prompt_as_it_is():
+    llm = PrefixCachedLLM.from_pipeline(
+        build_pipeline([]), prefix=PROMPT_PREFIX, max_new_tokens=3
+    )
+    input_ids, _, reused = llm.prefill(PROMPT)
+
+    assert input_ids[0].tolist() == llm.encode(PROMPT)
+    assert reused == len(llm.prefix_ids) > 0
+    assert llm.end_token_ids == list()
+    assert isinstance(llm(PROMPT), str)
+
+
+def test_the_stop_tokens_stop_the_generation_even_accepted_together(dolly):
+    end_token_id = dolly.tokenizer.convert_tokens_to_ids(DOLLY_END_KEY)
+    prompt_ids = dolly.encode(PROMPT)
+    criteria = StopSequenceCriteria(
+        dolly.tokenizer,
+        stop=list(),
+        prompt_length=len(prompt_ids),
+        stop_token_ids=[end_token_id],
+    )
+    merge, rows = dolly.encode("merge rows")
+
+    assert not criteria(torch.tensor([prompt_ids + [merge]]), None)
+    assert criteria(torch.tensor([prompt_ids + [merge, end_token_id, rows]]), None)
+    assert criteria.stopped
+
+
+def test_a_stop_sequence_is_found_in_the_tokens_of_an_assisted_step(dolly):
+    prompt_ids = dolly.encode(PROMPT)
+    criteria = StopSequenceCriteria(
+        dolly.tokenizer, stop=["Question:"], prompt_length=len(prompt_ids)
+    )
+    merge, rows, question = dolly.encode("merge rows Question:")
+
+    assert not criteria(torch.tensor([prompt_ids + [merge]]), None)
+    accepted = [rows, question] + [merge, rows] * 3
+    assert criteria(torch.tensor([prompt_ids + [merge] + accepted]), None)
@@ -0,0 +1,42 @@
+import numpy as np
+import pytest
+from langchain.vectorstores import Chroma
+
+from app.config import get_chroma_settings
+from app.retrieval.shards import DATABRICKS_SHARD, DOCUMENTS_SHARD, shard_directory
+from benchmarks.quantization_recall import main
+
+EMBEDDINGS = np.random.default_rng(0).normal(size=(12, 8)).astype(np.float32)
+
+
+def add_collection(directory: str, rows: range) -> None:
+    db = Chroma(
+        persist_directory=directory, client_settings=get_chroma_settings(directory)
+    )
+    db._collection.add(
+        ids=[str(row) for row in rows],
+        embeddings=EMBEDDINGS[rows].tolist(),
+        documents=[f"chunk {row}" for row in rows],
+    )
+    db.persist()
+
+
+@pytest.mark.parametrize("sharded", [False, True])
+def test_the_recall_is_measured_on_the_given_database(tmp_path, sharded):
+    persist_directory = str(tmp_path / "db")
+    if sharded:
+        add_collection(shard_directory(persist_directory, DOCUMENTS_SHARD), range(6))
+        add_collection(
+            shard_directory(persist_directory, DATABRICKS_SHARD), range(6, 12)
+        )
+    else:
+        add_collection(persist_directory, range(12))
+
+    report = main(
+        ["--persist-directory", persist_directory, "--sample", "12", "--k", "3"]
+        + ["--rescore", "0"]
+    )
+
+    float32 = [result for result in report if result["precision"] == "float32"]
+    assert float32[0]["recall@3"] == 1.0
+    assert float32[0]["bytes"] == EMBEDDINGS.nbytes
@@ -0,0 +1,91 @@
+import asyncio
+import os
+
+import pytest
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+from app.config import config
+from app.retrieval.artifact import STAGING_PREFIX
+from app.retrieval.lexical import LexicalIndex
+from app.retrieval.shards import DATABRICKS_SHARD, DOCUMENTS_SHARD, shard_directory
+from app.stubs import StubEmbeddings
+from data_preparation import ingest_documents
+from data_preparation.ingest_documents import rebuild_shard
+
+
+def split_by_characters(cls, **kwargs) -> RecursiveCharacterTextSplitter:
+    return cls(chunk_size=200, chunk_overlap=0)
+
+
+@pytest.fixture
+def directories(tmp_path, monkeypatch):
+    source_directory = tmp_path / "source_documents"
+    source_directory.mkdir()
+    monkeypatch.setattr(config, "SOURCE_DOCUMENTS_DIRECTORY", str(source_directory))
+    # The embeddings model and the tokenizer of the splitter are downloaded
+    monkeypatch.setattr(
+        ingest_documents, "HuggingFaceEmbeddings", lambda model_name: StubEmbeddings()
+    )
+    monkeypatch.setattr(
+        RecursiveCharacterTextSplitter,
+        "from_tiktoken_encoder",
+        classmethod(split_by_characters),
+    )
+    return source_directory, str(tmp_path / "db"), str(tmp_path / "lexical")
+
+
+def rebuild(persist_directory: str, lexical_directory: str, shard: str) -> None:
+    asyncio.run(
+        rebuild_shard(
+            persist_directory,
+            model_name="stub",
+            shard=shard,
+            lexical_index_directory=lexical_directory,
+        )
+    )
+
+
+def lexical_sources(lexical_directory: str):
+    return sorted(
+        os.path.basename(document.metadata["source"])
+        for document in LexicalIndex.open(lexical_directory).documents.values()
+    )
+
+
+def test_a_failed_rebuild_keeps_the_shard(directories, monkeypatch):
+    source_directory, persist_directory, lexical_directory = directories
+    (source_directory / "vacuum.md").write_text("vacuum removes the old files")
+    rebuild(persist_directory, lexical_directory, DOCUMENTS_SHARD)
+    directory = shard_directory(persist_directory, DOCUMENTS_SHARD)
+    files = sorted(os.listdir(directory))
+    assert "chroma-embeddings.parquet" in files
+
+    async def fail(**kwargs):
+        raise ValueError("The document could not be loaded.")
+
+    monkeypatch.setattr(ingest_documents, "process_documents", fail)
+    with pytest.raises(ValueError):
+        rebuild(persist_directory, lexical_directory, DOCUMENTS_SHARD)
+
+    assert sorted(os.listdir(directory)) == files
+    assert not [
+        name
+        for name in os.listdir(persist_directory)
+        if name.startswith(STAGING_PREFIX)
+    ]
+    assert lexical_sources(lexical_directory) == ["vacuum.md"]
+
+
+def test_the_chunks_of_the_deleted_documents_leave_the_lexical_index(directories):
+    source_directory, persist_directory, lexical_directory = directories
+    (source_directory / "vacuum.md").write_text("vacuum removes the old files")
+    (source_directory / "databricks_jobs.md").write_text("jobs run the notebooks")
+    rebuild(persist_directory, lexical_directory, DOCUMENTS_SHARD)
+    rebuild(persist_directory, lexical_directory, DATABRICKS_SHARD)
+
+    os.remove(source_directory / "vacuum.md")
+    (source_directory / "merge.md").write_text("merge upserts the rows")
+    rebuild(persist_directory, lexical_directory, DOCUMENTS_SHARD)
+
+    assert lexical_sources(lexical_directory) == ["databricks_jobs.md", "merge.md"]
+    assert sorted(os.listdir(persist_directory)) == ["shards"]
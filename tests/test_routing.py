@@ -0,0 +1,86 @@
+from typing import Dict, List, Optional
+
+import pytest
+from langchain.docstore.document import Document
+
+from app.generation.routing import LARGE, SMALL, QuestionRouter
+from app.retrieval.base import ScoredDocuments, VectorIndex
+from app.retrieval.hybrid import HybridRetriever
+from app.retrieval.lexical import LexicalIndex
+from app.stubs import StubEmbeddings
+
+DOCUMENTS = [
+    Document(page_content=text, metadata={"source": f"doc{i}.md"})
+    for i, text in enumerate(
+        [
+            "merge the rows of a source table into a delta table",
+            "vacuum removes the files of a delta table",
+            "the delta log records the commits of a table",
+            "z-order clusters the files of a delta table",
+        ]
+    )
+]
+SIMILARITIES = [0.9, 0.6, 0.55, 0.5]
+
+
+class FixedIndex(VectorIndex):
+    def search(
+        self,
+        embeddings: List[List[float]],
+        k: int,
+        where: Optional[Dict[str, str]] = None,
+    ) -> List[ScoredDocuments]:
+        return [list(zip(DOCUMENTS, SIMILARITIES))[:k] for _ in embeddings]
+
+
+@pytest.fixture
+def retriever() -> HybridRetriever:
+    lexical_index = LexicalIndex()
+    lexical_index.add_documents(DOCUMENTS)
+    return HybridRetriever(StubEmbeddings(), FixedIndex(), lexical_index=lexical_index)
+
+
+def test_hybrid_relevance_scores_are_the_vector_similarities(retriever):
+    scored, relevance = retriever.retrieve_with_relevance("merge a table", k=3)
+
+    assert relevance == SIMILARITIES[:3]
+    assert scored[0][0] is DOCUMENTS[0]
+    assert all(score < 0.05 for _, score in scored)
+
+
+def test_easy_question_goes_to_the_small_model_with_the_hybrid_search(retriever):
+    router = QuestionRouter(hard_keywords=("why",))
+    question = "how do I merge into a table"
+    scored, relevance = retriever.retrieve_with_relevance(question, k=3)
+
+    assert router.route(question, relevance) == (SMALL, "easy")
+    # The fused ranks of chunks found by both searches hardly spread
+    assert router.score_spread([score for _, score in scored]) < router.min_score_spread
+
+
+@pytest.mark.parametrize(
+    "question, scores, reason",
+    [
+        ("how do I merge", [], "no_context"),
+        (" ".join(["word"] * 21), [0.9, 0.5], "long_question"),
+        ("why merge", [0.9, 0.5], "keyword"),
+        ("how do I merge", [0.9, 0.88], "flat_scores"),
+    ],
+)
+def test_hard_questions_go_to_the_large_model(question, scores, reason):
+    router = QuestionRouter(hard_keywords=("why",))
+
+    assert router.route(question, scores) == (LARGE, reason)
+
+
+def test_the_lexical_fast_path_scores_the_chunks_like_the_hybrid_search(retriever):
+    questions = ["merge a table", "z-order"]
+    assert retriever.is_lexical_query(questions[1])
+
+    results = retriever.retrieve_batch(questions, k=2)
+    _, relevance = retriever.retrieve_with_relevance(questions[1], k=2)
+
+    assert results[1] == retriever.retrieve(questions[1], k=2)
+    scores = [score for scored in results for _, score in scored]
+    assert all(0 < score <= 2 / (retriever.rrf_k + 1) for score in scores)
+    assert relevance[0] > 1
@@ -0,0 +1,87 @@
+import json
+
+import numpy as np
+import pytest
+from langchain.docstore.document import Document
+from langchain.vectorstores import Chroma
+
+from app.config import get_chroma_settings
+from app.retrieval.artifact import MetadataColumns
+from app.retrieval.base import ChromaIndex, matches
+from app.retrieval.lexical import LexicalIndex
+
+# The chunk of a.md was kept for its near-duplicate in b.md, removed at the ingestion
+METADATAS = [
+    {"source": "a.md", "sources": json.dumps(["a.md", "b.md"])},
+    {"source": "b.md"},
+    {"source": "c.md"},
+]
+TEXTS = ["vacuum a delta table", "optimize a delta table", "merge into a delta table"]
+EMBEDDINGS = [[1.0, 0.0, 0.0], [0.0, 1.0, 0.0], [0.0, 0.0, 1.0]]
+
+
+@pytest.mark.parametrize(
+    "where, expected",
+    [
+        ({"source": "a.md"}, [0]),
+        ({"source": "b.md"}, [0, 1]),
+        ({"source": ["b.md", "c.md"]}, [0, 1, 2]),
+        ({"source": "d.md"}, []),
+    ],
+)
+def test_the_source_matches_the_sources_of_the_removed_duplicates(where, expected):
+    assert [
+        row for row, metadata in enumerate(METADATAS) if matches(metadata, where)
+    ] == expected
+    assert list(np.flatnonzero(columns().mask(where))) == expected
+
+
+def columns() -> MetadataColumns:
+    lookups = [dict(), dict()]
+    codes = np.full((len(METADATAS), 2), -1, dtype=np.int32)
+    for row, metadata in enumerate(METADATAS):
+        for position, key in enumerate(("source", "sources")):
+            if key in metadata:
+                codes[row, position] = lookups[position].setdefault(
+                    metadata[key], len(lookups[position])
+                )
+    return MetadataColumns(
+        ["source", "sources"], [list(lookup) for lookup in lookups], codes
+    )
+
+
+def test_lexical_search_keeps_the_chunks_of_the_removed_duplicates():
+    lexical_index = LexicalIndex()
+    lexical_index.add_documents(
+        Document(page_content=text, metadata=metadata)
+        for text, metadata in zip(TEXTS, METADATAS)
+    )
+
+    results = lexical_index.search("delta table", k=3, where={"source": "b.md"})
+
+    assert sorted(document.page_content for document, _ in results) == sorted(TEXTS[:2])
+
+
+def test_chroma_search_keeps_the_chunks_of_the_removed_duplicates(tmp_path):
+    directory = str(tmp_path)
+    db = Chroma(
+        persist_directory=directory, client_settings=get_chroma_settings(directory)
+    )
+    db._collection.add(
+        ids=[str(row) for row in range(len(TEXTS))],
+        embeddings=EMBEDDINGS,
+        documents=TEXTS,
+        metadatas=METADATAS,
+    )
+    index = ChromaIndex(db)
+
+    def search(where):
+        return sorted(
+            document.page_content
+            for document, _ in index.search_by_vector([1.0, 1.0, 0.0], k=3, where=where)
+        )
+
+    assert search({"source": "b.md"}) == sorted(TEXTS[:2])
+    assert search({"source": ["a.md", "b.md"]}) == sorted(TEXTS[:2])
+    assert search({"source": "c.md"}) == TEXTS[2:]
+    assert index.merged_sources() == [METADATAS[0]["sources"]]
@@ -0,0 +1,70 @@
+import asyncio
+from typing import Dict, List, Optional
+
+import pytest
+from langchain.docstore.document import Document
+
+from app import main
+from app.chatbot import ChatBot
+from app.models import SearchInput, SearchResults
+from app.retrieval.base import ScoredDocuments, VectorIndex
+from app.retrieval.hot_swap import IndexGeneration, IndexHolder
+from app.retrieval.hybrid import HybridRetriever
+from app.retrieval.lexical import LexicalIndex
+from app.stubs import StubEmbeddings
+
+# The lexical ranking of the chunks differs from their vector ranking
+DOCUMENTS = [
+    Document(
+        page_content=" ".join(["delta"] * (1 + row % 7) + [f"chunk{row}"] * 3),
+        metadata={"source": f"doc{row}.md"},
+    )
+    for row in range(120)
+]
+
+
+class FixedIndex(VectorIndex):
+    def search(
+        self,
+        embeddings: List[List[float]],
+        k: int,
+        where: Optional[Dict[str, str]] = None,
+    ) -> List[ScoredDocuments]:
+        ranking = [(document, 1 - row / 1000) for row, document in enumerate(DOCUMENTS)]
+        return [ranking[:k] for _ in embeddings]
+
+
+def search(offset: int, limit: int) -> SearchResults:
+    search_input = SearchInput(query="delta table", offset=offset, limit=limit)
+    return asyncio.run(main.search(search_input))
+
+
+@pytest.fixture(autouse=True)
+def chat_bot(monkeypatch) -> ChatBot:
+    lexical_index = LexicalIndex()
+    lexical_index.add_documents(DOCUMENTS)
+    retriever = HybridRetriever(
+        StubEmbeddings(), FixedIndex(), lexical_index=lexical_index, candidates=20
+    )
+    chat_bot = ChatBot.__new__(ChatBot)
+    chat_bot.index_holder = IndexHolder(
+        IndexGeneration(version="v1", retriever=retriever), loader=lambda _: None
+    )
+    monkeypatch.setattr(main, "chat_bot", chat_bot)
+    return chat_bot
+
+
+def test_consecutive_pages_neither_overlap_nor_skip():
+    pages = [search(offset, 10) for offset in range(0, 40, 10)]
+
+    texts = [hit.text for page in pages for hit in page.hits]
+    assert len(set(texts)) == 40
+    assert texts == [hit.text for hit in search(0, 40).hits]
+    assert [page.next_offset for page in pages] == [10, 20, 30, 40]
+
+
+def test_the_last_page_ends_at_the_maximum_results():
+    page = search(90, 10)
+
+    assert len(page.hits) == 10
+    assert page.next_offset is None